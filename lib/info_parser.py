@@ -1,8 +1,11 @@
+import functools
+
 from lib.llvm_instr import *
 from lib import utils
+from lib.overlay import resolve_desc
 
 
-def parse_llvm_instr_info(instr_info, target_cpu):
+def parse_llvm_instr_info(instr_info, target_cpu, layers=()):
     def scan_schedwrite(write_desc):
         write_type = write_desc['Type']
         if write_type == 'SchedWrite' or write_type == 'X86FoldableSchedWrite':
@@ -20,6 +23,7 @@ def parse_llvm_instr_info(instr_info, target_cpu):
 
     llvm_instrs = []
     for opcode, desc in instr_info.items():
+        desc = resolve_desc(opcode, desc, layers)
         schedreads, schedwrites = [], []
         for read_desc in desc['SchedReads']:
             assert read_desc['Type'] == 'SchedRead', 'Unknown schedread type'
@@ -38,42 +42,47 @@ def parse_llvm_instr_info(instr_info, target_cpu):
                            Port(pn) in target_cpu.all_ports for pn in item[1]),\
                        f'Found invalid port in {item[1]}'
                 uops.extend([uop] * item[0])
+                target_cpu.register_ports(uop.ports)
             num_uops = desc.get('Uops', len(uops))
             llvm_instr.set_uops_info(
                 UopsInfo(latency, throughput, uops, num_uops))
+            llvm_instr.set_op_latency(desc.get('OpLatency', None))
         llvm_instrs.append(llvm_instr)
     return llvm_instrs
 
 
-def infer_res(resources, resource_cycles):
-    class Node:
-        def __init__(self, res, cycs):
-            self.res = res
-            self.cycs = cycs
-            self.next = []
-
-    nodes = [
-        Node(res, cycles) for res, cycles in zip(resources, resource_cycles)
-    ]
-    for node in nodes:
-        for other in nodes:
-            if other != node and utils.listcontain(other.res, node.res):
-                node.next.append(other)
-    nodes.sort(key=lambda x: len(x.next), reverse=True)
-    for node in nodes:
-        if node.cycs > 0:
-            for next_node in node.next:
-                assert next_node.cycs > 0
-                next_node.cycs -= node.cycs
+@functools.lru_cache(maxsize=None)
+def infer_res_cached(resources, resource_cycles):
+    '''
+    Subtract cycles of each resource from its supersets. resources are
+    represented as port bitmasks, and they are visited in descending number of
+    supersets which is a topological order of the containment DAG (a strict
+    subset always has more supersets than its superset).
+    '''
+    masks = [Port.mask(res) for res in resources]
+    cycs = list(resource_cycles)
+    supersets = [[
+        j for j, other in enumerate(masks) if j != i and other & mask == mask
+    ] for i, mask in enumerate(masks)]
+    order = sorted(range(len(masks)), key=lambda i: len(supersets[i]),
+                   reverse=True)
+    for i in order:
+        if cycs[i] > 0:
+            for j in supersets[i]:
+                assert cycs[j] > 0
+                cycs[j] -= cycs[i]
 
-    leaf_res, leaf_res_cycs = [], []
-    for node in nodes:
-        if node.cycs > 0:
-            leaf_res.append(node.res)
-            leaf_res_cycs.append(node.cycs)
+    leaf_res = tuple(resources[i] for i in order if cycs[i] > 0)
+    leaf_res_cycs = tuple(cycs[i] for i in order if cycs[i] > 0)
     return leaf_res, leaf_res_cycs
 
 
+def infer_res(resources, resource_cycles):
+    leaf_res, leaf_res_cycs = infer_res_cached(tuple(resources),
+                                               tuple(resource_cycles))
+    return list(leaf_res), list(leaf_res_cycs)
+
+
 def parse_smv_instr_info(instr_info, target_cpu):
     smv_instrs = []
     for opcode, desc in instr_info.items():
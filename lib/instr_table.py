@@ -0,0 +1,113 @@
+import collections
+from array import array
+
+
+class InstrTable:
+    '''
+    Measured latency, num_uops and ports of llvm instrs, built once after
+    parsing. Port lists are interned as signatures (sorted tuple of port
+    groups) so that comparing two port lists is an int compare, and removing
+    a port list from a signature is memoized. Latency, num_uops and
+    signature columns are int arrays (UopsInfo asserts latency is an int),
+    so comparing whole columns runs in C. Per-row checks that depend on
+    schedwrites of each instruction are still Python loops.
+    '''
+    def __init__(self, llvm_instrs):
+        self.llvm_instrs = [x for x in llvm_instrs if x.has_uops_info()]
+        self.rows = {x.opcode: i for i, x in enumerate(self.llvm_instrs)}
+        self.signatures, self.sig_resources, self.sig_counts = {}, [], []
+        self.removed = {}
+
+        uops_infos = [x.uops_info for x in self.llvm_instrs]
+        self.latency = array('i', (x.latency for x in uops_infos))
+        self.num_uops = array('i', (x.num_uops for x in uops_infos))
+        self.port_sig = array('i', (self.intern(x.ports) for x in uops_infos))
+
+    def intern(self, resources):
+        ''' Return signature id of port list resources.  '''
+        sig = tuple(sorted(resources))
+        sig_id = self.signatures.get(sig)
+        if sig_id is None:
+            sig_id = self.signatures[sig] = len(self.sig_resources)
+            self.sig_resources.append(sig)
+            self.sig_counts.append(collections.Counter(sig))
+        return sig_id
+
+    def remove(self, sig_id, resources):
+        ''' Signature id of "signature - resources", None if not contained. '''
+        key = (sig_id, tuple(resources))
+        if key not in self.removed:
+            counts = self.sig_counts[sig_id].copy()
+            counts.subtract(resources)
+            self.removed[key] = None if any(
+                x < 0 for x in counts.values()) else self.intern(
+                    counts.elements())
+        return self.removed[key]
+
+    def row(self, llvm_instr):
+        return self.rows.get(llvm_instr.opcode)
+
+    def incompatible_aux_schedwrites(self):
+        '''
+        Return {row: [aux schedwrite, ...]} of aux schedwrites that don't fit
+        measured latency, num_uops or ports of instruction.
+        '''
+        result = {}
+        for row, llvm_instr in enumerate(self.llvm_instrs):
+            for schedwrite in llvm_instr.schedwrites:
+                if not schedwrite.is_aux():
+                    continue
+                assert schedwrite.is_complete()
+                if (schedwrite.latency > self.latency[row]
+                        or schedwrite.num_uops > self.num_uops[row]
+                        or self.remove(self.port_sig[row],
+                                       schedwrite.resources) is None):
+                    result.setdefault(row, []).append(schedwrite)
+        return result
+
+    def tally_candidates(self, schedwrite, llvm_instrs):
+        '''
+        Count (latency, num_uops, port signature) left for schedwrite by
+        each of llvm_instrs after removing its other (aux) schedwrites.
+        '''
+        tally = collections.Counter()
+        for llvm_instr in llvm_instrs:
+            row = self.row(llvm_instr)
+            if row is None:
+                continue
+            num_uops, sig = self.num_uops[row], self.port_sig[row]
+            for instr_sw in llvm_instr.schedwrites:
+                if instr_sw == schedwrite:
+                    continue
+                assert instr_sw.is_complete() and instr_sw.is_aux(), \
+                    f'[{schedwrite}, {instr_sw}] only 1 incompleted ' \
+                    f'schedwrite is allowed.'
+                num_uops -= instr_sw.num_uops
+                sig = self.remove(sig, instr_sw.resources)
+                assert sig is not None
+            tally[(self.latency[row], num_uops, sig)] += 1
+        return tally
+
+    def model_columns(self):
+        ''' latency, num_uops and port signature columns of current model. '''
+        latency, num_uops, port_sig = array('i'), array('i'), array('i')
+        for llvm_instr in self.llvm_instrs:
+            latency.append(llvm_instr.compute_latency())
+            num_uops.append(llvm_instr.compute_num_uops())
+            port_sig.append(self.intern(llvm_instr.compute_resources()))
+        return latency, num_uops, port_sig
+
+    def mismatched_rows(self):
+        '''
+        Rows whose model differs from measured latency/num_uops/ports. Each
+        pair of columns is compared at once, rows are only searched in
+        columns that differ.
+        '''
+        rows = set()
+        for measured, model in zip((self.latency, self.num_uops, self.port_sig),
+                                   self.model_columns()):
+            if measured != model:
+                rows.update(row
+                            for row, (x, y) in enumerate(zip(measured, model))
+                            if x != y)
+        return sorted(rows)
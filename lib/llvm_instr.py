@@ -1,4 +1,4 @@
-import re
+import re, unittest
 
 try:
     import utils
@@ -11,9 +11,13 @@ class Singleton(type):
 	Each subclass should implement get_key static method to hash a uniq id
 	for args passed to init and shouldn't use _instances as attr.
     '''
+    # All classes created by this metaclass, in creation order.
+    classes = []
+
     def __new__(meta_cls, class_name, base_classes, attrs):
         attrs['_instances'] = {}
         cls = super().__new__(meta_cls, class_name, base_classes, attrs)
+        Singleton.classes.append(cls)
 
         # Create get static method for all subclasses.
         def get(*args, **kwargs):
@@ -29,6 +33,18 @@ class Singleton(type):
             cls._instances[key] = super().__call__(*arg, **kwargs)
         return cls._instances[key]
 
+    @staticmethod
+    def get_registries():
+        ''' Return instances of all singleton classes keyed by class. '''
+        return {cls: cls._instances for cls in Singleton.classes}
+
+    @staticmethod
+    def set_registries(registries):
+        ''' Replace instances of singleton classes with given registries. '''
+        for cls, instances in registries.items():
+            cls._instances.clear()
+            cls._instances.update(instances)
+
 
 class ReadOnly:
     def __set_name__(self, owner, name):
@@ -46,6 +62,8 @@ class Resource(metaclass=Singleton):
 
 
 class Port(Resource):
+    number = ReadOnly()
+
     def __init__(self, number):
         assert isinstance(number, int), 'Expect int type'
         self._number = number
@@ -67,6 +85,14 @@ class Port(Resource):
     def gets(nums):
         return tuple(Port(num) for num in nums)
 
+    @staticmethod
+    def mask(ports):
+        ''' Bitmask of ports. INVALID_PORT takes bit 0. '''
+        mask = 0
+        for port in ports:
+            mask |= 1 << (port.number + 1)
+        return mask
+
     class GetInvalidPort:
         def __get__(self, obj, objtype=None):
             assert objtype is Port
@@ -75,6 +101,26 @@ class Port(Resource):
     INVALID_PORT = GetInvalidPort()
 
 
+class IsaSet(metaclass=Singleton):
+    ''' Interned xed ISA_SET name, id is its bit in TargetCPU.isa_mask.  '''
+    name = ReadOnly()
+    id = ReadOnly()
+
+    def __init__(self, name):
+        self._name = name
+        self._id = len(IsaSet._instances)
+
+    @staticmethod
+    def get_key(name):
+        return name
+
+    def __str__(self):
+        return self._name
+
+    def __repr__(self):
+        return self.__str__()
+
+
 class Uop:
     ''' Port, latency and throughput info for micro-op '''
     def __init__(self, ports, latency=None, throughput=None):
@@ -249,6 +295,13 @@ class WriteSequence(SchedWrite):
             resources.extend(leaf_write.resources)
         return tuple(resources)
 
+    @property
+    def resource_cycles(self):
+        resource_cycles = []
+        for leaf_write in self.expand():
+            resource_cycles.extend(leaf_write.resource_cycles)
+        return tuple(resource_cycles)
+
     def expand(self):
         '''
         Expand WriteSequence to leaf schedwrites.
@@ -294,6 +347,23 @@ class SchedWriteRes(SchedWrite):
     def get_key(resources, resource_cycles, latency, num_uops, prefix):
         return (resources, resource_cycles, latency, num_uops)
 
+    @staticmethod
+    def renumber():
+        '''
+        Number SchedWriteRes in order of their resources, cycles, latency and
+        num_uops so that names don't depend on creation order.
+        '''
+        def signature(schedwriteres):
+            return (tuple(
+                tuple(int(str(port)) for port in res)
+                for res in schedwriteres.resources),
+                    schedwriteres.resource_cycles, schedwriteres.latency,
+                    schedwriteres.num_uops)
+
+        for idx, schedwriteres in enumerate(
+                sorted(SchedWriteRes._instances.values(), key=signature)):
+            schedwriteres.name = re.sub(r'\d+$', str(idx), schedwriteres.name)
+
     def __lt__(self, other):
         if type(other) is not type(self):
             return super().__lt__(other)
@@ -307,6 +377,10 @@ class SchedWriteRes(SchedWrite):
 class SchedRead(metaclass=Singleton):
     def __init__(self, name: str):
         self.name = name
+        self.advance = None
+
+    def set_advance(self, advance):
+        self.advance = advance
 
     @staticmethod
     def get_key(name):
@@ -319,6 +393,18 @@ class SchedRead(metaclass=Singleton):
         return self.__str__()
 
 
+class SchedReadAdvance(SchedRead):
+    ''' Anonymous ReadAdvance used by InstRW of instructions.  '''
+    def __init__(self, advance, prefix=''):
+        # prefix will be ignored if SchedReadAdvance with same advance existed.
+        super().__init__(f'{prefix}ReadAdvance{advance}')
+        self.advance = advance
+
+    @staticmethod
+    def get_key(advance, prefix=''):
+        return advance
+
+
 class LLVMInstr:
     ''' Instruction defined in td file '''
     def __init__(self, opcode, schedreads, schedwrites, isa_set):
@@ -326,11 +412,17 @@ class LLVMInstr:
         self.schedreads = schedreads
         self.schedwrites = schedwrites
         self.isa_set = isa_set
+        self.isa_id = IsaSet(isa_set).id if isa_set is not None else None
         self._use_instrw = False
+        self.op_latency = None
 
     def set_uops_info(self, uops_info):
         self.uops_info = uops_info
 
+    def set_op_latency(self, op_latency):
+        ''' op_latency is [[start operand, target operand, kind, cycles], ...].'''
+        self.op_latency = op_latency
+
     def set_use_instrw(self, value):
         self._use_instrw = value
 
@@ -341,8 +433,8 @@ class LLVMInstr:
         return hasattr(self, 'uops_info')
 
     def is_invalid(self, target_cpu):
-        return (self.isa_set is not None
-                and self.isa_set not in target_cpu.valid_isa_set)
+        return (self.isa_id is not None
+                and not target_cpu.isa_mask >> self.isa_id & 1)
 
     def replace_or_add_schedrw(self,
                                old_schedrw,
@@ -356,6 +448,33 @@ class LLVMInstr:
         else:
             schedrws[schedrws.index(old_schedrw)] = new_schedrw
 
+    def compute_read_advances(self):
+        '''
+        Return {index of schedread: advance}. Advance of a register source
+        operand is the cycles after issue it is needed, i.e. latency minus the
+        max latency from that operand. Register source operands (REG0, REG1,
+        ...) map in order to schedreads other than ReadDefault, memory and
+        address operands are read by ReadDefault and aren't infered. None if
+        per-operand latency isn't known or operands don't map one to one.
+        '''
+        if not self.op_latency or not self.has_uops_info():
+            return None
+        op_cycles = {}
+        for start, _, kind, cycles in self.op_latency:
+            if kind == 'cycles' and re.match(r'^REG\d+$', start):
+                op_cycles[start] = max(op_cycles.get(start, 0), cycles)
+        indexes = [
+            idx for idx, schedread in enumerate(self.schedreads)
+            if schedread.name != 'ReadDefault'
+        ]
+        if not op_cycles or len(op_cycles) != len(indexes):
+            return None
+        operands = sorted(op_cycles, key=lambda x: int(x[3:]))
+        return {
+            idx: max(self.uops_info.latency - op_cycles[operand], 0)
+            for idx, operand in zip(indexes, operands)
+        }
+
     def compute_latency(self):
         return max(schedwrite.latency for schedwrite in self.schedwrites)
 
@@ -368,6 +487,12 @@ class LLVMInstr:
             resources.extend(schedwrite.resources)
         return tuple(resources)
 
+    def compute_resource_cycles(self):
+        resource_cycles = []
+        for schedwrite in self.schedwrites:
+            resource_cycles.extend(schedwrite.resource_cycles)
+        return tuple(resource_cycles)
+
     def __repr__(self):
         return (f'{self.opcode}:\n'
                 f'  schedreads  = {self.schedreads}\n'
@@ -397,3 +522,61 @@ class SMVInstr:
                 f'  throughput      = {self.throughput}\n'
                 f'  resources       = {self.resources}\n'
                 f'  resource_cycles = {self.resource_cycles}\n')
+
+
+if __name__ == '__main__':
+
+    class LLVMInstrChecker(unittest.TestCase):
+        def test_compute_read_advances(self):
+            # FMA-like: accumulator REG0 is needed 4 cycles after issue,
+            # REG1 right away, address registers are ReadDefault.
+            llvm_instr = LLVMInstr('TESTFMArm', [
+                SchedRead('TestReadAfterFold'),
+                SchedRead('ReadDefault'),
+                SchedRead('TestReadAfterFold')
+            ], [], None)
+            self.assertEqual(llvm_instr.compute_read_advances(), None)
+            llvm_instr.set_uops_info(UopsInfo(9, 0.5, [], 2))
+            llvm_instr.set_op_latency([['REG1', 'REG0', 'cycles', 9],
+                                       ['REG0', 'REG0', 'cycles', 5],
+                                       ['MEM0', 'REG0', 'cycles_mem', 9],
+                                       ['MEM0', 'REG0', 'cycles_addr', 9]])
+            self.assertEqual(llvm_instr.compute_read_advances(), {
+                0: 4,
+                2: 0
+            })
+
+            # Operands can't be mapped if counts differ.
+            llvm_instr.set_op_latency([['REG0', 'REG0', 'cycles', 5]])
+            self.assertEqual(llvm_instr.compute_read_advances(), None)
+
+        def test_renumber(self):
+            # Names only depend on the defs, whatever order they are created
+            # in, e.g. the order pool workers return components.
+            defs = [((Port.gets((0, 1)), ), (1, ), 3, 1),
+                    ((Port.gets((0, )), Port.gets((5, ))), (1, 2), 4, 2),
+                    ((Port.gets((0, )), ), (4, ), 11, 1),
+                    ((Port.gets((0, )), ), (1, ), 11, 1)]
+            saved = dict(SchedWriteRes._instances)
+            names = []
+            try:
+                for order in (defs, defs[::-1], defs[1:] + defs[:1]):
+                    SchedWriteRes._instances.clear()
+                    for resources, cycles, latency, num_uops in order:
+                        SchedWriteRes(resources, cycles, latency, num_uops,
+                                      'TEST')
+                    SchedWriteRes.renumber()
+                    names.append([
+                        SchedWriteRes.get(*x, 'TEST').name for x in defs
+                    ])
+            finally:
+                SchedWriteRes._instances.clear()
+                SchedWriteRes._instances.update(saved)
+            self.assertEqual(names[0], [
+                'TESTWriteResGroup3', 'TESTWriteResGroup2',
+                'TESTWriteResGroup1', 'TESTWriteResGroup0'
+            ])
+            self.assertEqual(names[1], names[0])
+            self.assertEqual(names[2], names[0])
+
+    unittest.main()
@@ -0,0 +1,61 @@
+import json
+
+# Fields of uops info provided by each source.
+UOPS_INFO_FIELDS = ('Port', 'Uops', 'Tp', 'Latency', 'OpLatency')
+
+
+def add_layer_argument(parser):
+    ''' Add --layer option to parser.  '''
+    parser.add_argument(
+        '--layer',
+        action='append',
+        default=[],
+        help='uops info layer file written by an importer with --layer-out, '
+        'earlier layers take precedence')
+
+
+def merge_uops_info(info, source, uops_info, overwrite=False):
+    '''
+    Merge uops_info of source into instruction info. A field is only taken
+    if info doesn't have it yet (or overwrite is set) and is stamped with
+    "<field>Sig". If Port is taken from source, Uops must come from it too.
+    '''
+    for key, value in uops_info.items():
+        if overwrite or key not in info:
+            info[key] = value
+            assert info.get(f'{key}Sig', None) != source
+            info[f'{key}Sig'] = source
+    # if port is updated then uops must be consistent with port.
+    if info.get('PortSig') == source and 'Uops' in uops_info:
+        info['Uops'] = uops_info['Uops']
+        info['UopsSig'] = source
+
+
+def dump_layer(path, source, entries):
+    ''' Write uops info of one source as a layer keyed by opcode.  '''
+    with open(path, 'w') as f:
+        json.dump({'source': source, 'entries': entries}, f, indent=2)
+
+
+def load_layer(path):
+    with open(path) as f:
+        layer = json.load(f)
+    assert set(layer) == {'source', 'entries'}, f'{path} is not a layer file'
+    return layer
+
+
+def resolve_desc(opcode, desc, layers):
+    '''
+    Return desc of opcode with fields of layers merged in. layers come in
+    precedence order and fields already in desc take precedence over all
+    layers. desc itself is not modified.
+    '''
+    if 'XedInfo' not in desc or not any(opcode in layer['entries']
+                                        for layer in layers):
+        return desc
+    desc = dict(desc)
+    for layer in layers:
+        uops_info = layer['entries'].get(opcode)
+        if uops_info is not None:
+            merge_uops_info(desc, layer['source'], uops_info)
+    return desc
@@ -0,0 +1,307 @@
+import asyncio, bisect, heapq, os, subprocess, sys, threading, time, unittest
+from concurrent.futures import ThreadPoolExecutor
+
+# Upper bounds (seconds) of latency histogram buckets.
+LATENCY_BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1,
+                   2, 5, 10, 30, 60)
+
+_jobs = os.cpu_count()
+_timeout = None
+_retries = 0
+_semaphore = threading.BoundedSemaphore(_jobs)
+_limiters = {}
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def add_arguments(parser):
+    ''' Add --jobs, --timeout and --retries options of runner to parser.  '''
+    parser.add_argument('--jobs',
+                        type=int,
+                        help='max number of concurrent external tool '
+                        'processes, default to number of cpus')
+    parser.add_argument('--timeout',
+                        type=float,
+                        help='kill an external tool call after this many '
+                        'seconds')
+    parser.add_argument('--retries',
+                        type=int,
+                        default=0,
+                        help='retry a timed out external tool call this many '
+                        'times')
+
+
+def configure(jobs=None, timeout=None, retries=0):
+    ''' Set global limits, must be called before any run.  '''
+    global _jobs, _timeout, _retries, _semaphore
+    _jobs = jobs or os.cpu_count()
+    _timeout = timeout
+    _retries = retries
+    _semaphore = threading.BoundedSemaphore(_jobs)
+    _limiters.clear()
+
+
+def configure_from_args(args):
+    configure(args.jobs, args.timeout, args.retries)
+
+
+def jobs():
+    return _jobs
+
+
+def retries():
+    return _retries
+
+
+class ToolStats:
+    ''' Invocation counts and latency histogram of one tool.  '''
+    def __init__(self):
+        self.calls = 0
+        self.failed = 0
+        self.timed_out = 0
+        self.retried = 0
+        self.seconds = 0
+        self.histogram = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def add(self, seconds, returncode):
+        self.calls += 1
+        self.seconds += seconds
+        self.histogram[bisect.bisect_right(LATENCY_BUCKETS, seconds)] += 1
+        if returncode is None:
+            self.timed_out += 1
+        elif returncode != 0:
+            self.failed += 1
+
+
+def _record(cmd, seconds, returncode, retry):
+    tool = os.path.basename(cmd[0])
+    with _stats_lock:
+        stats = _stats.setdefault(tool, ToolStats())
+        stats.add(seconds, returncode)
+        if retry:
+            stats.retried += 1
+
+
+def record_failure(cmd):
+    ''' Count a call that exited with 0 but whose output is unusable.  '''
+    with _stats_lock:
+        _stats.setdefault(os.path.basename(cmd[0]), ToolStats()).failed += 1
+
+
+def _check(cmd, result, check):
+    if check and result.returncode != 0:
+        raise subprocess.CalledProcessError(result.returncode, cmd,
+                                            result.stdout, result.stderr)
+    return result
+
+
+def run(cmd, input=None, timeout=None, retries=None, check=False):
+    '''
+    Run cmd (argv list, no shell) with input bytes or str fed to stdin and
+    return CompletedProcess with stdout and stderr bytes, its seconds is the
+    time the call ran. At most jobs calls run at a time over all threads. A
+    call running longer than timeout (default --timeout) is killed and
+    retried up to retries (default --retries) times, then
+    subprocess.TimeoutExpired is raised.
+    '''
+    timeout = _timeout if timeout is None else timeout
+    retries = _retries if retries is None else retries
+    if isinstance(input, str):
+        input = input.encode('utf-8')
+    for retry in range(retries + 1):
+        with _semaphore:
+            start = time.monotonic()
+            try:
+                result = subprocess.run(cmd,
+                                        input=input,
+                                        stdout=subprocess.PIPE,
+                                        stderr=subprocess.PIPE,
+                                        timeout=timeout)
+            except subprocess.TimeoutExpired:
+                _record(cmd, time.monotonic() - start, None, retry)
+                if retry == retries:
+                    raise
+                continue
+        result.seconds = time.monotonic() - start
+        _record(cmd, result.seconds, result.returncode, retry)
+        return _check(cmd, result, check)
+
+
+def map_threads(func, iterable):
+    '''
+    Map func over iterable in jobs threads. Use it instead of a process Pool
+    when func mostly waits on run, so that stats stay in this process.
+    '''
+    with ThreadPoolExecutor(max_workers=_jobs) as executor:
+        return list(executor.map(func, iterable))
+
+
+class PriorityLimiter:
+    '''
+    Allow at most limit holders at a time. Waiters are woken in order of
+    their rank, lower first, then in order of arrival.
+    '''
+    def __init__(self, limit):
+        self.free = limit
+        self.waiters = []
+        self.seq = 0
+
+    async def acquire(self, rank):
+        if self.free > 0 and not self.waiters:
+            self.free -= 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiters, (rank, self.seq, future))
+        self.seq += 1
+        await future
+
+    def release(self):
+        if self.waiters:
+            heapq.heappop(self.waiters)[2].set_result(None)
+        else:
+            self.free += 1
+
+
+def _limiter():
+    loop = asyncio.get_running_loop()
+    if loop not in _limiters:
+        _limiters[loop] = PriorityLimiter(_jobs)
+    return _limiters[loop]
+
+
+async def run_async(cmd,
+                    input=None,
+                    timeout=None,
+                    retries=None,
+                    check=False,
+                    rank=0):
+    '''
+    Coroutine version of run. At most jobs calls of the event loop run at a
+    time, waiting calls of lower rank go first.
+    '''
+    timeout = _timeout if timeout is None else timeout
+    retries = _retries if retries is None else retries
+    if isinstance(input, str):
+        input = input.encode('utf-8')
+    limiter = _limiter()
+    for retry in range(retries + 1):
+        await limiter.acquire(rank)
+        try:
+            start = time.monotonic()
+            proc = await asyncio.create_subprocess_exec(
+                *cmd,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE)
+            try:
+                stdout, stderr = await asyncio.wait_for(
+                    proc.communicate(input), timeout)
+            except asyncio.TimeoutError:
+                proc.kill()
+                await proc.wait()
+                _record(cmd, time.monotonic() - start, None, retry)
+                if retry == retries:
+                    raise subprocess.TimeoutExpired(cmd, timeout)
+                continue
+        finally:
+            limiter.release()
+        result = subprocess.CompletedProcess(cmd, proc.returncode, stdout,
+                                             stderr)
+        result.seconds = time.monotonic() - start
+        _record(cmd, result.seconds, result.returncode, retry)
+        return _check(cmd, result, check)
+
+
+def format_seconds(seconds):
+    return f'{seconds * 1000:g}ms' if seconds < 1 else f'{seconds:g}s'
+
+
+def print_stats(ostream=sys.stderr):
+    ''' Print invocation counts and latency histogram of each tool.  '''
+    for tool, stats in sorted(_stats.items()):
+        print(f'{tool}: {stats.calls} calls, {stats.failed} failed, '
+              f'{stats.timed_out} timed out, {stats.retried} retried, '
+              f'{stats.seconds:.2f}s total',
+              file=ostream)
+        bounds = [f'<{format_seconds(x)}' for x in LATENCY_BUCKETS]
+        bounds.append(f'>={format_seconds(LATENCY_BUCKETS[-1])}')
+        print('  ' + ', '.join(f'{bound}: {count}' for bound, count in zip(
+            bounds, stats.histogram) if count),
+              file=ostream)
+
+
+if __name__ == '__main__':
+    SLEEP = [sys.executable, '-c', 'import time; time.sleep(10)']
+    FAIL = [sys.executable, '-c', 'import sys; sys.exit(3)']
+    ECHO = [sys.executable, '-c', 'import sys; print(sys.stdin.read())']
+
+    class RunnerChecker(unittest.TestCase):
+        def setUp(self):
+            configure(jobs=2)
+            _stats.clear()
+
+        def stats(self):
+            return _stats[os.path.basename(sys.executable)]
+
+        def test_run(self):
+            result = run(ECHO, input='hello')
+            self.assertEqual(result.stdout.strip(), b'hello')
+            self.assertGreaterEqual(result.seconds, 0)
+            self.assertEqual(run(FAIL).returncode, 3)
+            with self.assertRaises(subprocess.CalledProcessError):
+                run(FAIL, check=True)
+            self.assertEqual((self.stats().calls, self.stats().failed),
+                             (3, 2))
+
+        def test_retry_timeout(self):
+            # A call timing out is retried, then TimeoutExpired is raised.
+            with self.assertRaises(subprocess.TimeoutExpired):
+                run(SLEEP, timeout=0.2, retries=1)
+            stats = self.stats()
+            self.assertEqual((stats.calls, stats.timed_out, stats.retried),
+                             (2, 2, 1))
+
+        def test_configured_timeout(self):
+            configure(jobs=2, timeout=0.2, retries=2)
+            self.assertEqual(retries(), 2)
+            with self.assertRaises(subprocess.TimeoutExpired):
+                asyncio.run(run_async(SLEEP))
+            stats = self.stats()
+            self.assertEqual((stats.calls, stats.timed_out, stats.retried),
+                             (3, 3, 2))
+
+        def test_run_async(self):
+            async def run_all():
+                return await asyncio.gather(
+                    run_async(ECHO, input='a', rank=1),
+                    run_async(FAIL, rank=0))
+
+            echo, fail = asyncio.run(run_all())
+            self.assertEqual(echo.stdout.strip(), b'a')
+            self.assertEqual(fail.returncode, 3)
+
+        def test_priority_limiter(self):
+            # Waiters are woken by rank, then by arrival.
+            order = []
+
+            async def hold(limiter, name, rank):
+                await limiter.acquire(rank)
+                order.append(name)
+                await asyncio.sleep(0)
+                limiter.release()
+
+            async def run_all():
+                limiter = PriorityLimiter(1)
+                await limiter.acquire(0)
+                tasks = [
+                    asyncio.ensure_future(hold(limiter, name, rank))
+                    for name, rank in (('a', 2), ('b', 1), ('c', 2))
+                ]
+                await asyncio.sleep(0)
+                limiter.release()
+                await asyncio.gather(*tasks)
+
+            asyncio.run(run_all())
+            self.assertEqual(order, ['b', 'a', 'c'])
+
+    unittest.main()
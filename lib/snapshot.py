@@ -0,0 +1,185 @@
+import hashlib, json, os, pickle, unittest
+
+from lib import target
+from lib.info_parser import parse_llvm_instr_info
+from lib.llvm_instr import Singleton
+from lib.overlay import load_layer
+
+# Bump it whenever layout of pickled objects changes.
+SNAPSHOT_VERSION = 5
+SNAPSHOT_MAGIC = b'SMGSNAP\0'
+
+
+class StaleSnapshotError(Exception):
+    pass
+
+
+def hash_file(path):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def is_snapshot(path):
+    with open(path, 'rb') as f:
+        return f.read(len(SNAPSHOT_MAGIC)) == SNAPSHOT_MAGIC
+
+
+def dump_snapshot(ostream, jf, target_cpu_name, layers=()):
+    '''
+    Parse jf (with layers merged in) for target_cpu_name and pickle the
+    instruction graph together with all singleton registries, so that object
+    identity (e.g. Port and SchedWrite) is preserved after loading.
+    '''
+    target_cpu = target.get_target(target_cpu_name)
+    with open(jf) as f:
+        llvm_instrs = parse_llvm_instr_info(
+            json.load(f), target_cpu, [load_layer(x) for x in layers])
+    header = {
+        'version': SNAPSHOT_VERSION,
+        'target_cpu': target_cpu_name,
+        'source': os.path.abspath(jf),
+        'source_hash': hash_file(jf),
+        'layers': [(os.path.abspath(x), hash_file(x)) for x in layers],
+    }
+    ostream.write(SNAPSHOT_MAGIC)
+    pickle.dump(header, ostream, protocol=pickle.HIGHEST_PROTOCOL)
+    pickle.dump((target_cpu, llvm_instrs, Singleton.get_registries()),
+                ostream,
+                protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def load_snapshot(path, target_cpu_name, check_source=True):
+    with open(path, 'rb') as f:
+        assert f.read(len(SNAPSHOT_MAGIC)) == SNAPSHOT_MAGIC, \
+            f'{path} is not a smg snapshot'
+        header = pickle.load(f)
+        if header['version'] != SNAPSHOT_VERSION:
+            raise StaleSnapshotError(
+                f'{path}: snapshot version {header["version"]} != '
+                f'{SNAPSHOT_VERSION}, please recompile it')
+        if header['target_cpu'] != target_cpu_name:
+            raise StaleSnapshotError(
+                f'{path}: snapshot is compiled for "{header["target_cpu"]}" '
+                f'instead of "{target_cpu_name}"')
+        sources = [(header['source'], header['source_hash'])]
+        for source, source_hash in sources + header['layers']:
+            if (check_source and os.path.exists(source)
+                    and hash_file(source) != source_hash):
+                raise StaleSnapshotError(
+                    f'{path}: {source} changed since snapshot was '
+                    f'compiled, please recompile it')
+        target_cpu, llvm_instrs, registries = pickle.load(f)
+    Singleton.set_registries(registries)
+    return target_cpu, llvm_instrs
+
+
+def load_model(path, target_cpu_name, layers=()):
+    '''
+    Load target cpu and llvm instrs from either json or snapshot. Layers of a
+    snapshot are merged when it is compiled.
+    '''
+    if is_snapshot(path):
+        assert not layers, 'Layers are merged when snapshot is compiled'
+        return load_snapshot(path, target_cpu_name)
+    target_cpu = target.get_target(target_cpu_name)
+    with open(path) as jf:
+        llvm_instrs = parse_llvm_instr_info(json.load(jf), target_cpu,
+                                            [load_layer(x) for x in layers])
+    return target_cpu, llvm_instrs
+
+
+def main(args):
+    with open(args.o, 'wb') as ostream:
+        dump_snapshot(ostream, args.jf, args.target_cpu, args.layer)
+
+
+if __name__ == '__main__':
+    import tempfile
+    from lib.llvm_instr import SchedWrite
+
+    INSTR_INFO = {
+        'ADD8rr': {
+            'SchedReads': [],
+            'SchedWrites': [{
+                'Name': 'WriteALU',
+                'Type': 'X86FoldableSchedWrite'
+            }],
+            'XedInfo': {
+                'IsaSet': 'I86'
+            },
+            'Port': [[1, [0, 1, 5, 6, 10]]],
+            'Uops': 1,
+            'Tp': 0.2,
+            'Latency': 1
+        },
+        'ADD8rm': {
+            'SchedReads': [{
+                'Name': 'ReadAfterLd',
+                'Type': 'SchedRead'
+            }],
+            'SchedWrites': [{
+                'Name': 'WriteALULd',
+                'Type': 'X86FoldableSchedWrite'
+            }],
+            'XedInfo': {
+                'IsaSet': 'I86'
+            },
+            'Port': [[1, [0, 1, 5, 6, 10]], [1, [2, 3, 11]]],
+            'Uops': 2,
+            'Tp': 0.5,
+            'Latency': 6
+        },
+    }
+
+    class SnapshotChecker(unittest.TestCase):
+        def setUp(self):
+            self.tmpdir = tempfile.TemporaryDirectory()
+            self.jf = os.path.join(self.tmpdir.name, 'instrs.json')
+            self.snap = os.path.join(self.tmpdir.name, 'instrs.snap')
+            with open(self.jf, 'w') as f:
+                json.dump(INSTR_INFO, f)
+            with open(self.snap, 'wb') as f:
+                dump_snapshot(f, self.jf, 'alderlake-p')
+
+        def tearDown(self):
+            self.tmpdir.cleanup()
+
+        def test_round_trip(self):
+            self.assertTrue(is_snapshot(self.snap))
+            self.assertFalse(is_snapshot(self.jf))
+            target_cpu, llvm_instrs = load_model(self.snap, 'alderlake-p')
+            self.assertEqual(target_cpu.short_name, 'ADLP')
+            self.assertEqual([x.opcode for x in llvm_instrs],
+                             ['ADD8rr', 'ADD8rm'])
+            uops_info = llvm_instrs[1].uops_info
+            self.assertEqual((uops_info.latency, uops_info.throughput,
+                              uops_info.num_uops), (6, 0.5, 2))
+            # Singletons are restored, not copied.
+            self.assertIs(llvm_instrs[1].schedwrites[0],
+                          SchedWrite.get('WriteALULd'))
+
+        def test_reject_version(self):
+            with open(self.snap, 'wb') as f:
+                f.write(SNAPSHOT_MAGIC)
+                pickle.dump({'version': SNAPSHOT_VERSION - 1}, f)
+            with self.assertRaisesRegex(StaleSnapshotError, 'version'):
+                load_snapshot(self.snap, 'alderlake-p')
+
+        def test_reject_target(self):
+            with self.assertRaisesRegex(StaleSnapshotError, 'alderlake-p'):
+                load_snapshot(self.snap, 'skylake')
+
+        def test_reject_changed_source(self):
+            with open(self.jf, 'w') as f:
+                json.dump({'ADD8rr': INSTR_INFO['ADD8rr']}, f)
+            with self.assertRaisesRegex(StaleSnapshotError, 'changed'):
+                load_snapshot(self.snap, 'alderlake-p')
+            _, llvm_instrs = load_snapshot(self.snap,
+                                           'alderlake-p',
+                                           check_source=False)
+            self.assertEqual(len(llvm_instrs), 2)
+
+    unittest.main()
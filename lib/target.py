@@ -1,27 +1,63 @@
-import os, unittest
+import glob, json, os, re, unittest
 
 try:
     import utils
-    from llvm_instr import Port, SchedWrite
+    from llvm_instr import IsaSet, Port, SchedWrite
 except ModuleNotFoundError:
     from lib import utils
-    from lib.llvm_instr import Port, SchedWrite
+    from lib.llvm_instr import IsaSet, Port, SchedWrite
 
 workdir = f'{os.path.dirname(os.path.realpath(__file__))}'
 
 
+def get_target_names():
+    return sorted(
+        os.path.splitext(os.path.basename(path))[0]
+        for path in glob.glob(f'{workdir}/targets/*.json'))
+
+
 def get_target(target_cpu):
-    target_map = {
-        'alderlake-p': AlderlakeP,
-        'sapphirerapids': SapphireRapids,
-        'skylake': Skylake,
-        'skylake-avx512': SkylakeServer,
-        'icelake-server': IcelakeServer,
-    }
-    if target_cpu not in target_map:
+    ''' Load target description from lib/targets/<target_cpu>.json.  '''
+    path = f'{workdir}/targets/{target_cpu}.json'
+    if not os.path.exists(path):
         raise NotImplementedError(f'Unknown target cpu "{target_cpu}"\n'
-                                  f'Valid target is {list(target_map.keys())}')
-    return target_map[target_cpu]()
+                                  f'Valid target is {get_target_names()}')
+    with open(path) as f:
+        return TargetCPU.from_desc(target_cpu, json.load(f))
+
+
+class PortMap:
+    '''
+    Compiled map of port groups of a reference cpu to port groups of target,
+    described by "port_maps" of target description. Group maps and opcode
+    rules are merged into one dict per distinct set of matching rules, so
+    mapping an instruction is a regex pass over its opcode once and a dict
+    lookup per resource. Groups not in the map are kept.
+    '''
+    def __init__(self, desc):
+        self.groups = {
+            Port.gets(src): Port.gets(dst)
+            for src, dst in desc.get('groups', [])
+        }
+        self.rules = [(re.compile(rule['pattern']), Port.gets(rule['from']),
+                       Port.gets(rule['to']))
+                      for rule in desc.get('opcode_rules', [])]
+        self.rule_maps = {(): self.groups}
+
+    def get_map(self, opcode):
+        matched = tuple(i for i, rule in enumerate(self.rules)
+                        if rule[0].match(opcode))
+        group_map = self.rule_maps.get(matched)
+        if group_map is None:
+            # Opcode rules take precedence over group maps.
+            group_map = self.rule_maps[matched] = dict(self.groups)
+            group_map.update(
+                (self.rules[i][1], self.rules[i][2]) for i in matched)
+        return group_map
+
+    def map_resources(self, opcode, resources):
+        group_map = self.get_map(opcode)
+        return tuple(group_map.get(res, res) for res in resources)
 
 
 class TargetCPU:
@@ -31,8 +67,103 @@ class TargetCPU:
         self.model_name = f'{proc_name.capitalize()}Model' \
                           if model_name is None else model_name
         self.all_ports = None
+        self.port_name_format = 'padded'
+        self.port_aliases = {}
+        self.isa_mask = 0
+        # Precomputed port group <-> name tables.
+        self.ports2name, self.name2ports = {}, {}
+        self.port_maps = {}
+
+    @classmethod
+    def from_desc(cls, name, desc):
+        '''
+        Create target from its json description, see lib/targets/*.json. ISA
+        sets are compiled into a bitset of IsaSet ids so that validity check
+        of an instruction is a bit test.
+        '''
+        target_cpu = cls(desc['short_name'], desc['proc_name'],
+                         desc.get('model_name'))
+        target_cpu.name = name
+        target_cpu.all_ports = Port.gets(desc['ports'])
+        target_cpu.load_ports = Port.gets(desc['load_ports'])
+        target_cpu.load_latency = desc['load_latency']
+        target_cpu.max_latency = desc['max_latency']
+        target_cpu.template_td = f'{workdir}/template/{desc["template"]}' \
+                                 if 'template' in desc else None
+        target_cpu.port_name_format = desc.get('port_name_format', 'padded')
+        target_cpu.port_aliases = desc.get('port_aliases', {})
+        target_cpu.port_maps = {
+            ref_name: PortMap(map_desc)
+            for ref_name, map_desc in desc.get('port_maps', {}).items()
+        }
+        for isa_set in desc['isa_sets']:
+            target_cpu.isa_mask |= 1 << IsaSet(isa_set).id
+
+        # Manually set some schedwrites resources instead of infering it.
+        for write_desc in desc.get('schedwrites', []):
+            SchedWrite(write_desc['name']).set_resources(
+                resources=tuple(
+                    Port.gets(ports) for ports in write_desc['resources']),
+                resource_cycles=tuple(write_desc['resource_cycles']),
+                latency=write_desc['latency'],
+                num_uops=write_desc['num_uops'],
+                is_aux=write_desc.get('is_aux', False))
+        target_cpu.init_ports_names()
+        return target_cpu
+
+    def get_port_map(self, ref_cpu):
+        ''' PortMap from ports of ref_cpu to ports of this target.  '''
+        if ref_cpu.name not in self.port_maps:
+            raise NotImplementedError(
+                f'Unknown resources map between {ref_cpu.proc_name} and '
+                f'{self.proc_name}, add it to "port_maps" of '
+                f'lib/targets/{self.name}.json')
+        return self.port_maps[ref_cpu.name]
+
+    def init_ports_names(self):
+        '''
+        Fill name tables with PortAny, PortInvalid, aliases, single ports,
+        load ports and resources of manually defined schedwrites. Other groups
+        are registered while parsing input or computed once on first lookup.
+        '''
+        self.ports2name, self.name2ports = {}, {}
+        self.register_ports(self.all_ports)
+        self.register_ports((Port.INVALID_PORT, ))
+        for alias, kind in self.port_aliases.items():
+            if kind == 'invalid':
+                self.name2ports[f'{self.short_name}{alias}'] = (
+                    Port.INVALID_PORT, )
+        for port in self.all_ports:
+            self.register_ports((port, ))
+        self.register_ports(self.load_ports)
+        for schedwrite in SchedWrite.get_all():
+            for ports in getattr(schedwrite, 'resources', ()):
+                self.register_ports(ports)
+
+    def register_ports(self, ports):
+        ports = tuple(ports)
+        if ports in self.ports2name or not (
+                ports == (Port.INVALID_PORT, )
+                or all(port in self.all_ports for port in ports)):
+            return
+        name = self.compute_ports_name(ports)
+        self.ports2name[ports] = name
+        self.name2ports.setdefault(name, ports)
+        # llvm-smv names of "digits" targets, e.g. SKLPort0156.
+        if (self.port_name_format == 'digits' and ports
+                and all(0 <= port.number < 10 for port in ports)):
+            self.name2ports.setdefault(
+                f'{self.short_name}Port' + ''.join(str(x) for x in ports),
+                ports)
 
     def get_ports_name(self, ports):
+        ports = tuple(ports)
+        name = self.ports2name.get(ports)
+        if name is None:
+            name = self.ports2name[ports] = self.compute_ports_name(ports)
+        return name
+
+    def compute_ports_name(self, ports):
         if len(ports) == 0:
             return ''
 
@@ -48,14 +179,29 @@ class TargetCPU:
 
     def parse_ports_name(self, ports_name: str):
         ''' Convert ports name to Port.  '''
+        ports = self.name2ports.get(ports_name)
+        if ports is None:
+            ports = self.name2ports[ports_name] = self.compute_ports(
+                ports_name)
+        return ports
+
+    def compute_ports(self, ports_name):
         if ports_name == f'{self.short_name}PortAny':
             return self.all_ports
 
-        if ports_name == f'{self.short_name}PortInvalid':
+        alias = ports_name[len(self.short_name):] if ports_name.startswith(
+            self.short_name) else None
+        if self.port_aliases.get(alias) == 'invalid':
             return (Port.INVALID_PORT, )
 
+        # Either "Port00_01" or one digit per port as "Port01".
+        if self.port_name_format == 'digits':
+            nums = (int(num)
+                    for num in ports_name[len(f'{self.short_name}Port'):])
+        else:
+            nums = utils.str2nums(ports_name, '_', f'{self.short_name}Port')
         ports = []
-        for num in utils.str2nums(ports_name, '_', f'{self.short_name}Port'):
+        for num in nums:
             assert Port(num) in self.all_ports
             ports.append(Port(num))
         return tuple(ports)
@@ -67,351 +213,11 @@ class TargetCPU:
             return str(latency)
 
 
-class AlderlakeP(TargetCPU):
-    valid_isa_set = frozenset('''
-        3DNOW_PREFETCH  ADOX_ADCX AES AVX
-        AVX2  AVX2GATHER  AVXAES  AVX_GFNI
-        AVX_VNNI  BMI1  BMI2  CET
-        CLDEMOTE  CLFLUSHOPT  CLFSH CLWB
-        CMOV  CMPXCHG16B  F16C  FAT_NOP
-        FCMOV FMA FXSAVE  FXSAVE64
-        GFNI  HRESET  I186  I286PROTECTED
-        I286REAL  I386  I486  I486REAL
-        I86 INVPCID KEYLOCKER KEYLOCKER_WIDE
-        LAHF  LONGMODE  LZCNT MONITOR
-        MOVBE MOVDIR  PAUSE PCLMULQDQ
-        PCONFIG PENTIUMMMX  PENTIUMREAL PKU
-        POPCNT  PPRO  PPRO_UD0_SHORT  PREFETCHW
-        PREFETCH_NOP  PTWRITE RDPID RDPMC
-        RDRAND  RDSEED  RDTSCP  RDWRFSGS
-        SERIALIZE SHA SMAP  SMX
-        SSE SSE2  SSE2MMX SSE3
-        SSE3X87 SSE4  SSE42 SSEMXCSR
-        SSE_PREFETCH  SSSE3 SSSE3MMX  VAES
-        VMFUNC  VPCLMULQDQ  VTX WAITPKG
-        WBNOINVD  X87 XSAVE XSAVEC
-        XSAVEOPT  XSAVES
-        '''.split())
-
-    def __init__(self):
-        super().__init__('ADLP', 'alderlake', 'AlderlakePModel')
-        self.all_ports = tuple(
-            Port(num) for num in (0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11))
-        self.load_ports = Port.gets((2, 3, 11))
-        self.load_latency = 5
-        self.max_latency = 100
-        self.template_td = f'{workdir}/template/alderlake-p.td'
-
-        # Manually set some schedwrites resources instead of infering it.
-        self.__set_schedwrite_resource()
-
-    def __set_schedwrite_resource(self):
-        ADLPPort04_09 = Port.gets((4, 9))
-        ADLPPort07_08 = Port.gets((7, 8))
-
-        # Manually define aux SchedWrite here.
-        SchedWrite('WriteIMulH').set_resources(resources=(),
-                                               resource_cycles=(),
-                                               latency=3,
-                                               num_uops=1,
-                                               is_aux=True)
-        SchedWrite('WriteIMulHLd').set_resources(resources=(),
-                                                 resource_cycles=(),
-                                                 latency=3,
-                                                 num_uops=1,
-                                                 is_aux=True)
-        SchedWrite('WriteRMW').set_resources(resources=(self.load_ports,
-                                                        ADLPPort04_09,
-                                                        ADLPPort07_08),
-                                             resource_cycles=(1, 1, 1),
-                                             latency=1,
-                                             num_uops=3,
-                                             is_aux=True)
-        SchedWrite('WriteVecMaskedGatherWriteback').set_resources(
-            resources=(),
-            resource_cycles=(),
-            latency=self.load_latency,
-            num_uops=0,
-            is_aux=True)
-
-        # Manually define non-aux SchedWrite here.
-        SchedWrite('WriteZero').set_resources(resources=(),
-                                              resource_cycles=(),
-                                              latency=1,
-                                              num_uops=1)
-        SchedWrite('WriteLoad').set_resources(resources=(self.load_ports, ),
-                                              resource_cycles=(1, ),
-                                              latency=self.load_latency,
-                                              num_uops=1)
-
-
-class SapphireRapids(TargetCPU):
-    valid_isa_set = frozenset('''
-        3DNOW_PREFETCH  ADOX_ADCX AES AMX_BF16
-        AMX_INT8  AMX_TILE  AVX AVX2
-        AVX2GATHER  AVX512BW_128  AVX512BW_128N AVX512BW_256
-        AVX512BW_512  AVX512BW_KOP  AVX512CD_128  AVX512CD_256
-        AVX512CD_512  AVX512DQ_128  AVX512DQ_128N AVX512DQ_256
-        AVX512DQ_512  AVX512DQ_KOP  AVX512DQ_SCALAR AVX512F_128
-        AVX512F_128N  AVX512F_256 AVX512F_512 AVX512F_KOP
-        AVX512F_SCALAR  AVX512_BF16_128 AVX512_BF16_256 AVX512_BF16_512
-        AVX512_BITALG_128 AVX512_BITALG_256 AVX512_BITALG_512 AVX512_FP16_128
-        AVX512_FP16_128N  AVX512_FP16_256 AVX512_FP16_512 AVX512_FP16_SCALAR
-        AVX512_GFNI_128 AVX512_GFNI_256 AVX512_GFNI_512 AVX512_IFMA_128
-        AVX512_IFMA_256 AVX512_IFMA_512 AVX512_VAES_128 AVX512_VAES_256
-        AVX512_VAES_512 AVX512_VBMI2_128  AVX512_VBMI2_256  AVX512_VBMI2_512
-        AVX512_VBMI_128 AVX512_VBMI_256 AVX512_VBMI_512 AVX512_VNNI_128
-        AVX512_VNNI_256 AVX512_VNNI_512 AVX512_VP2INTERSECT_128
-        AVX512_VP2INTERSECT_256 AVX512_VP2INTERSECT_512 AVX512_VPCLMULQDQ_128
-        AVX512_VPCLMULQDQ_256 AVX512_VPCLMULQDQ_512 AVX512_VPOPCNTDQ_128
-        AVX512_VPOPCNTDQ_256  AVX512_VPOPCNTDQ_512  AVXAES
-        AVX_GFNI  AVX_VNNI  BMI1  BMI2
-        CET CLDEMOTE  CLFLUSHOPT  CLFSH
-        CLWB  CMOV  CMPXCHG16B  ENQCMD
-        F16C  FAT_NOP FCMOV FMA
-        FXSAVE  FXSAVE64  GFNI  I186
-        I286PROTECTED I286REAL  I386  I486
-        I486REAL  I86 INVPCID LAHF
-        LONGMODE  LZCNT MONITOR MOVBE
-        MOVDIR  PAUSE PCLMULQDQ PCONFIG
-        PENTIUMMMX  PENTIUMREAL PKU POPCNT
-        PPRO  PPRO_UD0_LONG PREFETCHW PREFETCH_NOP
-        PTWRITE RDPID RDPMC RDRAND
-        RDSEED  RDTSCP  RDWRFSGS  RTM
-        SERIALIZE SGX SGX_ENCLV SHA
-        SMAP  SMX SSE SSE2
-        SSE2MMX SSE3  SSE3X87 SSE4
-        SSE42 SSEMXCSR  SSE_PREFETCH  SSSE3
-        SSSE3MMX  TDX TSX_LDTRK UINTR
-        VAES  VMFUNC  VPCLMULQDQ  VTX
-        WAITPKG WBNOINVD  X87 XSAVE
-        XSAVEC  XSAVEOPT  XSAVES
-        '''.split())
-
-    def __init__(self):
-        super().__init__('SPR', 'sapphirerapids', 'SapphireRapidsModel')
-        self.all_ports = tuple(
-            Port(num) for num in (0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11))
-        self.load_ports = Port.gets((2, 3, 11))
-        self.load_latency = 5
-        self.max_latency = 100
-        self.template_td = f'{workdir}/template/sapphirerapids.td'
-
-        # Manually set some schedwrites resources instead of infering it.
-        self.__set_schedwrite_resource()
-
-    def __set_schedwrite_resource(self):
-        SPRPort04_09 = Port.gets((4, 9))
-        SPRPort07_08 = Port.gets((7, 8))
-        SPRPort00_06 = Port.gets((0, 6))
-
-        # Manually define aux SchedWrite here.
-        SchedWrite('WriteIMulH').set_resources(resources=(),
-                                               resource_cycles=(),
-                                               latency=3,
-                                               num_uops=1,
-                                               is_aux=True)
-        SchedWrite('WriteIMulHLd').set_resources(resources=(),
-                                                 resource_cycles=(),
-                                                 latency=3,
-                                                 num_uops=1,
-                                                 is_aux=True)
-        SchedWrite('WriteRMW').set_resources(resources=(self.load_ports,
-                                                        SPRPort04_09,
-                                                        SPRPort07_08),
-                                             resource_cycles=(1, 1, 1),
-                                             latency=1,
-                                             num_uops=3,
-                                             is_aux=True)
-        SchedWrite('WriteVecMaskedGatherWriteback').set_resources(
-            resources=(),
-            resource_cycles=(),
-            latency=self.load_latency,
-            num_uops=0,
-            is_aux=True)
-
-        # Manually define non-aux SchedWrite here.
-        SchedWrite('WriteZero').set_resources(resources=(),
-                                              resource_cycles=(),
-                                              latency=1,
-                                              num_uops=1)
-        SchedWrite('WriteLoad').set_resources(resources=(self.load_ports, ),
-                                              resource_cycles=(1, ),
-                                              latency=self.load_latency,
-                                              num_uops=1)
-        SchedWrite('WriteCMOV').set_resources(resources=(SPRPort00_06, ),
-                                              resource_cycles=(1, ),
-                                              latency=1,
-                                              num_uops=1)
-
-
-class Skylake(TargetCPU):
-    valid_isa_set = frozenset('''
-        3DNOW_PREFETCH  ADOX_ADCX AES AVX
-        AVX2  AVX2GATHER  AVXAES  BMI1
-        BMI2  CLFLUSHOPT  CLFSH CMOV
-        CMPXCHG16B  F16C  FAT_NOP FCMOV
-        FMA FXSAVE  FXSAVE64  I186
-        I286PROTECTED I286REAL  I386  I486
-        I486REAL  I86 INVPCID LAHF
-        LONGMODE  LZCNT MONITOR MOVBE
-        MPX PAUSE PCLMULQDQ PENTIUMMMX
-        PENTIUMREAL POPCNT  PPRO  PPRO_UD0_LONG
-        PREFETCHW PREFETCH_NOP  RDPMC RDRAND
-        RDSEED  RDTSCP  RDWRFSGS  RTM
-        SGX SMAP  SMX SSE
-        SSE2  SSE2MMX SSE3  SSE3X87
-        SSE4  SSE42 SSEMXCSR  SSE_PREFETCH
-        SSSE3 SSSE3MMX  VMFUNC  VTX
-        X87 XSAVE XSAVEC  XSAVEOPT
-        XSAVES
-        '''.split())
-
-    def __init__(self):
-        super().__init__('SKL', 'skylake')
-        self.all_ports = tuple(Port(num) for num in (0, 1, 2, 3, 4, 5, 6, 7))
-        self.load_ports = Port.gets((2, 3))
-        self.load_latency = 5
-        self.max_latency = 100
-
-    def parse_ports_name(self, ports_name: str):
-        ''' Convert ports name to Port.  '''
-        if ports_name == f'{self.short_name}PortAny':
-            return self.all_ports
-
-        if ports_name in (f'{self.short_name}Divider',
-                          f'{self.short_name}FPDivider'):
-            return (Port.INVALID_PORT, )
-
-        ports = []
-        for num in ports_name[len(f'{self.short_name}Port'):]:
-            num = int(num)
-            assert Port(num) in self.all_ports
-            ports.append(Port(num))
-        return tuple(ports)
-
-
-class SkylakeServer(TargetCPU):
-    valid_isa_set = frozenset('''
-        3DNOW_PREFETCH  ADOX_ADCX AES AVX
-        AVX2  AVX2GATHER  AVX512BW_128  AVX512BW_128N
-        AVX512BW_256  AVX512BW_512  AVX512BW_KOP  AVX512CD_128
-        AVX512CD_256  AVX512CD_512  AVX512DQ_128  AVX512DQ_128N
-        AVX512DQ_256  AVX512DQ_512  AVX512DQ_KOP  AVX512DQ_SCALAR
-        AVX512F_128 AVX512F_128N  AVX512F_256 AVX512F_512
-        AVX512F_KOP AVX512F_SCALAR  AVXAES  BMI1
-        BMI2  CLFLUSHOPT  CLFSH CLWB
-        CMOV  CMPXCHG16B  F16C  FAT_NOP
-        FCMOV FMA FXSAVE  FXSAVE64
-        I186  I286PROTECTED I286REAL  I386
-        I486  I486REAL  I86 INVPCID
-        LAHF  LONGMODE  LZCNT MONITOR
-        MOVBE MPX PAUSE PCLMULQDQ
-        PENTIUMMMX  PENTIUMREAL PKU POPCNT
-        PPRO  PPRO_UD0_LONG PREFETCHW PREFETCH_NOP
-        RDPMC RDRAND  RDSEED  RDTSCP
-        RDWRFSGS  RTM SGX SMAP
-        SMX SSE SSE2  SSE2MMX
-        SSE3  SSE3X87 SSE4  SSE42
-        SSEMXCSR  SSE_PREFETCH  SSSE3 SSSE3MMX
-        VMFUNC  VTX X87 XSAVE
-        XSAVEC  XSAVEOPT  XSAVES
-        '''.split())
-
-    def __init__(self):
-        super().__init__('SKX', 'skylake-avx512')
-        self.all_ports = tuple(Port(num) for num in (0, 1, 2, 3, 4, 5, 6, 7))
-        self.load_ports = Port.gets((2, 3))
-        self.load_latency = 5
-        self.max_latency = 100
-
-    def parse_ports_name(self, ports_name: str):
-        '''
-        Convert ports name to Port.
-        '''
-        if ports_name == f'{self.short_name}PortAny':
-            return self.all_ports
-
-        if ports_name in (f'{self.short_name}Divider',
-                          f'{self.short_name}FPDivider'):
-            return (Port.INVALID_PORT, )
-
-        ports = []
-        for num in ports_name[len(f'{self.short_name}Port'):]:
-            num = int(num)
-            assert Port(num) in self.all_ports
-            ports.append(Port(num))
-        return tuple(ports)
-
-
-class IcelakeServer(TargetCPU):
-    valid_isa_set = frozenset('''
-        3DNOW_PREFETCH  ADOX_ADCX AES AVX
-        AVX2  AVX2GATHER  AVX512BW_128  AVX512BW_128N
-        AVX512BW_256  AVX512BW_512  AVX512BW_KOP  AVX512CD_128
-        AVX512CD_256  AVX512CD_512  AVX512DQ_128  AVX512DQ_128N
-        AVX512DQ_256  AVX512DQ_512  AVX512DQ_KOP  AVX512DQ_SCALAR
-        AVX512F_128 AVX512F_128N  AVX512F_256 AVX512F_512
-        AVX512F_KOP AVX512F_SCALAR  AVX512_BITALG_128 AVX512_BITALG_256
-        AVX512_BITALG_512 AVX512_GFNI_128 AVX512_GFNI_256 AVX512_GFNI_512
-        AVX512_IFMA_128 AVX512_IFMA_256 AVX512_IFMA_512 AVX512_VAES_128
-        AVX512_VAES_256 AVX512_VAES_512 AVX512_VBMI2_128  AVX512_VBMI2_256
-        AVX512_VBMI2_512  AVX512_VBMI_128 AVX512_VBMI_256 AVX512_VBMI_512
-        AVX512_VNNI_128 AVX512_VNNI_256 AVX512_VNNI_512 AVX512_VPCLMULQDQ_128
-        AVX512_VPCLMULQDQ_256 AVX512_VPCLMULQDQ_512 AVX512_VPOPCNTDQ_128
-        AVX512_VPOPCNTDQ_256 AVX512_VPOPCNTDQ_512  AVXAES  AVX_GFNI  BMI1
-        BMI2  CLFLUSHOPT  CLFSH CLWB
-        CMOV  CMPXCHG16B  F16C  FAT_NOP
-        FCMOV FCOMI FMA FXSAVE
-        FXSAVE64  GFNI  I186  I286PROTECTED
-        I286REAL  I386  I486  I486REAL
-        I86 INVPCID LAHF  LONGMODE
-        LZCNT MONITOR MOVBE PAUSE
-        PCLMULQDQ PCONFIG PENTIUMMMX  PENTIUMREAL
-        PKU POPCNT  PPRO  PPRO_UD0_LONG
-        PREFETCHW PREFETCH_NOP  RDPID RDPMC
-        RDRAND  RDSEED  RDTSCP  RDWRFSGS
-        RTM SGX SGX_ENCLV SHA
-        SMAP  SMX SSE SSE2
-        SSE2MMX SSE3  SSE3X87 SSE4
-        SSE42 SSEMXCSR  SSE_PREFETCH  SSSE3
-        SSSE3MMX  VAES  VMFUNC  VPCLMULQDQ
-        VTX WBNOINVD  X87 XSAVE
-        XSAVEC  XSAVEOPT  XSAVES
-        '''.split())
-
-    def __init__(self):
-        super().__init__('ICX', 'icelake-server')
-        self.all_ports = tuple(
-            Port(num) for num in (0, 1, 2, 3, 4, 5, 6, 7, 8, 9))
-        self.load_ports = Port.gets((2, 3))
-        self.load_latency = 5
-        self.max_latency = 100
-
-    def parse_ports_name(self, ports_name: str):
-        '''
-        Convert ports name to Port.
-        '''
-        if ports_name == f'{self.short_name}PortAny':
-            return self.all_ports
-
-        if ports_name in (f'{self.short_name}Divider',
-                          f'{self.short_name}FPDivider'):
-            return (Port.INVALID_PORT, )
-
-        ports = []
-        for num in ports_name[len(f'{self.short_name}Port'):]:
-            num = int(num)
-            assert Port(num) in self.all_ports
-            ports.append(Port(num))
-        return tuple(ports)
-
-
 if __name__ == '__main__':
 
     class TargetChecker(unittest.TestCase):
         def test_target(self):
-            target_cpu = AlderlakeP()
+            target_cpu = get_target('alderlake-p')
             self.assertEqual(target_cpu.get_ports_name([]), '')
             self.assertEqual(target_cpu.get_ports_name([Port(1),
                                                         Port(2)]),
@@ -421,4 +227,22 @@ if __name__ == '__main__':
             self.assertEqual(target_cpu.parse_ports_name('ADLPPort1_3'),
                              (Port(1), Port(3)))
 
+        def test_skylake_ports_name(self):
+            target_cpu = get_target('skylake')
+            self.assertEqual(target_cpu.parse_ports_name('SKLPort0156'),
+                             Port.gets((0, 1, 5, 6)))
+            self.assertEqual(target_cpu.parse_ports_name('SKLDivider'),
+                             (Port.INVALID_PORT, ))
+
+        def test_port_map(self):
+            port_map = get_target('alderlake-p').get_port_map(
+                get_target('skylake'))
+            self.assertEqual(
+                port_map.map_resources(
+                    'ADD32rm', (Port.gets((2, 3)), Port.gets((0, 1, 5, 6)))),
+                (Port.gets((2, 3, 11)), Port.gets((0, 1, 5, 6, 10))))
+            self.assertEqual(
+                port_map.map_resources('IMUL32rr', (Port.gets((0, 1, 5, 6)), )),
+                (Port.gets((0, 1, 5, 6)), ))
+
     unittest.main()
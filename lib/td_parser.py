@@ -0,0 +1,325 @@
+import bisect, re, unittest
+
+try:
+    import utils
+except ModuleNotFoundError:
+    from lib import utils
+
+
+class TdWrite:
+    ''' Resources, latency def of a SchedWrite/SchedWriteRes in td file. '''
+    def __init__(self,
+                 name,
+                 resources=(),
+                 resource_cycles=None,
+                 latency=1,
+                 num_uops=1,
+                 unsupported=False):
+        self.name = name
+        self.resources = tuple(resources)
+        self.resource_cycles = tuple(resource_cycles or
+                                     (1, ) * len(self.resources))
+        self.latency = latency
+        self.num_uops = num_uops
+        self.unsupported = unsupported
+
+
+def strip_comments(text):
+    text = re.sub(r'/\*.*?\*/', '', text, flags=re.S)
+    return re.sub(r'//[^\n]*', '', text)
+
+
+def split_statements(text):
+    '''
+    Split td text into top-level statements. A statement ends with ';' or
+    with its '{...}' body. "let ... in {" blocks are flattened.
+    '''
+    statements, current, depth, in_string = [], '', 0, False
+    for char in text:
+        current += char
+        if in_string:
+            in_string = char != '"'
+        elif char == '"':
+            in_string = True
+        elif char in '<[({':
+            depth += 1
+        elif char in '>])}':
+            depth -= 1
+            if char == '}' and depth <= 0:
+                if depth < 0:
+                    # Closing bracket of a flattened "let ... in {".
+                    current, depth = current[:-1], 0
+                if current.strip():
+                    statements.append(current.strip())
+                current = ''
+        elif char == ';' and depth == 0:
+            statements.append(current.strip())
+            current = ''
+
+        if depth == 1 and re.match(r'^let\s.*\sin\s*{$', current.strip(),
+                                   re.S):
+            current, depth = '', 0
+    return statements
+
+
+def split_args(args):
+    ''' Split top-level comma separated template args. '''
+    result, current, depth, in_string = [], '', 0, False
+    for char in args:
+        if in_string:
+            in_string = char != '"'
+        elif char == '"':
+            in_string = True
+        elif char in '<[(':
+            depth += 1
+        elif char in '>])':
+            depth -= 1
+        elif char == ',' and depth == 0:
+            result.append(current.strip())
+            current = ''
+            continue
+        current += char
+    if current.strip():
+        result.append(current.strip())
+    return result
+
+
+def parse_list(value):
+    assert value.startswith('[') and value.endswith(']'), value
+    return split_args(value[1:-1])
+
+
+HEAD_RE = re.compile(
+    r'^(?P<kind>def|defm|multiclass)\s+(?:(?P<name>\w+)\s*:\s*|:\s*)?'
+    r'(?P<cls>\w+)\s*<', re.S)
+
+
+def parse_statement(statement):
+    ''' Return (kind, name, class, args, body) of a def/defm/multiclass. '''
+    match = HEAD_RE.match(statement)
+    if match is None:
+        return None
+    depth, begin = 0, match.end() - 1
+    for end in range(begin, len(statement)):
+        if statement[end] == '<':
+            depth += 1
+        elif statement[end] == '>':
+            depth -= 1
+            if depth == 0:
+                break
+    else:
+        return None
+    args = split_args(statement[begin + 1:end])
+    body = statement[end + 1:].strip()
+    return match.group('kind'), match.group('name'), match.group('cls'), \
+        args, body
+
+
+class TdSchedModel:
+    ''' Subset of a schedule model td file that smg emits. '''
+    def __init__(self, target_cpu):
+        self.target_cpu = target_cpu
+        self.proc_resources = {}
+        self.writes = {}
+        self.instrws = []
+        self.pair_defaults = {}
+        self.read_advances = {}
+
+    def parse_file(self, path):
+        with open(path) as f:
+            self.parse(f.read())
+
+    def parse(self, text):
+        for statement in split_statements(strip_comments(text)):
+            parsed = parse_statement(statement)
+            if parsed is None:
+                continue
+            kind, name, cls, args, body = parsed
+            lets = dict(re.findall(r'let\s+(\w+)\s*=\s*([^;]+);', body))
+            if kind == 'multiclass':
+                if cls.endswith('WriteResPair'):
+                    self.parse_pair_multiclass(cls, args)
+            elif cls == 'ProcResource':
+                self.proc_resources[name] = self.target_cpu.parse_ports_name(
+                    name)
+            elif cls == 'ProcResGroup':
+                ports = set()
+                for res in parse_list(args[0]):
+                    ports.update(self.get_resource(res))
+                self.proc_resources[name] = tuple(sorted(ports))
+            elif cls in ('WriteRes', 'SchedWriteRes'):
+                write_name = args[0] if cls == 'WriteRes' else name
+                resources = [
+                    self.get_resource(x)
+                    for x in parse_list(args[-1])
+                ]
+                self.add_write(
+                    TdWrite(write_name, resources,
+                            self.get_list(lets, 'ResourceCycles'),
+                            self.get_int(lets.get('Latency', '1')),
+                            self.get_int(lets.get('NumMicroOps', '1'))))
+            elif cls == 'X86WriteRes':
+                self.add_write(
+                    TdWrite(args[0],
+                            [self.get_resource(x) for x in parse_list(args[1])],
+                            [self.get_int(x) for x in parse_list(args[3])],
+                            self.get_int(args[2]), self.get_int(args[4])))
+            elif cls == 'X86WriteResUnsupported':
+                self.add_write(TdWrite(args[0], unsupported=True))
+            elif cls == 'X86WriteResPairUnsupported':
+                self.add_write(TdWrite(args[0], unsupported=True))
+                self.add_write(TdWrite(args[0] + 'Ld', unsupported=True))
+            elif cls in self.pair_defaults:
+                self.expand_pair(cls, args)
+            elif cls == 'InstRW':
+                self.parse_instrw(args)
+            elif cls == 'ReadAdvance':
+                self.read_advances[args[0]] = self.get_int(args[1])
+            elif cls == 'SchedReadAdvance':
+                self.read_advances[name] = self.get_int(args[0])
+
+    def parse_pair_multiclass(self, cls, params):
+        defaults = []
+        for param in params[3:]:
+            value = param.split('=')[1].strip()
+            defaults.append(
+                [self.get_int(x) for x in parse_list(value)] if value.
+                startswith('[') else self.get_int(value))
+        self.pair_defaults[cls] = defaults
+
+    def expand_pair(self, cls, args):
+        ''' Expand *WriteResPair as defined in the template.  '''
+        name, exe_ports, latency = args[:3]
+        res, num_uops, load_lat, load_uops = self.pair_defaults[cls]
+        rest = args[3:]
+        if len(rest) > 0:
+            res = [self.get_int(x) for x in parse_list(rest[0])]
+        if len(rest) > 1:
+            num_uops = self.get_int(rest[1])
+        if len(rest) > 2:
+            load_lat = self.get_int(rest[2])
+        if len(rest) > 3:
+            load_uops = self.get_int(rest[3])
+        latency = self.get_int(latency)
+        resources = [self.get_resource(x) for x in parse_list(exe_ports)]
+        self.add_write(TdWrite(name, resources, res, latency, num_uops))
+        self.add_write(
+            TdWrite(name + 'Ld', [self.target_cpu.load_ports] + resources,
+                    [1] + res, latency + load_lat, num_uops + load_uops))
+
+    def parse_instrw(self, args):
+        schedrws = parse_list(args[0])
+        match = re.match(r'^\((instrs|instregex)\s+(.*)\)$', args[1], re.S)
+        assert match, f'Unsupported InstRW: {args[1]}'
+        items = split_args(match.group(2))
+        if match.group(1) == 'instregex':
+            items = [x.strip('"') for x in items]
+        self.instrws.append((schedrws, match.group(1), items))
+
+    def add_write(self, write):
+        self.writes[write.name] = write
+
+    def get_resource(self, name):
+        if name not in self.proc_resources:
+            self.proc_resources[name] = self.target_cpu.parse_ports_name(name)
+        return self.proc_resources[name]
+
+    def get_int(self, value):
+        value = value.strip()
+        if value.endswith('.MaxLatency'):
+            return self.target_cpu.max_latency
+        return int(value)
+
+    def get_list(self, lets, key):
+        if key not in lets:
+            return None
+        return [self.get_int(x) for x in parse_list(lets[key].strip())]
+
+    def match_instrws(self, opcodes):
+        '''
+        Map each opcode to the indexes of InstRWs matching it, the way
+        llvm-tblgen does: instregex is a prefix match and its literal prefix is
+        binary searched in sorted opcodes.
+        '''
+        sorted_opcodes = sorted(opcodes)
+        opcode_set = set(opcodes)
+        opc2instrws = {}
+        for idx, (_, kind, items) in enumerate(self.instrws):
+            matched = set()
+            for item in items:
+                if kind == 'instrs':
+                    if item in opcode_set:
+                        matched.add(item)
+                    continue
+                prefix, pattern = utils.tblgen_regex_prefix(item)
+                regex = re.compile(pattern) if pattern is not None else None
+                begin = bisect.bisect_left(sorted_opcodes, prefix)
+                for opcode in sorted_opcodes[begin:]:
+                    if not opcode.startswith(prefix):
+                        break
+                    if regex is None or regex.match(opcode[len(prefix):]):
+                        matched.add(opcode)
+            for opcode in matched:
+                opc2instrws.setdefault(opcode, []).append(idx)
+        return opc2instrws
+
+
+if __name__ == '__main__':
+    from llvm_instr import Port
+    from target import get_target
+
+    PAIR_MULTICLASS = '''
+multiclass ADLPWriteResPair<X86FoldableSchedWrite SchedRW,
+                            list<ProcResourceKind> ExePorts,
+                            int Lat, list<int> Res = [1], int UOps = 1,
+                            int LoadLat = 5, int LoadUOps = 1> {
+  def : WriteRes<SchedRW, ExePorts> {
+    let Latency = Lat;
+  }
+}
+'''
+
+    class TdParserChecker(unittest.TestCase):
+        def test_write_res_pair(self):
+            td = TdSchedModel(get_target('alderlake-p'))
+            td.parse(PAIR_MULTICLASS +
+                     'defm : ADLPWriteResPair<WriteFAdd, [ADLPPort00_01], '
+                     '3>;\n'
+                     'defm : ADLPWriteResPair<WriteFDiv, [ADLPPort00], 11, '
+                     '[4], 1, 6>;\n')
+            p01, p0 = Port.gets((0, 1)), Port.gets((0, ))
+            load_ports = td.target_cpu.load_ports
+            # Defaults of the multiclass fill missing args.
+            write = td.writes['WriteFAdd']
+            self.assertEqual((write.resources, write.resource_cycles,
+                              write.latency, write.num_uops),
+                             ((p01, ), (1, ), 3, 1))
+            write = td.writes['WriteFAddLd']
+            self.assertEqual((write.resources, write.resource_cycles,
+                              write.latency, write.num_uops),
+                             ((load_ports, p01), (1, 1), 8, 2))
+            # Given args override defaults in order.
+            write = td.writes['WriteFDivLd']
+            self.assertEqual((write.resources, write.resource_cycles,
+                              write.latency, write.num_uops),
+                             ((load_ports, p0), (1, 4), 17, 2))
+
+        def test_match_instrws(self):
+            td = TdSchedModel(get_target('alderlake-p'))
+            td.parse('def : InstRW<[WriteA], (instregex "ADD(8|16)rr")>;\n'
+                     'def : InstRW<[WriteB], (instrs ADD8rr, SUB8rr)>;\n'
+                     'def : InstRW<[WriteC], (instregex "(V?)SUB")>;\n')
+            opc2instrws = td.match_instrws(
+                ['ADD8rr', 'ADD8rr_REV', 'ADD16rr', 'ADD32rr', 'SUB8rr',
+                 'VSUBPSrr', 'XSUB'])
+            # instregex is anchored at the start only, so it matches
+            # ADD8rr_REV, and overlapping InstRWs are all reported.
+            self.assertEqual(opc2instrws['ADD8rr'], [0, 1])
+            self.assertEqual(opc2instrws['ADD8rr_REV'], [0])
+            self.assertEqual(opc2instrws['ADD16rr'], [0])
+            self.assertNotIn('ADD32rr', opc2instrws)
+            self.assertEqual(opc2instrws['SUB8rr'], [1, 2])
+            self.assertEqual(opc2instrws['VSUBPSrr'], [2])
+            self.assertNotIn('XSUB', opc2instrws)
+
+    unittest.main()
@@ -0,0 +1,192 @@
+import csv, functools, json, math, sys, unittest
+
+try:
+    from llvm_instr import Port
+except ModuleNotFoundError:
+    from lib.llvm_instr import Port
+
+
+# Measured Tp is rounded to 2 decimals by its sources and varies a few
+# percent between runs, so a bound matches it within an absolute part that
+# covers rounding of small Tp plus a relative part that covers noise of long
+# non-pipelined ops.
+THROUGHPUT_ABS_TOLERANCE = 0.05
+THROUGHPUT_REL_TOLERANCE = 0.05
+
+
+def group_cycles(resources, resource_cycles):
+    ''' Sum cycles of each port group. Return ((mask, cycles), ...).  '''
+    cycles = {}
+    for res, cycs in zip(resources, resource_cycles):
+        mask = Port.mask(res)
+        cycles[mask] = cycles.get(mask, 0) + cycs
+    return tuple(sorted(cycles.items()))
+
+
+@functools.lru_cache(maxsize=None)
+def port_pressure_bound_of(groups):
+    '''
+    Lower bound of reciprocal throughput when cycles of each port group are
+    optimally distributed over its ports. It is the max over port sets of
+    (cycles of groups inside the set) / (number of ports in the set), and the
+    max is reached at a union of groups.
+    '''
+    bound = 0
+    masks = [mask for mask, _ in groups]
+    for select in range(1, 1 << len(groups)):
+        union = 0
+        for i, mask in enumerate(masks):
+            if select >> i & 1:
+                union |= mask
+        load = sum(cycs for mask, cycs in groups if mask & ~union == 0)
+        bound = max(bound, load / bin(union).count('1'))
+    return bound
+
+
+def port_pressure_bound(resources, resource_cycles):
+    return port_pressure_bound_of(group_cycles(resources, resource_cycles))
+
+
+def throughput_tolerance(throughput):
+    return THROUGHPUT_ABS_TOLERANCE + THROUGHPUT_REL_TOLERANCE * throughput
+
+
+def fits_throughput(resources, resource_cycles, throughput):
+    bound = port_pressure_bound(tuple(resources), tuple(resource_cycles))
+    return abs(bound - throughput) <= throughput_tolerance(throughput)
+
+
+def derive_resource_cycles(resources,
+                           throughput,
+                           fixed_resources=(),
+                           fixed_resource_cycles=None):
+    '''
+    Derive resource_cycles of resources so that port pressure bound of
+    resources plus fixed_resources matches measured throughput. Extra cycles
+    go to the smallest port group that can reach it, which models a
+    non-pipelined unit. Return None if it can't be fitted.
+    '''
+    if throughput is None:
+        return None
+    resource_cycles = [1] * len(resources)
+    fixed_cycles = tuple(fixed_resource_cycles or
+                         (1, ) * len(fixed_resources))
+    tolerance = throughput_tolerance(throughput)
+
+    def bound_of(cycles):
+        return port_pressure_bound(
+            tuple(resources) + tuple(fixed_resources),
+            tuple(cycles) + fixed_cycles)
+
+    bound = bound_of(resource_cycles)
+    if abs(bound - throughput) <= tolerance:
+        return tuple(resource_cycles)
+    if bound > throughput:
+        return None
+
+    # Try from smallest group, the first entry of a group takes extra cycles.
+    first_idx = {}
+    for i, res in enumerate(resources):
+        first_idx.setdefault(res, i)
+    for res in sorted(first_idx, key=lambda x: (len(x), x)):
+        cycles = list(resource_cycles)
+        while bound_of(cycles) < throughput - tolerance:
+            cycles[first_idx[res]] += 1
+        if abs(bound_of(cycles) - throughput) <= tolerance:
+            return tuple(cycles)
+    return None
+
+
+class ThroughputReport:
+    '''
+    Divergences between port pressure bound of the inferred model and
+    measured throughput, ranked by |log(bound / measured)|.
+    '''
+    FIELDS = ('opcode', 'schedwrites', 'measured', 'bound', 'ratio')
+
+    def __init__(self):
+        self.divergences = []
+        self.num_checked = 0
+
+    def check(self, llvm_instr, resources, resource_cycles):
+        throughput = llvm_instr.uops_info.throughput
+        if throughput is None or throughput <= 0:
+            return
+        self.num_checked += 1
+        if fits_throughput(resources, resource_cycles, throughput):
+            return
+        bound = port_pressure_bound(tuple(resources), tuple(resource_cycles))
+        self.divergences.append({
+            'opcode': llvm_instr.opcode,
+            'schedwrites': ','.join(x.name for x in llvm_instr.schedwrites),
+            'measured': throughput,
+            'bound': round(bound, 3),
+            'ratio': round(bound / throughput, 3),
+        })
+
+    def ranked(self):
+        return sorted(self.divergences,
+                      key=lambda x: (-abs(math.log(x['ratio'] or 1e-3)),
+                                     x['opcode']))
+
+    def dump(self, path):
+        ''' Dump ranked divergences as csv if path ends with .csv else json. '''
+        with open(path, 'w', newline='') as ostream:
+            if path.endswith('.csv'):
+                writer = csv.DictWriter(ostream, fieldnames=self.FIELDS)
+                writer.writeheader()
+                writer.writerows(self.ranked())
+            else:
+                json.dump(
+                    {
+                        'checked': self.num_checked,
+                        'divergences': self.ranked()
+                    },
+                    ostream,
+                    indent=2)
+
+    def print_summary(self, top=10, ostream=sys.stderr):
+        if not self.divergences:
+            return
+        print(f'Throughput: {len(self.divergences)} of {self.num_checked} '
+              f'instructions diverge from measured Tp, worst {top}:',
+              file=ostream)
+        for row in self.ranked()[:top]:
+            print(f'  {row["opcode"]}: measured {row["measured"]}, bound '
+                  f'{row["bound"]} ({row["schedwrites"]})',
+                  file=ostream)
+
+
+if __name__ == '__main__':
+
+    class ThroughputChecker(unittest.TestCase):
+        def test_pipelined(self):
+            p0156 = Port.gets((0, 1, 5, 6))
+            self.assertEqual(derive_resource_cycles((p0156, ), 0.25), (1, ))
+            self.assertEqual(derive_resource_cycles((p0156, ), None), None)
+            # Bound is already above measured throughput.
+            self.assertEqual(derive_resource_cycles((Port.gets((0, )), ), 0.5),
+                             None)
+
+        def test_non_pipelined(self):
+            # Divider on port 0 takes 4 cycles per uop.
+            p0, p05 = Port.gets((0, )), Port.gets((0, 5))
+            self.assertEqual(derive_resource_cycles((p0, ), 4.0), (4, ))
+            self.assertEqual(derive_resource_cycles((p0, p05), 4.0), (4, 1))
+            self.assertTrue(fits_throughput((p0, p05), (4, 1), 4.0))
+            self.assertFalse(fits_throughput((p0, p05), (1, 1), 4.0))
+
+        def test_multi_group(self):
+            # Extra cycles go to the smallest group that reaches throughput,
+            # a group of 2 ports needs 6 cycles for Tp 3.
+            p01, p0156 = Port.gets((0, 1)), Port.gets((0, 1, 5, 6))
+            self.assertEqual(
+                derive_resource_cycles((p0156, p01, p01), 3.0), (1, 5, 1))
+            self.assertAlmostEqual(
+                port_pressure_bound((p0156, p01, p01), (1, 5, 1)), 3.0)
+            # Fixed aux resources count but never take extra cycles.
+            p23 = Port.gets((2, 3))
+            self.assertEqual(
+                derive_resource_cycles((p01, ), 2.0, (p23, ), (1, )), (4, ))
+
+    unittest.main()
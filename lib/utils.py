@@ -74,6 +74,117 @@ def commonpostfix(strings):
     return inversed_common_postfix[::-1]
 
 
+def remove_parens(string):
+    ''' Remove parenthesized parts of string like llvm-tblgen does. '''
+    result, paren = '', 0
+    for char in string:
+        if char == '(':
+            paren += 1
+        elif char == ')':
+            paren -= 1
+        elif paren == 0:
+            result += char
+    return result
+
+
+def tblgen_regex_prefix(regex):
+    '''
+    Split instregex into (literal prefix, pattern) the way llvm-tblgen does.
+    The prefix is binary searched in sorted instructions and only instructions
+    with that prefix are matched against pattern. pattern is None if prefix is
+    the whole regex.
+    '''
+    # Explicit ^ anchor is dropped to not interfere with prefix search.
+    had_anchor = regex.startswith('^')
+    if had_anchor:
+        regex = regex[1:]
+
+    first_meta = len(regex)
+    for i, char in enumerate(regex):
+        if char in '()^$|*+?.[]\\{}':
+            first_meta = i
+            break
+    # For regex like ABC* only AB can be used as prefix.
+    if 0 < first_meta < len(regex) and regex[first_meta] in '+*?':
+        first_meta -= 1
+    # Top-level | or ? can't be optimized to binary search.
+    if any(char in remove_parens(regex) for char in '|?'):
+        first_meta = 0
+
+    prefix, pattern = regex[:first_meta], regex[first_meta:]
+    if not pattern:
+        return prefix, None
+    return prefix, f'^{pattern}' if had_anchor else f'^({pattern})'
+
+
+def expand_literal_regex(regex):
+    '''
+    Return all strings matched by regex made of literals, groups, "|" and "?"
+    like RegexReducer generates, e.g. "(V?)ADD(8|16)" gives 4 strings. Return
+    None if regex uses anything else.
+    '''
+    alternatives, seq, i = [], [''], 0
+    while i < len(regex):
+        char = regex[i]
+        if char == '|':
+            alternatives.extend(seq)
+            seq, i = [''], i + 1
+            continue
+        if char == '(':
+            depth, end = 0, i
+            for end in range(i, len(regex)):
+                depth += {'(': 1, ')': -1}.get(regex[end], 0)
+                if depth == 0:
+                    break
+            if depth != 0:
+                return None
+            atom = expand_literal_regex(regex[i + 1:end])
+            if atom is None:
+                return None
+            i = end + 1
+        elif char in ')^$*+?.[]\\{}':
+            return None
+        else:
+            atom, i = [char], i + 1
+        if i < len(regex) and regex[i] == '?':
+            atom, i = [''] + atom, i + 1
+        seq = [x + y for x in seq for y in atom]
+    return alternatives + seq
+
+
+def split_leading_group(regex):
+    '''
+    Split regex starting with a group like "^(V?)CVTSS2SIrr$" (which has no
+    literal prefix for llvm-tblgen) into regexes starting with each literal
+    alternative of the group, e.g. "^VCVTSS2SIrr$" and "^CVTSS2SIrr$". Return
+    [regex] if the leading group can't be expanded.
+    '''
+    anchor = '^' if regex.startswith('^') else ''
+    body = regex[len(anchor):]
+    if not body.startswith('('):
+        return [regex]
+    depth = 0
+    for end, char in enumerate(body):
+        depth += {'(': 1, ')': -1}.get(char, 0)
+        if depth == 0:
+            break
+    end += 1
+    if body[end:end + 1] in ('?', '*', '+'):
+        if body[end] != '?':
+            return [regex]
+        end += 1
+    alternatives = expand_literal_regex(body[:end])
+    if alternatives is None:
+        return [regex]
+    result = []
+    for alternative in alternatives:
+        piece = anchor + alternative + body[end:]
+        # Alternative may be empty and leave another leading group.
+        pieces = split_leading_group(piece) if not alternative else [piece]
+        result.extend(x for x in pieces if x not in result)
+    return result
+
+
 class RegexReducer:
     ''' Reduce a list of regexes to more concise regexes. '''
     def __init__(self, diff_len_limit=2):
@@ -240,6 +351,30 @@ if __name__ == '__main__':
             self.assertTrue(listcontain([1, 1, 2], [1]))
             self.assertFalse(listcontain([1, 1, 2], [3]))
 
+        def test_tblgen_regex_prefix(self):
+            self.assertEqual(tblgen_regex_prefix('^ADD(8|16)rr$'),
+                             ('ADD', '^(8|16)rr$'))
+            self.assertEqual(tblgen_regex_prefix('ADD(8|16)rr$'),
+                             ('ADD', '^((8|16)rr$)'))
+            self.assertEqual(tblgen_regex_prefix('^ADDS*rr$'),
+                             ('ADD', '^S*rr$'))
+            self.assertEqual(tblgen_regex_prefix('^(V?)CVTSD2SIrm$'),
+                             ('', '^(V?)CVTSD2SIrm$'))
+            self.assertEqual(tblgen_regex_prefix('ADD8rr|SUB8rr'),
+                             ('', '^(ADD8rr|SUB8rr)'))
+            self.assertEqual(tblgen_regex_prefix('MOV8rr'), ('MOV8rr', None))
+
+        def test_split_leading_group(self):
+            self.assertEqual(expand_literal_regex('(V?)ADD(8|16)'),
+                             ['ADD8', 'ADD16', 'VADD8', 'VADD16'])
+            self.assertEqual(expand_literal_regex('ADD(8|16)*'), None)
+            self.assertEqual(split_leading_group('^(V?)CVTSS2SI((64)?)rr$'),
+                             ['^CVTSS2SI((64)?)rr$', '^VCVTSS2SI((64)?)rr$'])
+            self.assertEqual(split_leading_group('^((V|E)?)(A|B)rr$'),
+                             ['^Arr$', '^Brr$', '^V(A|B)rr$', '^E(A|B)rr$'])
+            self.assertEqual(split_leading_group('^ADD(8|16)rr$'),
+                             ['^ADD(8|16)rr$'])
+
         def test_regex_reducer(self):
             self.assertEqual(
                 RegexReducer().reduce([
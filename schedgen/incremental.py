@@ -0,0 +1,120 @@
+import glob, hashlib, json, os, sys
+
+from lib.llvm_instr import WriteSequence
+
+# Bump it whenever layout of state files changes.
+STATE_VERSION = 2
+
+srcdir = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+
+def hash_obj(obj):
+    return hashlib.sha256(repr(obj).encode('utf-8')).hexdigest()
+
+
+class IncrementalState:
+    '''
+    Inference results and emitted text blocks of previous smg gen runs, keyed
+    by content hash of everything that determines them. Entries that are not
+    used by current run are dropped when saving.
+    '''
+    def __init__(self, state_dir, target_cpu):
+        self.state_dir = state_dir
+        self.salt = self.compute_salt(target_cpu)
+        self.infer_events, self.blocks = {}, {}
+        self.used_infer_events, self.used_blocks = {}, {}
+        self.stats = []
+        self.num_blocks, self.num_reused_blocks = 0, 0
+
+        manifest = self.load_json('manifest.json')
+        if manifest == {'version': STATE_VERSION, 'salt': self.salt}:
+            self.infer_events = self.load_json('infer.json') or {}
+            self.blocks = self.load_json('blocks.json') or {}
+
+    @staticmethod
+    def compute_salt(target_cpu):
+        ''' Hash of target, template and smg sources.  '''
+        sha = hashlib.sha256(target_cpu.short_name.encode('utf-8'))
+        sources = sorted(
+            glob.glob(f'{srcdir}/lib/**/*', recursive=True) +
+            glob.glob(f'{srcdir}/schedgen/*.py'))
+        if target_cpu.template_td is not None:
+            sources.append(target_cpu.template_td)
+        for path in sources:
+            if os.path.isfile(path) and '__pycache__' not in path:
+                with open(path, 'rb') as f:
+                    sha.update(f.read())
+        return sha.hexdigest()
+
+    def load_json(self, name):
+        path = os.path.join(self.state_dir, name)
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    def dump_json(self, name, obj):
+        with open(os.path.join(self.state_dir, name), 'w') as f:
+            json.dump(obj, f)
+
+    def component_key(self, component, sw2instrs, minimize_instrw=False):
+        desc = []
+        for schedwrite in component:
+            write_desc = [str(schedwrite)]
+            if type(schedwrite) is WriteSequence:
+                write_desc.append([str(x) for x in schedwrite.expand()])
+            for llvm_instr in sw2instrs[schedwrite]:
+                uops_info = getattr(llvm_instr, 'uops_info', None)
+                if uops_info is not None:
+                    uops_info = (uops_info.latency, uops_info.throughput,
+                                 uops_info.num_uops, uops_info.ports)
+                write_desc.append(
+                    (llvm_instr.opcode, [str(x) for x in llvm_instr.schedwrites],
+                     uops_info))
+                # Users forced to InstRW don't vote when minimizing InstRW.
+                if minimize_instrw:
+                    write_desc.append(llvm_instr.use_instrw())
+            desc.append(write_desc)
+        if minimize_instrw:
+            desc.append('minimize-instrw')
+        return hash_obj(desc)
+
+    def get_infer_events(self, key):
+        '''
+        Return (infer events, InstRW override estimates) of component key, or
+        None if it isn't cached.
+        '''
+        cached = self.infer_events.get(key)
+        if cached is not None:
+            self.used_infer_events[key] = cached
+        return cached
+
+    def set_infer_events(self, key, events, estimated_overrides):
+        self.used_infer_events[key] = (events, estimated_overrides)
+
+    def emit_block(self, ostream, key, emitter):
+        ''' Write cached text for key or capture text written by emitter.  '''
+        key = hash_obj(key)
+        text = self.blocks.get(key)
+        if text is None:
+            text = emitter()
+        else:
+            self.num_reused_blocks += 1
+        self.num_blocks += 1
+        self.used_blocks[key] = text
+        ostream.write(text)
+
+    def report(self, what, reused, total):
+        self.stats.append(f'{what}: reused {reused}/{total}')
+
+    def save(self):
+        self.report('emitted blocks', self.num_reused_blocks,
+                    self.num_blocks)
+        print('Incremental: ' + ', '.join(self.stats), file=sys.stderr)
+        os.makedirs(self.state_dir, exist_ok=True)
+        self.dump_json('infer.json', self.used_infer_events)
+        self.dump_json('blocks.json', self.used_blocks)
+        self.dump_json('manifest.json', {
+            'version': STATE_VERSION,
+            'salt': self.salt
+        })
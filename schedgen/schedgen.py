@@ -1,42 +1,77 @@
-import json, collections, sys
+import bisect, io, json, collections, math, multiprocessing, re, sys, unittest
 
-import lib.target as target
 import lib.utils as utils
-from lib.info_parser import parse_llvm_instr_info
+from lib.instr_table import InstrTable
+from lib.snapshot import load_model
+from lib.td_parser import TdSchedModel
 from lib.llvm_instr import *
+from lib.throughput import (ThroughputReport, derive_resource_cycles,
+                            fits_throughput, port_pressure_bound)
+from schedgen.incremental import IncrementalState
+
+# An instregex is kept if llvm-tblgen tests it against at most this many
+# instructions per instruction it matches, otherwise instrs is cheaper.
+INSTREGEX_COST_FACTOR = 4
+
+# (LLVMSchedGen, components, sw2instrs) inherited by forked inference workers.
+_pool_context = None
+
+
+def _infer_component_in_worker(idx):
+    schedgen, components, sw2instrs = _pool_context
+    return schedgen.infer_component_counted(components[idx], sw2instrs)
 
 
 class LLVMSchedGen:
-    def __init__(self, llvm_instrs, target_cpu):
+    def __init__(self,
+                 llvm_instrs,
+                 target_cpu,
+                 state=None,
+                 minimize_instrw=False,
+                 jobs=1):
         self.target_cpu = target_cpu
         self.llvm_instrs = llvm_instrs
+        self.state = state
+        self.minimize_instrw = minimize_instrw
+        self.jobs = jobs
+        self.estimated_overrides = [0, 0]
+        self.sorted_opcodes = sorted(x.opcode for x in llvm_instrs)
+        self.instrw_cost = collections.Counter()
+        self.pair_stats = collections.Counter()
+        self.read_advance_stats = collections.Counter()
+        self.infered_reads = []
+        self.infered_writes = set()
+        # Port groups emitted under the name of their template definition.
+        self.template_group_names = {}
+        self.unfitted_throughputs = []
+        self.table = InstrTable(llvm_instrs)
         self.clean_wrong_schedwrite()
         self.infer_schedwrite_resources()
+        self.derive_schedwrite_resource_cycles()
         self.infer_schedwriteres()
+        self.infer_read_advance()
+        SchedWriteRes.renumber()
         self.validate_infered_resource()
+        self.check_throughput_bound()
         self.tag_unsupported_schedwrite()
+        self.report_unfitted_throughputs()
 
     def gen_scheduler(self, ostream):
         self.emit_scheduler(ostream)
 
     def clean_wrong_schedwrite(self):
         ''' Some schedwrites of instr are wrong which must be removed. '''
-        for llvm_instr in self.llvm_instrs:
-            if not llvm_instr.has_uops_info():
-                continue
+        row2wrong_aux = self.table.incompatible_aux_schedwrites()
+        for row, llvm_instr in enumerate(self.table.llvm_instrs):
             instr_latency = llvm_instr.uops_info.latency
             instr_ports = llvm_instr.uops_info.ports
             instr_num_uops = llvm_instr.uops_info.num_uops
-            wrong_aux_schedwrites, wrong_writesequences = [], []
+            wrong_aux_schedwrites = row2wrong_aux.get(row, [])
+            wrong_writesequences = []
             for schedwrite in llvm_instr.schedwrites:
-                if schedwrite.is_aux():
-                    assert schedwrite.is_complete()
-                    if (schedwrite.latency > instr_latency
-                            or schedwrite.num_uops > instr_num_uops
-                            or not utils.listcontain(instr_ports,
-                                                     schedwrite.resources)):
-                        wrong_aux_schedwrites.append(schedwrite)
-                elif type(schedwrite) is WriteSequence:
+                # Aux schedwrites are checked by table.
+                if (type(schedwrite) is WriteSequence
+                        and not schedwrite.is_aux()):
                     ext_latency, ext_num_uops, ext_ports = 0, 0, []
                     for leaf_write in schedwrite.expand():
                         if not leaf_write.is_complete():
@@ -72,64 +107,461 @@ class LLVMSchedGen:
             for schedwrite in llvm_instr.schedwrites:
                 sw2instrs.setdefault(schedwrite, []).append(llvm_instr)
 
-        # TODO: resource_cycles is not derived.
-        for schedwrite, llvm_instrs in sw2instrs.items():
+        # Schedwrites in different components never affect each other, so
+        # each component can be infered (or reused from state) on its own.
+        reused, keys, todo = 0, {}, []
+        components = self.split_components(sw2instrs)
+        for idx, component in enumerate(components):
+            if self.state is not None:
+                keys[idx] = self.state.component_key(component, sw2instrs,
+                                                     self.minimize_instrw)
+                cached = self.state.get_infer_events(keys[idx])
+                if cached is not None:
+                    events, estimated_overrides = cached
+                    self.apply_infer_events(events)
+                    # Override estimates are still counted.
+                    for i, cnt in enumerate(estimated_overrides):
+                        self.estimated_overrides[i] += cnt
+                    reused += 1
+                    continue
+            todo.append(idx)
+
+        in_pool = self.jobs > 1 and len(todo) > 1
+        if in_pool:
+            results = self.infer_components_in_pool(
+                [components[idx] for idx in todo], sw2instrs)
+        else:
+            results = [
+                self.infer_component_counted(components[idx], sw2instrs)
+                for idx in todo
+            ]
+        for idx, (events, estimated_overrides) in zip(todo, results):
+            # Events infered in pool are applied here, in component order.
+            if in_pool:
+                self.apply_infer_events(events)
+                for i, cnt in enumerate(estimated_overrides):
+                    self.estimated_overrides[i] += cnt
+            if self.state is not None:
+                self.state.set_infer_events(keys[idx], events,
+                                            estimated_overrides)
+
+        if self.state is not None:
+            self.state.report('inference components', reused, len(components))
+
+    def infer_component_counted(self, component, sw2instrs):
+        '''
+        Infer component, return (applied infer events, override estimates
+        added by component).
+        '''
+        estimated_overrides = list(self.estimated_overrides)
+        events = self.infer_component(component, sw2instrs)
+        return events, [
+            x - y for x, y in zip(self.estimated_overrides, estimated_overrides)
+        ]
+
+    def infer_component(self, component, sw2instrs):
+        ''' Infer schedwrites of component, return applied infer events.  '''
+        if self.needs_joint_fit(component, sw2instrs):
+            events = self.fit_component_leaves(component, sw2instrs)
+            self.apply_infer_events(events)
+            return events
+        if self.minimize_instrw:
+            events = self.minimize_component_instrw(component, sw2instrs)
+            self.apply_infer_events(events)
+            return events
+
+        events = []
+        for schedwrite in component:
+            event = self.infer_schedwrite(schedwrite, sw2instrs[schedwrite])
+            if event is not None:
+                self.apply_infer_events([event])
+                events.append(event)
+        return events
+
+    @staticmethod
+    def needs_joint_fit(component, sw2instrs):
+        '''
+        If component has a WriteSequence with more than 1 incompleted leaf, or
+        an instruction with more than 1 incompleted schedwrite, its leaves
+        can't be infered one by one.
+        '''
+        for schedwrite in component:
+            if (type(schedwrite) is WriteSequence and
+                    len([x for x in schedwrite.expand() if not x.is_complete()])
+                    > 1):
+                return True
+            for llvm_instr in sw2instrs[schedwrite]:
+                if len([x for x in llvm_instr.schedwrites
+                        if not x.is_complete()]) > 1:
+                    return True
+        return False
+
+    def leaf_equations(self, component, sw2instrs):
+        '''
+        Return Counter of equations {(coefs, latency, num_uops, port
+        signature): number of instructions}. coefs is ((leaf write, count),
+        ...) of incompleted leaves, and the rest is what instruction measured
+        minus its complete leaf and aux schedwrites.
+        '''
+        equations = collections.Counter()
+        for schedwrite in component:
             if schedwrite.is_complete():
                 continue
-            candidates = []
-            for llvm_instr in llvm_instrs:
-                if not llvm_instr.has_uops_info():
+            leaf_writes = schedwrite.expand() if type(
+                schedwrite) is WriteSequence else [schedwrite]
+            for llvm_instr in sw2instrs[schedwrite]:
+                row = self.table.row(llvm_instr)
+                # Latency of instruction is the max of its schedwrites, so
+                # only 1 incompleted schedwrite per instruction can be fitted.
+                if row is None or any(not x.is_complete() and x != schedwrite
+                                      for x in llvm_instr.schedwrites):
                     continue
-                dr_latency = llvm_instr.uops_info.latency
-                dr_num_uops = llvm_instr.uops_info.num_uops
-                dr_ports = llvm_instr.uops_info.ports
-                for instr_sw in llvm_instr.schedwrites:
-                    if instr_sw == schedwrite:
+                latency, num_uops = self.table.latency[row], self.table.num_uops[
+                    row]
+                sig = self.table.port_sig[row]
+                for write in llvm_instr.schedwrites + leaf_writes:
+                    if write is schedwrite or not write.is_complete():
                         continue
-                    assert instr_sw.is_complete() and instr_sw.is_aux(), \
-                        f'[{schedwrite}, {instr_sw}] only 1 incompleted ' \
-                        f'schedwrite is allowed.'
-                    dr_num_uops -= instr_sw.num_uops
-                    dr_ports = utils.listremove(dr_ports, instr_sw.resources)
-                dr_ports = tuple(sorted(dr_ports))
-                candidates.append((dr_latency, dr_num_uops, dr_ports))
-
-            # Pick up a choice for schedwrite.
-            choices = collections.Counter(candidates).most_common()
-            if len(choices):
-                for choice, cnt in choices:
-                    # If latency, num_uops >= 0.
-                    if choice[0] >= 0 and choice[1] >= 0:
-                        best_choice = choice
+                    if write in leaf_writes:
+                        latency -= write.latency
+                    num_uops -= write.num_uops
+                    sig = self.table.remove(sig, write.resources)
+                    if sig is None:
                         break
-                else:
-                    raise ValueError('Not find best choice.')
+                if sig is None or latency < 0 or num_uops < 0:
+                    continue
+                coefs = collections.Counter(
+                    x for x in leaf_writes if not x.is_complete())
+                equations[(tuple(coefs.items()), latency, num_uops, sig)] += 1
+        return equations
 
-                dr_latency = best_choice[0]
-                dr_num_uops = best_choice[1]
-                dr_ports = best_choice[2]
+    def fit_component_leaves(self, component, sw2instrs):
+        '''
+        Fit latency, num_uops and ports of all incompleted leaves of component
+        together. Each user instruction gives an equation over the leaves it
+        uses. Equations with 1 unknown leaf vote for it and the most voted
+        value is fixed, then it is substituted into other equations, so leaves
+        only shared by sequences are solved from leaves used directly. Leaves
+        left underdetermined are not infered, their users are overridden by
+        SchedWriteRes instead. Return infer events.
+        '''
+        equations = self.leaf_equations(component, sw2instrs)
+        fixed = {}
 
-                write = schedwrite
-                if type(schedwrite) is WriteSequence:
-                    write = None
-                    leaf_writes = schedwrite.expand()
-                    for leaf_write in leaf_writes:
-                        if leaf_write.is_complete():
-                            dr_latency -= leaf_write.latency
-                            dr_num_uops -= leaf_write.num_uops
-                            dr_ports = utils.listremove(
-                                dr_ports, leaf_write.resources)
-                            continue
-                        assert write is None, (f'multi leaf schedwrite'
-                                               f'incompleted: {leaf_writes}')
-                        write = leaf_write
-                    dr_ports = tuple(sorted(dr_ports))
+        def residual(coefs, latency, num_uops, sig):
+            unknowns = []
+            for leaf_write, cnt in coefs:
+                if leaf_write not in fixed:
+                    unknowns.append((leaf_write, cnt))
+                    continue
+                leaf_latency, leaf_num_uops, leaf_sig = fixed[leaf_write]
+                latency -= cnt * leaf_latency
+                num_uops -= cnt * leaf_num_uops
+                sig = self.table.remove(
+                    sig, self.table.sig_resources[leaf_sig] * cnt)
+                if sig is None or latency < 0 or num_uops < 0:
+                    return None
+            return unknowns, latency, num_uops, sig
+
+        def divide(latency, num_uops, sig, cnt):
+            counts = self.table.sig_counts[sig]
+            if (latency % cnt or num_uops % cnt
+                    or any(x % cnt for x in counts.values())):
+                return None
+            return latency // cnt, num_uops // cnt, self.table.intern(
+                collections.Counter({x: y // cnt
+                                     for x, y in counts.items()}).elements())
+
+        while True:
+            votes = collections.Counter()
+            for equation, weight in equations.most_common():
+                result = residual(*equation)
+                if result is None or len(result[0]) != 1:
+                    continue
+                unknowns, latency, num_uops, sig = result
+                value = divide(latency, num_uops, sig, unknowns[0][1])
+                if value is not None:
+                    votes[(unknowns[0][0], value)] += weight
+            if not votes:
+                break
+            (leaf_write, value), _ = votes.most_common(1)[0]
+            fixed[leaf_write] = value
+
+        events = []
+        for leaf_write, (latency, num_uops, sig) in fixed.items():
+            ports = self.table.sig_resources[sig]
+            events.append((leaf_write.name, [[int(str(p)) for p in res]
+                                             for res in ports],
+                           [1] * len(ports), latency, num_uops))
+        return events
+
+    def infer_components_in_pool(self, components, sw2instrs):
+        '''
+        Infer components in forked worker processes, which inherit the model
+        so that only component indexes and infer events are transferred.
+        Return [(events, estimated overrides), ...] in components order.
+        '''
+        global _pool_context
+        _pool_context = (self, components, sw2instrs)
+        try:
+            with multiprocessing.get_context('fork').Pool(self.jobs) as pool:
+                return pool.map(
+                    _infer_component_in_worker, range(len(components)),
+                    max(1, len(components) // (self.jobs * 4)))
+        finally:
+            _pool_context = None
+
+    def split_components(self, sw2instrs):
+        '''
+        Split schedwrites into connected components of the instr <->
+        incompleted schedwrite graph. Components and schedwrites in them keep
+        the order of sw2instrs.
+        '''
+        parent = {}
 
-                # Set all resource_cycles to 1 cycle for convenience.
-                write.set_resources(resources=dr_ports,
-                                    resource_cycles=(1, ) * len(dr_ports),
-                                    num_uops=dr_num_uops,
-                                    latency=dr_latency)
+        def find(x):
+            while parent.setdefault(x, x) is not x:
+                parent[x] = parent[parent[x]]
+                x = parent[x]
+            return x
+
+        def union(a, b):
+            parent[find(a)] = find(b)
+
+        for schedwrite in sw2instrs:
+            find(schedwrite)
+            if type(schedwrite) is WriteSequence:
+                for leaf_write in schedwrite.expand():
+                    if not leaf_write.is_complete():
+                        union(leaf_write, schedwrite)
+        for llvm_instr in self.llvm_instrs:
+            writes = [sw for sw in llvm_instr.schedwrites if not sw.is_complete()]
+            for schedwrite in writes[1:]:
+                union(schedwrite, writes[0])
+
+        components = {}
+        for schedwrite in sw2instrs:
+            components.setdefault(find(schedwrite), []).append(schedwrite)
+        return list(components.values())
+
+    @staticmethod
+    def incompleted_leaf(schedwrite):
+        ''' The only incompleted leaf write of schedwrite, None otherwise.  '''
+        if type(schedwrite) is not WriteSequence:
+            return None if schedwrite.is_complete() else schedwrite
+        leaf_writes = [x for x in schedwrite.expand() if not x.is_complete()]
+        return leaf_writes[0] if len(leaf_writes) == 1 else None
+
+    def leaf_choice(self, schedwrite, choice):
+        '''
+        Map (latency, num_uops, port signature) choice of schedwrite to the
+        choice of its incompleted leaf write. None if it doesn't fit.
+        '''
+        latency, num_uops, sig = choice
+        if type(schedwrite) is WriteSequence:
+            for leaf_write in schedwrite.expand():
+                if not leaf_write.is_complete():
+                    continue
+                latency -= leaf_write.latency
+                num_uops -= leaf_write.num_uops
+                sig = self.table.remove(sig, leaf_write.resources)
+                if sig is None:
+                    return None
+        if latency < 0 or num_uops < 0:
+            return None
+        return latency, num_uops, sig
+
+    def minimize_component_instrw(self, component, sw2instrs):
+        '''
+        Choose the def of each incompleted leaf write of component so that
+        the number of instructions overridden by InstRW is minimal. All users
+        of a leaf write vote, whether they use it directly or in a
+        WriteSequence. Choices are made leaf by leaf: unless needs_joint_fit,
+        no user depends on two incompleted leaves, so the per-leaf majority
+        is also the joint minimum. Removal of wrong aux schedwrites is not
+        part of the choice, users it already forced to InstRW just don't
+        vote since they are overridden anyway. Return the infer events and
+        add greedy/minimized override estimates.
+        '''
+        if self.needs_joint_fit(component, sw2instrs):
+            return self.fit_component_leaves(component, sw2instrs)
+
+        # Greedy choices, the same as infer_schedwrite in component order.
+        greedy = {}
+        for schedwrite in component:
+            leaf_write = self.incompleted_leaf(schedwrite)
+            if leaf_write is None or leaf_write in greedy:
+                continue
+            event = self.infer_schedwrite(schedwrite, sw2instrs[schedwrite])
+            if event is not None:
+                greedy[leaf_write] = (event[3], event[4],
+                                      self.table.intern(
+                                          tuple(
+                                              Port.gets(ports)
+                                              for ports in event[1])))
+
+        votes, all_votes, num_voters = {}, {}, {}
+        for schedwrite in component:
+            leaf_write = self.incompleted_leaf(schedwrite)
+            if leaf_write is None:
+                continue
+            instrs = sw2instrs[schedwrite]
+            voters = [x for x in instrs if not x.use_instrw()]
+            for tally, users in ((votes, voters), (all_votes, instrs)):
+                leaf_tally = tally.setdefault(leaf_write, collections.Counter())
+                for choice, cnt in self.table.tally_candidates(
+                        schedwrite, users).items():
+                    choice = self.leaf_choice(schedwrite, choice)
+                    if choice is not None:
+                        leaf_tally[choice] += cnt
+            num_voters[leaf_write] = num_voters.get(leaf_write, 0) + sum(
+                self.table.row(x) is not None for x in voters)
+
+        events = []
+        for leaf_write, leaf_tally in votes.items():
+            # Nobody votes if all users are overridden anyway.
+            if not leaf_tally:
+                leaf_tally = all_votes[leaf_write]
+            if not leaf_tally:
+                continue
+            best_choice, best_cnt = leaf_tally.most_common(1)[0]
+            greedy_choice = greedy.get(leaf_write)
+            # Keep greedy choice on tie.
+            if greedy_choice and leaf_tally[greedy_choice] == best_cnt:
+                best_choice = greedy_choice
+            self.estimated_overrides[0] += num_voters[leaf_write] - votes[
+                leaf_write].get(greedy_choice, 0)
+            self.estimated_overrides[1] += num_voters[leaf_write] - votes[
+                leaf_write][best_choice]
+
+            latency, num_uops, sig = best_choice
+            ports = self.table.sig_resources[sig]
+            events.append((leaf_write.name, [[int(str(p)) for p in res]
+                                             for res in ports],
+                           [1] * len(ports), latency, num_uops))
+        return events
+
+    def report_minimized_instrw(self, ostream=sys.stderr):
+        greedy, minimized = self.estimated_overrides
+        num_instrw = sum(x.use_instrw() for x in self.llvm_instrs)
+        print(f'InstRW overrides of infered schedwrite users: {greedy} with '
+              f'most common defs, {minimized} with minimized defs. '
+              f'{num_instrw} instructions use InstRW.',
+              file=ostream)
+
+    def apply_infer_events(self, events):
+        for name, resources, resource_cycles, latency, num_uops in events:
+            self.infered_writes.add(SchedWrite.get(name))
+            SchedWrite.get(name).set_resources(
+                resources=tuple(Port.gets(ports) for ports in resources),
+                resource_cycles=tuple(resource_cycles),
+                latency=latency,
+                num_uops=num_uops)
+
+    def infer_schedwrite(self, schedwrite, llvm_instrs):
+        '''
+        Infer def for schedwrite (or its only incompleted leaf schedwrite).
+        Return the infered def as a serializable event or None.
+        '''
+        if schedwrite.is_complete():
+            return None
+
+        # Pick up a choice for schedwrite.
+        choices = self.table.tally_candidates(schedwrite,
+                                             llvm_instrs).most_common()
+        if not len(choices):
+            return None
+
+        for choice, cnt in choices:
+            # If latency, num_uops >= 0.
+            if choice[0] >= 0 and choice[1] >= 0:
+                best_choice = choice
+                break
+        else:
+            raise ValueError('Not find best choice.')
+
+        dr_latency = best_choice[0]
+        dr_num_uops = best_choice[1]
+        dr_ports = self.table.sig_resources[best_choice[2]]
+
+        write = schedwrite
+        if type(schedwrite) is WriteSequence:
+            write = None
+            leaf_writes = schedwrite.expand()
+            for leaf_write in leaf_writes:
+                if leaf_write.is_complete():
+                    dr_latency -= leaf_write.latency
+                    dr_num_uops -= leaf_write.num_uops
+                    dr_ports = utils.listremove(dr_ports,
+                                                leaf_write.resources)
+                    continue
+                assert write is None, (f'multi leaf schedwrite'
+                                       f'incompleted: {leaf_writes}')
+                write = leaf_write
+            dr_ports = tuple(sorted(dr_ports))
+
+        # resource_cycles are derived from throughput later.
+        return (write.name, [[int(str(p)) for p in ports]
+                             for ports in dr_ports], [1] * len(dr_ports),
+                dr_latency, dr_num_uops)
+
+    def derive_schedwrite_resource_cycles(self):
+        '''
+        Derive resource_cycles of infered schedwrites from the most common
+        measured throughput of instructions that fully match them.
+        '''
+        write2tps = {}
+        for llvm_instr in self.llvm_instrs:
+            if (not llvm_instr.has_uops_info()
+                    or llvm_instr.uops_info.throughput is None
+                    or not all(x.is_complete()
+                               for x in llvm_instr.schedwrites)):
+                continue
+            uops_info = llvm_instr.uops_info
+            if (llvm_instr.compute_latency() != uops_info.latency
+                    or llvm_instr.compute_num_uops() != uops_info.num_uops
+                    or not utils.cmplist(llvm_instr.compute_resources(),
+                                         uops_info.ports)):
+                continue
+            for schedwrite in llvm_instr.schedwrites:
+                leaf_writes = schedwrite.expand() if type(
+                    schedwrite) is WriteSequence else [schedwrite]
+                for leaf_write in leaf_writes:
+                    if leaf_write in self.infered_writes:
+                        write2tps.setdefault(leaf_write, []).append(
+                            (uops_info.throughput, llvm_instr))
+
+        for write, tps in write2tps.items():
+            tp = collections.Counter(x[0] for x in tps).most_common(1)[0][0]
+            llvm_instr = next(x[1] for x in tps if x[0] == tp)
+            fixed_resources, fixed_cycles = [], []
+            for schedwrite in llvm_instr.schedwrites:
+                leaf_writes = schedwrite.expand() if type(
+                    schedwrite) is WriteSequence else [schedwrite]
+                for leaf_write in leaf_writes:
+                    if leaf_write is not write:
+                        fixed_resources.extend(leaf_write.resources)
+                        fixed_cycles.extend(leaf_write.resource_cycles)
+            resource_cycles = derive_resource_cycles(write.resources, tp,
+                                                     fixed_resources,
+                                                     fixed_cycles)
+            if resource_cycles is not None:
+                write.set_resources(resources=write.resources,
+                                    resource_cycles=resource_cycles,
+                                    latency=write.latency,
+                                    num_uops=write.num_uops)
+
+    def report_unfitted_throughputs(self):
+        if not self.unfitted_throughputs:
+            return
+        print(f'Warning: resource cycles of {len(self.unfitted_throughputs)} '
+              f'instructions can\'t be fitted to measured throughput, '
+              f'1 cycle per uop is used:',
+              file=sys.stderr)
+        for opcode, throughput, bound in self.unfitted_throughputs:
+            print(f'  {opcode}: measured {throughput}, port pressure bound '
+                  f'{bound:.2f}',
+                  file=sys.stderr)
 
     def infer_schedwriteres(self):
         for llvm_instr in self.llvm_instrs:
@@ -139,42 +571,100 @@ class LLVMSchedGen:
             dr_num_uops = llvm_instr.uops_info.num_uops
             dr_ports = llvm_instr.uops_info.ports
 
-            old_schedwrite = None
+            old_schedwrites, aux_ports, aux_cycles = [], [], []
             for schedwrite in llvm_instr.schedwrites:
                 if schedwrite.is_aux():
                     assert dr_latency >= schedwrite.latency
                     dr_num_uops -= schedwrite.num_uops
                     dr_ports = utils.listremove(dr_ports, schedwrite.resources)
+                    aux_ports.extend(schedwrite.resources)
+                    aux_cycles.extend(schedwrite.resource_cycles)
                 else:
-                    assert old_schedwrite is None
-                    old_schedwrite = schedwrite
+                    old_schedwrites.append(schedwrite)
+            # Latency of several non aux schedwrites is their max, they are
+            # replaced by a single SchedWriteRes together.
+            old_schedwrite = old_schedwrites[0] if old_schedwrites else None
+            for schedwrite in old_schedwrites[1:]:
+                llvm_instr.schedwrites.remove(schedwrite)
+
+            dr_ports = tuple(sorted(dr_ports))
+            throughput = llvm_instr.uops_info.throughput
+            dr_resource_cycles = derive_resource_cycles(
+                dr_ports, throughput, aux_ports, aux_cycles)
+            if throughput is not None and dr_resource_cycles is None:
+                ports = llvm_instr.uops_info.ports
+                self.unfitted_throughputs.append(
+                    (llvm_instr.opcode, throughput,
+                     port_pressure_bound(ports, (1, ) * len(ports))))
 
-            if (old_schedwrite and old_schedwrite.latency == dr_latency
+            # Keep old schedwrite if its cycles also fit throughput.
+            if (len(old_schedwrites) == 1 and old_schedwrite.is_complete()
+                    and old_schedwrite.latency == dr_latency
                     and old_schedwrite.num_uops == dr_num_uops
-                    and utils.cmplist(old_schedwrite.resources, dr_ports)):
+                    and utils.cmplist(old_schedwrite.resources, dr_ports)
+                    and (dr_resource_cycles is None or fits_throughput(
+                        old_schedwrite.resources + tuple(aux_ports),
+                        old_schedwrite.resource_cycles + tuple(aux_cycles),
+                        throughput))):
                 continue
 
             assert dr_num_uops >= 0
-            dr_ports = tuple(sorted(dr_ports))
+            if dr_resource_cycles is None:
+                dr_resource_cycles = (1, ) * len(dr_ports)
             schedwriteres = SchedWriteRes(resources=dr_ports,
-                                          resource_cycles=(1, ) *
-                                          len(dr_ports),
+                                          resource_cycles=dr_resource_cycles,
                                           latency=dr_latency,
                                           num_uops=dr_num_uops,
                                           prefix=self.target_cpu.short_name)
             llvm_instr.replace_or_add_schedrw(old_schedwrite, schedwriteres)
             llvm_instr.set_use_instrw(True)
 
+    def infer_read_advance(self):
+        '''
+        Infer ReadAdvance of each SchedRead from the most common advance of
+        the operands it reads. Operands with another advance get a
+        SchedReadAdvance at their position in InstRW of their instruction.
+        '''
+        read2advances = {}
+        for llvm_instr in self.llvm_instrs:
+            for idx, advance in (llvm_instr.compute_read_advances()
+                                 or {}).items():
+                read2advances.setdefault(llvm_instr.schedreads[idx],
+                                         []).append((advance, llvm_instr, idx))
+
+        overridden = set()
+        for schedread, advances in read2advances.items():
+            advance = collections.Counter(
+                x[0] for x in advances).most_common(1)[0][0]
+            schedread.set_advance(advance)
+            self.infered_reads.append(schedread)
+            for instr_advance, llvm_instr, idx in advances:
+                if instr_advance == advance:
+                    continue
+                # schedreads may be shared with other instructions.
+                if llvm_instr not in overridden:
+                    llvm_instr.schedreads = list(llvm_instr.schedreads)
+                    overridden.add(llvm_instr)
+                llvm_instr.schedreads[idx] = SchedReadAdvance(
+                    instr_advance, prefix=self.target_cpu.short_name)
+                llvm_instr.set_use_instrw(True)
+        self.read_advance_stats['reads'] = len(self.infered_reads)
+        self.read_advance_stats['overrides'] = len(overridden)
+
     def validate_infered_resource(self):
+        mismatched_rows = self.table.mismatched_rows()
+        assert not mismatched_rows, 'Infered resources mismatch: ' + ', '.join(
+            self.table.llvm_instrs[row].opcode for row in mismatched_rows)
+
+    def check_throughput_bound(self):
+        ''' Compare port pressure bound of inferred model with measured Tp. '''
+        self.throughput_report = ThroughputReport()
         for llvm_instr in self.llvm_instrs:
-            if not llvm_instr.has_uops_info():
-                continue
-            assert (
-                llvm_instr.uops_info.latency == llvm_instr.compute_latency())
-            assert (
-                llvm_instr.uops_info.num_uops == llvm_instr.compute_num_uops())
-            assert utils.cmplist(llvm_instr.uops_info.ports,
-                                 llvm_instr.compute_resources())
+            if (llvm_instr.has_uops_info()
+                    and not llvm_instr.is_invalid(self.target_cpu)):
+                self.throughput_report.check(
+                    llvm_instr, llvm_instr.compute_resources(),
+                    llvm_instr.compute_resource_cycles())
 
     def tag_unsupported_schedwrite(self):
         sw2instrs = {}
@@ -195,15 +685,13 @@ class LLVMSchedGen:
                                        for llvm_instr in llvm_instrs)
             schedwrite.set_supported(is_spt)
 
-    def emit_scheduler(self, ostream):
-        with open(self.target_cpu.template_td) as td:
-            ostream.write(td.read())
-        ostream.write(f'\n//==={"-"*70}===//\n')
-        ostream.write('// The following definitons are infered by smg.\n')
-        ostream.write(f'//==={"-"*70}===//\n\n')
-        ostream.write('// Infered SchedWrite definition.\n')
+    def get_ports_name(self, ports):
+        ''' Name of ports in emitted td, template name of group if any.  '''
+        name = self.template_group_names.get(tuple(ports))
+        return self.target_cpu.get_ports_name(ports) if name is None else name
 
-        # Populate schedwrite and emit them.
+    def get_lived_schedwrites(self):
+        ''' SchedWrites used by instructions, WriteSequences expanded.  '''
         lived_schedwrites = set()
         for llvm_instr in self.llvm_instrs:
             for instr_sw in llvm_instr.schedwrites:
@@ -213,6 +701,129 @@ class LLVMSchedGen:
                         lived_schedwrites.add(leaf_write)
                 elif type(instr_sw) is SchedWrite:
                     lived_schedwrites.add(instr_sw)
+        return lived_schedwrites
+
+    def get_instrw_groups(self):
+        ''' Return {schedrws: instructions} of instructions using InstRW.  '''
+        schedrws2instrs = {}
+        for llvm_instr in self.llvm_instrs:
+            if not llvm_instr.use_instrw():
+                continue
+
+            # SchedWriteRes comes first, then SchedWrite, SchedRead. Reads
+            # keep their operand order.
+            schedrws = tuple(
+                sorted(llvm_instr.schedreads + llvm_instr.schedwrites,
+                       key=lambda x:
+                       (isinstance(x, SchedRead), type(x) is SchedWrite,
+                        type(x) is SchedWriteRes, ''
+                        if isinstance(x, SchedRead) else x.name)))
+            schedrws2instrs.setdefault(schedrws, []).append(llvm_instr)
+
+        return dict(
+            sorted(schedrws2instrs.items(), key=lambda x:
+                   (x[0][0], len(x[0]))))
+
+    def get_proc_res_groups(self):
+        '''
+        Return (new groups, {ports: template name}) of port groups used by
+        emitted WriteRes and SchedWriteRes. New groups are not defined in the
+        template yet, template groups with the same ports are reused under
+        their own names. A superset group is never reused, because it would
+        let uops issue on ports they can't use.
+        '''
+        td = TdSchedModel(self.target_cpu)
+        td.parse_file(self.target_cpu.template_td)
+        defined = {
+            frozenset(ports): name
+            for name, ports in td.proc_resources.items()
+        }
+
+        # The same writes emit_scheduler emits with resources.
+        writes = [
+            x for x in self.get_lived_schedwrites()
+            if x.is_supported() and x.is_complete()
+        ]
+        writes.extend(x for schedrws in self.get_instrw_groups()
+                      for x in schedrws if type(x) is SchedWriteRes)
+        groups = set()
+        for write in writes:
+            groups.update(write.resources)
+
+        new_groups, template_names = [], {}
+        for ports in sorted(groups):
+            if len(ports) < 2:
+                continue
+            name = defined.get(frozenset(ports))
+            if name is None:
+                new_groups.append(ports)
+            elif name != self.target_cpu.get_ports_name(ports):
+                template_names[ports] = name
+        return new_groups, template_names
+
+    def emit_proc_res_groups(self, ostream):
+        groups, self.template_group_names = self.get_proc_res_groups()
+        if not len(groups):
+            return
+        ostream.write('// Infered ProcResGroup definition.\n')
+        aligned_width = math.ceil(
+            (max(len(self.get_ports_name(ports))
+                 for ports in groups) + 1) / 2) * 2
+        for ports in groups:
+            name = self.get_ports_name(ports)
+            port_names = [
+                self.get_ports_name((port, )) for port in ports
+            ]
+            ostream.write(f'def {name}' + ' ' * (aligned_width - len(name)) +
+                          ': ProcResGroup<[' + ', '.join(port_names) + ']>;\n')
+        ostream.write('\n')
+
+    @staticmethod
+    def emit_template(ostream, template):
+        '''
+        Write template with its ReadAdvance defs replaced by infered ones.
+        Return names of SchedReads that have a ReadAdvance in template.
+        '''
+        template_reads = set()
+
+        def infered_read_advance(match):
+            template_reads.add(match.group(1))
+            schedread = SchedRead.get(match.group(1))
+            if schedread is None or schedread.advance is None:
+                return match.group(0)
+            return f'def : ReadAdvance<{schedread.name}, {schedread.advance}>;'
+
+        ostream.write(
+            re.sub(r'def\s*:\s*ReadAdvance<\s*(\w+)\s*,\s*-?\d+\s*>;',
+                   infered_read_advance, template))
+        return template_reads
+
+    def emit_read_advances(self, ostream, template_reads):
+        ''' Emit ReadAdvance of infered SchedReads that template lacks.  '''
+        schedreads = [
+            x for x in self.infered_reads if x.name not in template_reads
+        ]
+        if not schedreads:
+            return
+        ostream.write('// Infered ReadAdvance.\n')
+        for schedread in schedreads:
+            ostream.write(
+                f'def : ReadAdvance<{schedread.name}, {schedread.advance}>;\n')
+        ostream.write('\n')
+
+    def emit_scheduler(self, ostream):
+        with open(self.target_cpu.template_td) as td:
+            template = td.read()
+        template_reads = self.emit_template(ostream, template)
+        ostream.write(f'\n//==={"-"*70}===//\n')
+        ostream.write('// The following definitons are infered by smg.\n')
+        ostream.write(f'//==={"-"*70}===//\n\n')
+        self.emit_read_advances(ostream, template_reads)
+        self.emit_proc_res_groups(ostream)
+        ostream.write('// Infered SchedWrite definition.\n')
+
+        # Populate schedwrite and emit them.
+        lived_schedwrites = self.get_lived_schedwrites()
         dead_schedwrites = tuple(
             sorted(set(SchedWrite.get_all()) - lived_schedwrites))
         lived_schedwrites = collections.deque(sorted(lived_schedwrites))
@@ -221,8 +832,9 @@ class LLVMSchedGen:
             write = lived_schedwrites.popleft()
             write_mem = SchedWrite.get(write.name + 'Ld')
             writes = (write, )
+            # Memory variant may be dead if all its users are overridden.
 
-            if write_mem:
+            if write_mem in lived_schedwrites:
                 lived_schedwrites.remove(write_mem)
                 writes = (write, write_mem)
                 if all(not x.is_supported() for x in (write, write_mem)):
@@ -248,22 +860,7 @@ class LLVMSchedGen:
             self.emit_write_res_unsupported(ostream, dead_write)
 
         # Group instrs which used InstRW based on schedrws.
-        schedrws2instrs = {}
-        for llvm_instr in self.llvm_instrs:
-            if not llvm_instr.use_instrw():
-                continue
-
-            # SchedWriteRes comes first, then SchedWrite, SchedRead.
-            schedrws = tuple(
-                sorted(llvm_instr.schedreads + llvm_instr.schedwrites,
-                       key=lambda x:
-                       (type(x) is SchedRead, type(x) is SchedWrite, type(x) is
-                        SchedWriteRes, x.name)))
-            schedrws2instrs.setdefault(schedrws, []).append(llvm_instr)
-
-        schedrws2instrs = dict(
-            sorted(schedrws2instrs.items(), key=lambda x:
-                   (x[0][0], len(x[0]))))
+        schedrws2instrs = self.get_instrw_groups()
 
         # Emit SchedWriteRes and InstRW.
         ostream.write('\n// Infered SchedWriteRes and InstRW definition.\n')
@@ -273,12 +870,46 @@ class LLVMSchedGen:
                 if type(schedrw) is SchedWriteRes and schedrw not in emitted:
                     emitted.add(schedrw)
                     ostream.write('\n')
-                    self.emit_schedwriteres(ostream, schedrw)
-            self.emit_instrw(ostream, schedrws, llvm_instrs)
+                    self.emit_cached(
+                        ostream,
+                        ('SchedWriteRes', schedrw.name, schedrw.resources,
+                         schedrw.resource_cycles, schedrw.latency,
+                         schedrw.num_uops), self.emit_schedwriteres, schedrw)
+                elif (type(schedrw) is SchedReadAdvance
+                      and schedrw not in emitted):
+                    emitted.add(schedrw)
+                    ostream.write(f'\ndef {schedrw.name} : '
+                                  f'SchedReadAdvance<{schedrw.advance}>;\n')
+            instrs_regexes, instrs_opcode = self.plan_instrw(llvm_instrs)
+            self.emit_cached(ostream, ('InstRW', [x.name for x in schedrws],
+                                       instrs_regexes, instrs_opcode),
+                             self.emit_instrw, schedrws, instrs_regexes,
+                             instrs_opcode)
 
         # Emit tailer bracket
         ostream.write('\n}\n')
 
+    def emit_cached(self, ostream, key, emit_fn, *args):
+        ''' Reuse text emitted by previous run if incremental state is used. '''
+        if self.state is None:
+            emit_fn(ostream, *args)
+            return
+
+        def emitter():
+            buffer = io.StringIO()
+            emit_fn(buffer, *args)
+            return buffer.getvalue()
+
+        self.state.emit_block(ostream, key, emitter)
+
+    def get_res_defs(self, schedwrite):
+        ''' Return [(resource, cycles), ...] with cycles summed per resource. '''
+        res_defs = {}
+        for res, cycles in zip(schedwrite.resources,
+                               schedwrite.resource_cycles):
+            res_defs[res] = res_defs.get(res, 0) + cycles
+        return list(res_defs.items())
+
     def emit_write_res_pair_unsupported(self, ostream, schedwrite):
         ostream.write(
             f'defm : X86WriteResPairUnsupported<{schedwrite.name}>;\n')
@@ -287,21 +918,34 @@ class LLVMSchedGen:
         ostream.write(f'defm : X86WriteResUnsupported<{schedwrite.name}>;\n')
 
     def try_emit_write_res_pair(self, ostream, write_reg, write_mem):
-        ports_diff = utils.listdiff(write_reg.resources, write_mem.resources)
-        # Return false if ports_diff is empty or all diffs aren't load ports.
-        if len(ports_diff) == 0 or any(port != self.target_cpu.load_ports
-                                       for port in ports_diff):
+        '''
+        Fold write_reg/write_mem into WriteResPair whose memory variant is
+        register variant plus 1 cycle on load ports, LoadUOps more uops and
+        LoadLat more latency. Store/RMW forms aren't folded memory variants,
+        they can't be expressed by WriteResPair.
+        '''
+        self.pair_stats['candidates'] += 1
+        load_ports = self.target_cpu.load_ports
+        res_defs = self.get_res_defs(write_reg)
+        if any(res == load_ports for res, _ in res_defs):
             return False
 
-        num_loads = len(ports_diff)
-        if write_mem.num_uops - write_reg.num_uops != num_loads:
+        # Memory variant must use the same cycles on execution ports.
+        mem_res_defs = dict(self.get_res_defs(write_mem))
+        if mem_res_defs.get(load_ports) != 1:
+            return False
+        del mem_res_defs[load_ports]
+        if mem_res_defs != dict(res_defs):
             return False
 
+        load_uops = write_mem.num_uops - write_reg.num_uops
+        if load_uops < 0:
+            return False
+        self.pair_stats['folded'] += 1
         short_name = self.target_cpu.short_name
 
-        res_defs = collections.Counter(write_reg.resources).items()
         exe_ports = '[' + ', '.join(
-            self.target_cpu.get_ports_name(res[0]) for res in res_defs) + ']'
+            self.get_ports_name(res[0]) for res in res_defs) + ']'
         latstr = self.target_cpu.lat2str(write_reg.latency)
 
         load_lat = write_mem.latency - write_reg.latency
@@ -312,8 +956,8 @@ class LLVMSchedGen:
                       f'{exe_ports}, {latstr}')
         tailer = '>;\n'
         must_present = False
-        if num_loads != 1:
-            tailer = f', {num_loads}' + tailer
+        if load_uops != 1:
+            tailer = f', {load_uops}' + tailer
             must_present = True
         if must_present or load_lat != self.target_cpu.load_latency:
             tailer = f', {load_lat}' + tailer
@@ -321,7 +965,7 @@ class LLVMSchedGen:
         if must_present or write_reg.num_uops != 1:
             tailer = f', {write_reg.num_uops}' + tailer
             must_present = True
-        if must_present or write_reg.resource_cycles != [1]:
+        if must_present or [res[1] for res in res_defs] != [1]:
             resource_cycles = '[' + ', '.join(str(res[1])
                                               for res in res_defs) + ']'
             tailer = f', {resource_cycles}' + tailer
@@ -330,9 +974,9 @@ class LLVMSchedGen:
 
     def emit_write_res(self, ostream, schedwrite):
         num_uops = schedwrite.num_uops
-        res_defs = collections.Counter(schedwrite.resources).items()
+        res_defs = self.get_res_defs(schedwrite)
         exe_ports = '[' + ', '.join(
-            self.target_cpu.get_ports_name(res[0]) for res in res_defs) + ']'
+            self.get_ports_name(res[0]) for res in res_defs) + ']'
         resource_cycles = tuple(res[1] for res in res_defs)
         latstr = self.target_cpu.lat2str(schedwrite.latency)
 
@@ -354,9 +998,9 @@ class LLVMSchedGen:
             ostream.write(tailer)
 
     def emit_schedwriteres(self, ostream, schedwriteres):
-        res_defs = collections.Counter(schedwriteres.resources).items()
+        res_defs = self.get_res_defs(schedwriteres)
         exe_ports = '[' + ', '.join(
-            self.target_cpu.get_ports_name(res[0]) for res in res_defs) + ']'
+            self.get_ports_name(res[0]) for res in res_defs) + ']'
         resource_cycles = tuple(res[1] for res in res_defs)
         latstr = self.target_cpu.lat2str(schedwriteres.latency)
 
@@ -374,16 +1018,74 @@ class LLVMSchedGen:
             tailer = ';\n'
         ostream.write(tailer)
 
-    def emit_instrw(self, ostream, schedrws, llvm_instrs):
+    def instregex_cost(self, regex):
+        '''
+        Number of instructions llvm-tblgen tests regex against: those with its
+        literal prefix, or all of them if it has none.
+        '''
+        prefix, pattern = utils.tblgen_regex_prefix(regex)
+        if pattern is None:
+            return 1
+        if not prefix:
+            return len(self.sorted_opcodes)
+        begin = bisect.bisect_left(self.sorted_opcodes, prefix)
+        end = bisect.bisect_left(self.sorted_opcodes,
+                                 prefix[:-1] + chr(ord(prefix[-1]) + 1))
+        return end - begin
+
+    def plan_instrw(self, llvm_instrs):
+        '''
+        Return (instregexes, opcodes of instrs) of an InstRW. A regex without
+        literal prefix is split at its leading group, and regexes that test
+        too many instructions for what they match fall back to instrs.
+        '''
+        opcodes = [x.opcode for x in llvm_instrs]
         instrs_regexes, instrs_opcode = [], []
+        for expr in utils.RegexReducer(4).reduce(opcodes):
+            if not any(char in expr for char in ('(', ')', '|', '?', '*')):
+                instrs_opcode.append(expr)
+                continue
 
-        for expr in utils.RegexReducer(4).reduce(
-            [x.opcode for x in llvm_instrs]):
-            if any(char in expr for char in ('(', ')', '|', '?', '*')):
-                instrs_regexes.append(expr)
+            regex = f'^{expr}$'
+            members = [x for x in opcodes if re.match(regex, x)]
+            cost = self.instregex_cost(regex)
+            self.instrw_cost['before'] += cost
+            pieces = [
+                x for x in utils.split_leading_group(regex)
+                if any(re.match(x, y) for y in members)
+            ]
+            pieces_cost = sum(self.instregex_cost(x) for x in pieces)
+            if pieces_cost < cost:
+                self.instrw_cost['split'] += 1
+                regexes, cost = pieces, pieces_cost
             else:
-                instrs_opcode.append(expr)
+                regexes = [regex]
+
+            if cost > INSTREGEX_COST_FACTOR * len(members):
+                self.instrw_cost['to_instrs'] += 1
+                self.instrw_cost['after'] += len(members)
+                instrs_opcode.extend(members)
+            else:
+                self.instrw_cost['after'] += cost
+                for regex in regexes:
+                    # Splitting may leave plain opcodes.
+                    if re.fullmatch(r'\^\w+\$', regex):
+                        instrs_opcode.append(regex[1:-1])
+                    else:
+                        instrs_regexes.append(regex)
+        self.instrw_cost['instregex'] += len(instrs_regexes)
+        self.instrw_cost['instrs'] += len(instrs_opcode)
+        return instrs_regexes, instrs_opcode
+
+    def print_instrw_cost(self, ostream=sys.stderr):
+        cost = self.instrw_cost
+        print(f'InstRW: {cost["instregex"]} instregex, {cost["instrs"]} instrs. '
+              f'{cost["split"]} instregexes split at leading group, '
+              f'{cost["to_instrs"]} replaced by instrs. Instructions tested by '
+              f'instregex: {cost["before"]} -> {cost["after"]}.',
+              file=ostream)
 
+    def emit_instrw(self, ostream, schedrws, instrs_regexes, instrs_opcode):
         # Emit instregex.
         if instrs_regexes:
             header = 'def : InstRW<[' + ', '.join([x.name for x in schedrws
@@ -395,7 +1097,7 @@ class LLVMSchedGen:
                     ostream.write(',\n' + ' ' * len(header))
                 else:
                     indent = True
-                ostream.write(f'"^{instrs_regex}$"')
+                ostream.write(f'"{instrs_regex}"')
             ostream.write(')>;\n')
 
         # Emit instrs.
@@ -414,10 +1116,125 @@ class LLVMSchedGen:
 
 
 def main(args):
-    target_cpu = target.get_target(args.target_cpu)
-    with open(args.jf) as jf:
-        llvm_instrs = parse_llvm_instr_info(json.load(jf), target_cpu)
-
+    target_cpu, llvm_instrs = load_model(args.jf, args.target_cpu,
+                                         args.layer)
+    if target_cpu.template_td is None:
+        sys.exit(f'{target_cpu.name} has no template td, it can only be '
+                 f'used as reference cpu')
+    state = None
+    if args.incremental:
+        state = IncrementalState(args.incremental, target_cpu)
     ostream = sys.stdout if args.o == '-' else open(args.o, 'w')
-    LLVMSchedGen(llvm_instrs, target_cpu).gen_scheduler(ostream)
+    schedgen = LLVMSchedGen(llvm_instrs, target_cpu, state,
+                            args.minimize_instrw, args.jobs)
+    schedgen.gen_scheduler(ostream)
     ostream.close()
+    schedgen.print_instrw_cost()
+    if schedgen.read_advance_stats['reads']:
+        print(f'ReadAdvance: {schedgen.read_advance_stats["reads"]} '
+              f'SchedReads infered, {schedgen.read_advance_stats["overrides"]} '
+              f'instructions use SchedReadAdvance.',
+              file=sys.stderr)
+    print(f'WriteResPair: {schedgen.pair_stats["folded"]} of '
+          f'{schedgen.pair_stats["candidates"]} Foo/FooLd pairs folded.',
+          file=sys.stderr)
+    if args.minimize_instrw:
+        schedgen.report_minimized_instrw()
+    schedgen.throughput_report.print_summary()
+    if args.tp_report:
+        schedgen.throughput_report.dump(args.tp_report)
+    if state is not None:
+        state.save()
+
+
+if __name__ == '__main__':
+    import copy, tempfile
+    from lib import target
+
+    class SchedGenChecker(unittest.TestCase):
+        @staticmethod
+        def schedgen_of(llvm_instrs):
+            ''' LLVMSchedGen with only what the tested methods use.  '''
+            schedgen = LLVMSchedGen.__new__(LLVMSchedGen)
+            schedgen.llvm_instrs = llvm_instrs
+            schedgen.target_cpu = target.get_target('alderlake-p')
+            schedgen.read_advance_stats = collections.Counter()
+            schedgen.infered_reads = []
+            schedgen.template_group_names = {}
+            return schedgen
+
+        @staticmethod
+        def fma(opcode, acc_cycles):
+            schedreads = [
+                SchedRead('TestReadAcc'),
+                SchedRead('ReadDefault'),
+                SchedRead('TestReadSrc')
+            ]
+            llvm_instr = LLVMInstr(opcode, schedreads, [], None)
+            llvm_instr.set_uops_info(UopsInfo(9, 0.5, [], 2))
+            llvm_instr.set_op_latency([['REG0', 'REG0', 'cycles', acc_cycles],
+                                       ['REG1', 'REG0', 'cycles', 9],
+                                       ['MEM0', 'REG0', 'cycles_addr', 9]])
+            return llvm_instr
+
+        def test_infer_read_advance(self):
+            # Accumulator and source operands get their own advances.
+            llvm_instrs = [
+                self.fma('TESTFMA0', 5),
+                self.fma('TESTFMA1', 5),
+                self.fma('TESTFMA2', 7)
+            ]
+            schedgen = self.schedgen_of(llvm_instrs)
+            schedgen.infer_read_advance()
+            self.assertEqual(SchedRead('TestReadAcc').advance, 4)
+            self.assertEqual(SchedRead('TestReadSrc').advance, 0)
+            self.assertEqual(SchedRead('ReadDefault').advance, None)
+            self.assertEqual(schedgen.read_advance_stats['overrides'], 1)
+            self.assertFalse(llvm_instrs[0].use_instrw())
+            # Only the differing operand is overridden, in its position.
+            self.assertEqual(
+                [x.name for x in llvm_instrs[2].schedreads],
+                ['ADLPReadAdvance2', 'ReadDefault', 'TestReadSrc'])
+            self.assertTrue(llvm_instrs[2].use_instrw())
+
+            # Infered reads missing from template get a ReadAdvance def.
+            ostream = io.StringIO()
+            template_reads = schedgen.emit_template(
+                ostream, 'def : ReadAdvance<TestReadAcc, 1>;\n')
+            self.assertEqual(ostream.getvalue(),
+                             'def : ReadAdvance<TestReadAcc, 4>;\n')
+            ostream = io.StringIO()
+            schedgen.emit_read_advances(ostream, template_reads)
+            self.assertEqual(
+                ostream.getvalue(), '// Infered ReadAdvance.\n'
+                'def : ReadAdvance<TestReadSrc, 0>;\n\n')
+
+        def test_get_proc_res_groups(self):
+            # Only groups of emitted SchedWriteRes are collected, and a
+            # template group is reused under its own name without renaming
+            # it in target.
+            target_cpu = copy.copy(target.get_target('alderlake-p'))
+            p01, p15, p56 = (Port.gets(x) for x in ((0, 1), (1, 5), (5, 6)))
+            schedgen = self.schedgen_of([
+                LLVMInstr('TESTOP0', [], [
+                    SchedWriteRes((p01, p15), (1, 1), 1, 2, 'ADLP')
+                ], None),
+                LLVMInstr('TESTOP1', [],
+                          [SchedWriteRes((p56, ), (1, ), 1, 1, 'ADLP')], None)
+            ])
+            schedgen.llvm_instrs[0].set_use_instrw(True)
+            with tempfile.NamedTemporaryFile('w', suffix='.td') as td:
+                td.write('def ADLPPortVec : ProcResGroup<'
+                         '[ADLPPort00, ADLPPort01]>;\n')
+                td.flush()
+                target_cpu.template_td = td.name
+                schedgen.target_cpu = target_cpu
+                groups, template_names = schedgen.get_proc_res_groups()
+            self.assertEqual(groups, [p15])
+            self.assertEqual(template_names, {p01: 'ADLPPortVec'})
+            self.assertEqual(target_cpu.get_ports_name(p01),
+                             'ADLPPort00_01')
+            schedgen.template_group_names = template_names
+            self.assertEqual(schedgen.get_ports_name(p01), 'ADLPPortVec')
+
+    unittest.main()
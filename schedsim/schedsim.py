@@ -0,0 +1,200 @@
+import re, sys, collections, unittest
+
+from lib.snapshot import load_model
+from lib.llvm_instr import *
+from schedgen.schedgen import LLVMSchedGen
+
+DEFAULT_ISSUE_WIDTH = 6
+
+
+class KernelInstr:
+    ''' An instruction of kernel with its register defs and uses.  '''
+    def __init__(self, opcode, defs, uses, line_no):
+        self.opcode = opcode
+        self.defs = defs
+        self.uses = uses
+        self.line_no = line_no
+
+
+def parse_kernel(path):
+    '''
+    Parse kernel file. Each line is "OPCODE [defs = uses]", registers are
+    separated by comma or space, "#" starts a comment. e.g.
+
+        IMUL64rr rax = rax, rcx
+        ADD64rr rcx = rcx, rdx
+    '''
+    kernel = []
+    with open(path) as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.split('#')[0].strip()
+            if not line:
+                continue
+            opcode, _, operands = line.partition(' ')
+            defs, uses = '', operands
+            if '=' in operands:
+                defs, _, uses = operands.partition('=')
+            kernel.append(
+                KernelInstr(opcode, re.findall(r'[^\s,]+', defs),
+                            re.findall(r'[^\s,]+', uses), line_no))
+    return kernel
+
+
+def get_issue_width(target_cpu):
+    if target_cpu.template_td is None:
+        return DEFAULT_ISSUE_WIDTH
+    with open(target_cpu.template_td) as td:
+        match = re.search(r'let\s+IssueWidth\s*=\s*(\d+)', td.read())
+    return int(match.group(1)) if match else DEFAULT_ISSUE_WIDTH
+
+
+class SchedSimulator:
+    '''
+    Greedy port/dependency simulation of a kernel loop on the inferred model.
+    Instructions are dispatched in order, IssueWidth uops per cycle. Each
+    instruction starts once its uses are ready, each of its resources picks
+    the port of the group that frees up first and keeps it busy for its
+    cycles. Defs are ready latency cycles after the instruction starts.
+    '''
+    def __init__(self, kernel, opc2instr, issue_width):
+        self.kernel = kernel
+        self.issue_width = issue_width
+        self.descs = []
+        for kernel_instr in kernel:
+            llvm_instr = opc2instr[kernel_instr.opcode]
+            self.descs.append(
+                (llvm_instr.compute_latency(), llvm_instr.compute_num_uops(),
+                 tuple(
+                     zip(llvm_instr.compute_resources(),
+                         llvm_instr.compute_resource_cycles()))))
+
+    def run(self, iterations):
+        reg_ready = {}
+        port_free = {}
+        port_busy = collections.Counter()
+        dispatch_cycle, dispatch_uops = 0, 0
+        iter_end = []
+        for _ in range(iterations):
+            end = 0
+            for kernel_instr, (latency, num_uops,
+                               res_defs) in zip(self.kernel, self.descs):
+                # Front end dispatches issue_width uops per cycle.
+                dispatch_uops += num_uops
+                while dispatch_uops > self.issue_width:
+                    dispatch_uops -= self.issue_width
+                    dispatch_cycle += 1
+
+                start = max([dispatch_cycle] +
+                            [reg_ready.get(reg, 0) for reg in kernel_instr.uses])
+                issue = start
+                for ports, cycles in res_defs:
+                    port = min(ports, key=lambda x: (port_free.get(x, 0), x))
+                    port_start = max(start, port_free.get(port, 0))
+                    port_free[port] = port_start + cycles
+                    port_busy[port] += cycles
+                    issue = max(issue, port_start)
+
+                for reg in kernel_instr.defs:
+                    reg_ready[reg] = issue + latency
+                end = max(end, issue + latency)
+            iter_end.append(end)
+        return iter_end, port_busy
+
+
+def steady_state(iter_end):
+    '''
+    Cycles per iteration measured over the second half of iterations, or
+    averaged over all iterations if there are too few for a second half.
+    '''
+    half = len(iter_end) // 2
+    if half == 0 or len(iter_end) - 1 == half:
+        return iter_end[-1] / len(iter_end)
+    return (iter_end[-1] - iter_end[half]) / (len(iter_end) - 1 - half)
+
+
+def main(args):
+    target_cpu, llvm_instrs = load_model(args.jf, args.target_cpu,
+                                         args.layer)
+    kernel = parse_kernel(args.kernel)
+    opc2instr = {llvm_instr.opcode: llvm_instr for llvm_instr in llvm_instrs}
+    for kernel_instr in kernel:
+        if kernel_instr.opcode not in opc2instr:
+            sys.exit(f'{args.kernel}:{kernel_instr.line_no}: unknown opcode '
+                     f'{kernel_instr.opcode}')
+
+    # Infer the model in memory, nothing is emitted.
+    LLVMSchedGen(llvm_instrs, target_cpu)
+    for kernel_instr in kernel:
+        llvm_instr = opc2instr[kernel_instr.opcode]
+        if not all(x.is_complete() for x in llvm_instr.schedwrites):
+            sys.exit(f'{args.kernel}:{kernel_instr.line_no}: '
+                     f'{kernel_instr.opcode} has incompleted schedwrites')
+
+    issue_width = args.issue_width or get_issue_width(target_cpu)
+    simulator = SchedSimulator(kernel, opc2instr, issue_width)
+    iter_end, port_busy = simulator.run(args.iterations)
+    cycles = steady_state(iter_end)
+    num_uops = sum(desc[1] for desc in simulator.descs)
+
+    print(f'Iterations:        {args.iterations}')
+    print(f'Instructions:      {len(kernel)}')
+    print(f'Total uops:        {num_uops}')
+    print(f'Issue width:       {issue_width}')
+    print(f'Cycles/iteration:  {cycles:.2f}')
+    if cycles:
+        print(f'IPC:               {len(kernel) / cycles:.2f}')
+    print('\nPort pressure (cycles/iteration):')
+    for port in sorted(port_busy):
+        print(f'  {target_cpu.get_ports_name((port, )):24} '
+              f'{port_busy[port] / args.iterations:.2f}')
+
+
+if __name__ == '__main__':
+
+    class SchedSimChecker(unittest.TestCase):
+        @staticmethod
+        def simulator_of(kernel, issue_width=6):
+            p1, p0156 = Port.gets((1, )), Port.gets((0, 1, 5, 6))
+            opc2instr = {
+                'TESTIMUL': LLVMInstr('TESTIMUL', [], [
+                    SchedWriteRes((p1, ), (1, ), 3, 1, 'TEST')
+                ], None),
+                'TESTADD': LLVMInstr('TESTADD', [], [
+                    SchedWriteRes((p0156, ), (1, ), 1, 1, 'TEST')
+                ], None),
+            }
+            return SchedSimulator(kernel, opc2instr, issue_width)
+
+        def test_dependency_chain(self):
+            # Each IMUL waits for the previous one, its latency bounds the
+            # loop, while the ADD chain beside it hides under it.
+            kernel = [
+                KernelInstr('TESTIMUL', ['rax'], ['rax', 'rcx'], 1),
+                KernelInstr('TESTADD', ['rdx'], ['rdx'], 2)
+            ]
+            iter_end, port_busy = self.simulator_of(kernel).run(100)
+            self.assertEqual(iter_end[:3], [3, 6, 9])
+            self.assertAlmostEqual(steady_state(iter_end), 3)
+            self.assertEqual(port_busy[Port(1)], 100)
+            self.assertEqual(sum(port_busy.values()), 200)
+
+        def test_independent(self):
+            # Without dependencies IMULs are bound by port 1 throughput.
+            kernel = [KernelInstr('TESTIMUL', ['rax'], ['rcx'], 1)]
+            iter_end, _ = self.simulator_of(kernel).run(100)
+            self.assertAlmostEqual(steady_state(iter_end), 1)
+
+        def test_issue_width(self):
+            # 4 independent ADDs on 4 ports are bound by issue width 2.
+            kernel = [
+                KernelInstr('TESTADD', [f'r{i}'], [], i) for i in range(4)
+            ]
+            iter_end, _ = self.simulator_of(kernel, 2).run(100)
+            self.assertAlmostEqual(steady_state(iter_end), 2)
+
+        def test_steady_state(self):
+            self.assertEqual(steady_state([4, 6, 8, 10]), 2)
+            self.assertEqual(steady_state([3]), 3)
+            self.assertEqual(steady_state([3, 5]), 2.5)
+
+    unittest.main()
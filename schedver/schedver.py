@@ -1,19 +1,157 @@
-import sys, os, json, subprocess
-from lib import target
-from lib.info_parser import parse_smv_instr_info, parse_llvm_instr_info
+import sys, os, json, csv, collections, functools
+from lib import runner
+from lib.info_parser import parse_smv_instr_info
+from lib.snapshot import load_model
+from lib.td_parser import TdSchedModel
+from lib.throughput import derive_resource_cycles, fits_throughput
 from lib.llvm_instr import *
 
 
 def get_smv_instrs(target_cpu):
-    smv_instrs_json = subprocess.run(
-        f'llvm-smv -mcpu={target_cpu.proc_name}',
-        shell=True,
-        check=True,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.DEVNULL).stdout.decode('utf-8')
+    cmd = ['llvm-smv', f'-mcpu={target_cpu.proc_name}']
+    smv_instrs_json = runner.run(cmd, check=True).stdout.decode('utf-8')
     return parse_smv_instr_info(json.loads(smv_instrs_json), target_cpu)
 
 
+def format_port_counts(port_counts):
+    ''' Format port counts as "Port" field of input json. '''
+    return [[cycles, [int(str(p)) for p in ports]]
+            for ports, cycles in port_counts]
+
+
+class MismatchReport:
+    ''' Collect all mismatches found by verifier.  '''
+    KINDS = ('missing', 'latency', 'num_uops', 'ports', 'unsupported',
+             'unresolved', 'overlap', 'read_advance')
+    FIELDS = ('opcode', 'schedwrites', 'kind', 'expected', 'actual')
+
+    def __init__(self):
+        self.mismatches = []
+        self.num_checked = 0
+
+    def compare(self, llvm_instrs, expected, actual):
+        '''
+        Compare columns of expected and actual (latency, num_uops,
+        port_counts) tables. actual row is None if instruction is missing.
+        A latency or num_uops column equal as a whole is skipped, rows are
+        only searched in differing columns. Port counts are matched per row
+        but memoized, since most instructions share a few signatures.
+        '''
+        self.num_checked += len(llvm_instrs)
+        for llvm_instr, act in zip(llvm_instrs, actual):
+            if act is None:
+                self.add(llvm_instr, 'missing', None, None)
+        rows = [(llvm_instr, exp, act)
+                for llvm_instr, exp, act in zip(llvm_instrs, expected, actual)
+                if act is not None]
+        for col, kind in enumerate(self.KINDS[1:4]):
+            if kind != 'ports':
+                exp_col = [exp[col] for _, exp, _ in rows]
+                if exp_col == [act[col] for _, _, act in rows]:
+                    continue
+            for llvm_instr, exp, act in rows:
+                if kind == 'ports':
+                    matched = port_counts_match(
+                        exp[col], act[col], llvm_instr.uops_info.throughput)
+                else:
+                    matched = exp[col] == act[col]
+                if not matched:
+                    self.add(llvm_instr, kind, exp[col], act[col])
+
+    def add(self, llvm_instr, kind, expected, actual):
+        if kind == 'ports':
+            expected = format_port_counts(expected)
+            actual = format_port_counts(actual)
+        self.mismatches.append({
+            'opcode': llvm_instr.opcode,
+            'schedwrites': ','.join(x.name for x in llvm_instr.schedwrites),
+            'kind': kind,
+            'expected': expected,
+            'actual': actual,
+        })
+
+    def summary(self):
+        by_kind = collections.Counter(x['kind'] for x in self.mismatches)
+        by_schedwrite = {}
+        for mismatch in self.mismatches:
+            group = by_schedwrite.setdefault(mismatch['schedwrites'], {
+                'count': 0,
+                'kinds': collections.Counter(),
+                'opcodes': []
+            })
+            group['count'] += 1
+            group['kinds'][mismatch['kind']] += 1
+            if mismatch['opcode'] not in group['opcodes']:
+                group['opcodes'].append(mismatch['opcode'])
+        by_schedwrite = dict(
+            sorted(by_schedwrite.items(), key=lambda x: -x[1]['count']))
+        return {
+            'checked': self.num_checked,
+            'mismatches': len(self.mismatches),
+            'by_kind': dict(by_kind.most_common()),
+            'by_schedwrite': by_schedwrite,
+        }
+
+    def dump(self, path):
+        ''' Dump report as csv if path ends with .csv else as json. '''
+        with open(path, 'w', newline='') as ostream:
+            if path.endswith('.csv'):
+                writer = csv.DictWriter(ostream, fieldnames=self.FIELDS)
+                writer.writeheader()
+                for mismatch in self.mismatches:
+                    writer.writerow({
+                        key: json.dumps(value) if key in ('expected',
+                                                          'actual') else value
+                        for key, value in mismatch.items()
+                    })
+            else:
+                json.dump(
+                    {
+                        'summary': self.summary(),
+                        'mismatches': self.mismatches
+                    },
+                    ostream,
+                    indent=2)
+
+    def print_summary(self, ostream=sys.stdout):
+        if not self.mismatches:
+            print('Pass', file=ostream)
+            return
+        summary = self.summary()
+        print(f'Fail: {summary["mismatches"]} mismatches in '
+              f'{summary["checked"]} instructions',
+              file=ostream)
+        for kind, count in summary['by_kind'].items():
+            print(f'  {kind:10}: {count}', file=ostream)
+
+
+@functools.lru_cache(maxsize=None)
+def port_counts_match(expected, actual, throughput):
+    '''
+    expected counts uops of each port group, while actual counts cycles, a
+    non-pipelined unit may take more cycles than uops. Both must use the same
+    port groups with at least 1 cycle per uop. Extra cycles must be what
+    smg derives: if throughput can't be fitted, cycles equal uops, else port
+    pressure bound of actual is throughput within throughput_tolerance.
+    '''
+    actual_cycles = dict(actual)
+    if len(expected) != len(actual_cycles) or any(
+            actual_cycles.get(ports, 0) < count for ports, count in expected):
+        return False
+    ports = tuple(ports for ports, count in expected for _ in range(count))
+    if derive_resource_cycles(ports, throughput) is None:
+        return dict(expected) == actual_cycles
+    return fits_throughput(tuple(actual_cycles), tuple(actual_cycles.values()),
+                           throughput)
+
+
+def expected_row(llvm_instr):
+    ''' (latency, num_uops, port_counts) from uops info of llvm_instr.  '''
+    uops_info = llvm_instr.uops_info
+    return (uops_info.latency, uops_info.num_uops,
+            tuple(sorted(collections.Counter(uops_info.ports).items())))
+
+
 class LLVMSchedVerifier:
     def __init__(self, llvm_instrs, target_cpu):
         self.target_cpu = target_cpu
@@ -26,31 +164,154 @@ class LLVMSchedVerifier:
             for smv_instr in self.smv_instrs
         }
 
-        for llvm_instr in self.llvm_instrs:
-            if (not llvm_instr.has_uops_info()
-                    or llvm_instr.is_invalid(self.target_cpu)):
+        llvm_instrs = [
+            llvm_instr for llvm_instr in self.llvm_instrs
+            if llvm_instr.has_uops_info()
+            and not llvm_instr.is_invalid(self.target_cpu)
+        ]
+        expected = [expected_row(llvm_instr) for llvm_instr in llvm_instrs]
+
+        actual = []
+        for llvm_instr in llvm_instrs:
+            smv_instr = opc2smv_instrs.get(llvm_instr.opcode)
+            if smv_instr is None:
+                actual.append(None)
+                continue
+            actual.append(
+                (smv_instr.latency, smv_instr.num_uops,
+                 tuple(
+                     sorted(
+                         zip(smv_instr.resources,
+                             smv_instr.resource_cycles)))))
+
+        report = MismatchReport()
+        report.compare(llvm_instrs, expected, actual)
+        return report
+
+
+class LLVMSchedTdVerifier:
+    '''
+    Verify td file generated by smg against input json without llvm-smv by
+    resolving schedrws of each instruction the way llvm-tblgen does.
+    '''
+    def __init__(self, llvm_instrs, target_cpu, td):
+        self.target_cpu = target_cpu
+        self.llvm_instrs = llvm_instrs
+        self.td_model = TdSchedModel(target_cpu)
+        if target_cpu.template_td is not None:
+            self.td_model.parse_file(target_cpu.template_td)
+        self.td_model.parse_file(td)
+
+    def resolve_writes(self, schedrw_names):
+        ''' Return TdWrites of schedrws or name of the unresolved one. '''
+        writes = []
+        for name in schedrw_names:
+            if name in self.td_model.writes:
+                writes.append([self.td_model.writes[name]])
+            elif WriteSequence.get(name, None, None) is not None:
+                leaf_writes = WriteSequence.get(name, None, None).expand()
+                if any(x.name not in self.td_model.writes
+                       for x in leaf_writes):
+                    return name
+                writes.append([self.td_model.writes[x.name]
+                               for x in leaf_writes])
+            elif (SchedRead.get(name) is None
+                  and name not in self.td_model.read_advances):
+                return name
+        return writes
+
+    def resolve_read_advances(self, schedrw_names):
+        '''
+        Return {index: advance} of SchedReads among schedrw_names in operand
+        order. A read without ReadAdvance def has advance 0.
+        '''
+        read_names = [
+            name for name in schedrw_names
+            if name not in self.td_model.writes
+            and WriteSequence.get(name, None, None) is None
+        ]
+        return {
+            idx: self.td_model.read_advances.get(name, 0)
+            for idx, name in enumerate(read_names)
+        }
+
+    def run(self):
+        report = MismatchReport()
+        llvm_instrs = [
+            llvm_instr for llvm_instr in self.llvm_instrs
+            if llvm_instr.has_uops_info()
+            and not llvm_instr.is_invalid(self.target_cpu)
+        ]
+        opc2instrws = self.td_model.match_instrws(
+            [llvm_instr.opcode for llvm_instr in self.llvm_instrs])
+
+        checked_instrs, expected, actual = [], [], []
+        for llvm_instr in llvm_instrs:
+            instrws = opc2instrws.get(llvm_instr.opcode, [])
+            if len(instrws) > 1:
+                report.add(llvm_instr, 'overlap', None,
+                           [self.td_model.instrws[i][0] for i in instrws])
+            if instrws:
+                schedrw_names = self.td_model.instrws[instrws[0]][0]
+            else:
+                schedrw_names = [
+                    x.name
+                    for x in llvm_instr.schedwrites + llvm_instr.schedreads
+                ]
+
+            # Only operands with measured latency have an expected advance.
+            read_advances = llvm_instr.compute_read_advances()
+            if read_advances is not None:
+                td_advances = self.resolve_read_advances(schedrw_names)
+                td_advances = {
+                    idx: td_advances.get(idx)
+                    for idx in read_advances
+                }
+                if td_advances != read_advances:
+                    report.add(llvm_instr, 'read_advance', read_advances,
+                               td_advances)
+
+            writes = self.resolve_writes(schedrw_names)
+            if isinstance(writes, str):
+                report.add(llvm_instr, 'unresolved', None, writes)
+                continue
+            unsupported = [
+                leaf.name for write in writes for leaf in write
+                if leaf.unsupported
+            ]
+            if unsupported:
+                report.add(llvm_instr, 'unsupported', None, unsupported)
                 continue
 
-            uops_info = llvm_instr.uops_info
-            smv_instr = opc2smv_instrs[llvm_instr.opcode]
-            assert uops_info.latency == smv_instr.latency
-            assert uops_info.num_uops == smv_instr.num_uops
+            # Each write is a def, WriteSequence adds up its leaf writes.
+            latency = max(sum(leaf.latency for leaf in write)
+                          for write in writes) if writes else 0
+            num_uops = sum(leaf.num_uops for write in writes for leaf in write)
+            port_counts = collections.Counter()
+            for write in writes:
+                for leaf in write:
+                    for res, cycles in zip(leaf.resources,
+                                           leaf.resource_cycles):
+                        port_counts[res] += cycles
+            checked_instrs.append(llvm_instr)
+            expected.append(expected_row(llvm_instr))
+            actual.append(
+                (latency, num_uops, tuple(sorted(port_counts.items()))))
 
-            # FIXME: We assume each uops consumes only 1 cycles.
-            res_cycles = {
-                ports: cycles
-                for ports, cycles in zip(smv_instr.resources,
-                                         smv_instr.resource_cycles)
-            }
-            assert set(smv_instr.resources) == set(uops_info.ports)
-            for ports in uops_info.ports:
-                res_cycles[ports] -= 1
-            assert all(cycs == 0 for cycs in res_cycles.values())
-        print('Pass')
+        report.compare(checked_instrs, expected, actual)
+        report.num_checked = len(llvm_instrs)
+        return report
 
 
 def main(args):
-    target_cpu = target.get_target(args.target_cpu)
-    with open(args.jf) as jf:
-        llvm_instrs = parse_llvm_instr_info(json.load(jf), target_cpu)
-    LLVMSchedVerifier(llvm_instrs, target_cpu).run()
+    target_cpu, llvm_instrs = load_model(args.jf, args.target_cpu,
+                                         args.layer)
+    if args.td:
+        report = LLVMSchedTdVerifier(llvm_instrs, target_cpu, args.td).run()
+    else:
+        report = LLVMSchedVerifier(llvm_instrs, target_cpu).run()
+    report.print_summary()
+    if args.report:
+        report.dump(args.report)
+    if report.mismatches:
+        sys.exit(1)
@@ -1,8 +1,13 @@
 #!/usr/bin/env python3
 
-import argparse, json, sys, subprocess, math
+import argparse, json, sys, os, math
 from collections import Counter
-from multiprocessing import Pool
+
+# Add parent dir to path.
+sys.path.append(f'{os.path.dirname(os.path.realpath(__file__))}/..')
+
+from lib import runner
+from lib.overlay import dump_layer, merge_uops_info
 
 
 def parse_command_line():
@@ -16,10 +21,15 @@ def parse_command_line():
     parser.add_argument('--jf',
                         default='-',
                         help='instruction sched info json file')
+    parser.add_argument(
+        '--layer-out',
+        help='write uops info to this layer file instead of merging it into '
+        'output json, which is then the unchanged input')
     parser.add_argument('--adl-p-json',
                         '--spr-json',
                         required=True,
                         help='alderlake-p/sapphirerapids tpt lat json file')
+    runner.add_arguments(parser)
     return parser.parse_args()
 
 
@@ -40,13 +50,11 @@ def disassemble(encode):
     formatted_encode = ','.join(blocks)
     triples = ('x86_64', 'i386', 'i686-linux-gnu-code16')
     for triple in triples:
-        cmd = (f"echo -e '{formatted_encode}' | llvm-mc --disassemble "
-               f"--triple={triple} --debug-only=print-opcode -o /dev/null")
-        result = subprocess.run(cmd,
-                                shell=True,
-                                check=True,
-                                stdout=subprocess.PIPE,
-                                stderr=subprocess.DEVNULL)
+        cmd = [
+            'llvm-mc', '--disassemble', f'--triple={triple}',
+            '--debug-only=print-opcode', '-o', '/dev/null'
+        ]
+        result = runner.run(cmd, input=f'{formatted_encode}\n', check=True)
         parsed_opcode = result.stdout.decode('utf-8')
         if parsed_opcode != '':
             return encode, parsed_opcode
@@ -55,6 +63,7 @@ def disassemble(encode):
 
 if __name__ == '__main__':
     args = parse_command_line()
+    runner.configure_from_args(args)
     ostream = sys.stdout if args.o == '-' else open(args.o, 'w')
     istream = sys.stdin if args.jf == '-' else open(args.jf, 'r')
 
@@ -86,11 +95,12 @@ if __name__ == '__main__':
                     entry[name] = value
             encode2uopsinfo[encode] = entry
 
-    with Pool() as pool:
-        result = pool.map(disassemble, encode2uopsinfo.keys())
+    result = runner.map_threads(disassemble, encode2uopsinfo.keys())
+    runner.print_stats()
 
     sig_name = 'hw-adl'
     instr_sched_info = json.load(istream)
+    layer_entries = {}
     for encode, parsed_opcode in result:
         if parsed_opcode is None:
             continue
@@ -98,16 +108,13 @@ if __name__ == '__main__':
         if 'XedInfo' not in sched_info:
             continue
         uops_info = encode2uopsinfo[encode]
-        for key, value in uops_info.items():
-            if args.overwrite or key not in sched_info:
-                sched_info[key] = value
-                assert sched_info.get(f'{key}Sig', None) != sig_name
-                sched_info[f'{key}Sig'] = 'hw-adl'
-        # if port is updated then uops must be consistent with port.
-        if sched_info['PortSig'] == sig_name:
-            sched_info['Uops'] = uops_info['Uops']
-            sched_info['UopsSig'] = sig_name
+        if args.layer_out:
+            layer_entries.setdefault(parsed_opcode, uops_info)
+        else:
+            merge_uops_info(sched_info, sig_name, uops_info, args.overwrite)
 
+    if args.layer_out:
+        dump_layer(args.layer_out, sig_name, layer_entries)
     json.dump(instr_sched_info, ostream, indent=2)
     istream.close()
     ostream.close()
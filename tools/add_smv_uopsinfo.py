@@ -1,13 +1,13 @@
 #!/usr/bin/env python3
 
-import argparse, json, sys, os, re
+import argparse, json, sys, os
 
 # Add parent dir to path.
 sys.path.append(f'{os.path.dirname(os.path.realpath(__file__))}/..')
 
 from schedver.schedver import get_smv_instrs
-from lib import target
-from lib.llvm_instr import Port
+from lib import runner, target
+from lib.overlay import dump_layer, merge_uops_info
 
 
 def parse_command_line():
@@ -19,79 +19,37 @@ def parse_command_line():
                         default=False,
                         action='store_true',
                         help='Overwrite info if it existed')
+    parser.add_argument(
+        '--layer-out',
+        help='write uops info to this layer file instead of merging it into '
+        'output json, which is then the unchanged input')
     parser.add_argument('--jf',
                         default='-',
                         help='instruction sched info json file')
+    runner.add_arguments(parser)
     return parser.parse_args()
 
 
-def map_resources(opcode, ref_resources, ref_cpu, target_cpu):
-    target_resources = []
-    if (isinstance(ref_cpu, target.SkylakeServer)
-            and isinstance(target_cpu, target.SapphireRapids)):
-        for res in ref_resources:
-            if res == ref_cpu.load_ports:
-                target_resources.append(target_cpu.load_ports)
-            elif res == Port.gets((2, 3, 7)):
-                target_resources.append(Port.gets((7, 8)))
-            elif res == Port.gets((4, )):
-                target_resources.append(Port.gets((4, 9)))
-            elif (res == Port.gets((0, 1, 5, 6))
-                  and re.match(r'^(ADD|SUB|XOR|AND|OR)\d', opcode)):
-                target_resources.append(Port.gets((0, 1, 5, 6, 10)))
-            target_resources.append(res)
-        return tuple(target_resources)
-    elif (isinstance(ref_cpu, target.IcelakeServer)
-          and isinstance(target_cpu, target.SapphireRapids)):
-        for res in ref_resources:
-            if res == ref_cpu.load_ports:
-                target_resources.append(target_cpu.load_ports)
-            elif res == Port.gets((2, 3, 7)):  # STA from SKX
-                target_resources.append(Port.gets((7, 8)))
-            elif res == Port.gets((4, )):  # STD from SKX
-                target_resources.append(Port.gets((4, 9)))
-            elif (res == Port.gets((0, 1, 5, 6))
-                  and re.match(r'^(ADD|SUB|XOR|AND|OR)\d', opcode)):
-                target_resources.append(Port.gets((0, 1, 5, 6, 10)))
-            target_resources.append(res)
-        return tuple(target_resources)
-    elif (isinstance(ref_cpu, target.Skylake)
-          and isinstance(target_cpu, target.AlderlakeP)):
-        for res in ref_resources:
-            if res == ref_cpu.load_ports:
-                target_resources.append(target_cpu.load_ports)
-            elif res == Port.gets((2, 3, 7)):
-                target_resources.append(Port.gets((7, 8)))
-            elif res == Port.gets((4, )):
-                target_resources.append(Port.gets((4, 9)))
-            elif (res == Port.gets((0, 1, 5, 6))
-                  and re.match(r'^(ADD|SUB|XOR|AND|OR)\d', opcode)):
-                target_resources.append(Port.gets((0, 1, 5, 6, 10)))
-            target_resources.append(res)
-        return tuple(target_resources)
-    else:
-        raise NotImplementedError(
-            f'Unknown resources map between '
-            f'{ref_cpu.proc_name} and {target_cpu.proc_name}')
-
-
 if __name__ == '__main__':
     args = parse_command_line()
+    runner.configure_from_args(args)
     istream = sys.stdin if args.jf == '-' else open(args.jf, 'r')
     ostream = sys.stdout if args.o == '-' else open(args.o, 'w')
 
     ref_cpu = target.get_target(args.ref_cpu)
     target_cpu = target.get_target(args.target_cpu)
     instr_sched_info = json.load(istream)
+    port_map = target_cpu.get_port_map(ref_cpu)
+    sig_name = f'smv.{ref_cpu.proc_name}'
+    layer_entries = {}
     for smv_instr in get_smv_instrs(ref_cpu):
         # FIXME: we assume each uop only consume 1 cycle.
         ports = []
         opcode = smv_instr.opcode
         for resources, cycles in zip(
-                map_resources(opcode, smv_instr.resources, ref_cpu,
-                              target_cpu), smv_instr.resource_cycles):
+                port_map.map_resources(opcode, smv_instr.resources),
+                smv_instr.resource_cycles):
             ports.append([cycles, [int(str(p)) for p in resources]])
-        sig_name = f'smv.{ref_cpu.proc_name}'
         uops = smv_instr.num_uops
         tp = smv_instr.throughput
         latency = smv_instr.latency
@@ -99,17 +57,15 @@ if __name__ == '__main__':
         info = instr_sched_info[smv_instr.opcode]
         if 'XedInfo' not in info:
             continue
-        for key, value in uops_info.items():
-            # Only add smv uops info to instruction with iform.
-            if args.overwrite or key not in info:
-                info[key] = value
-                assert info.get(f'{key}Sig', None) != sig_name
-                info[f'{key}Sig'] = sig_name
-        # if port is updated then uops must be consistent with port.
-        if info['PortSig'] == sig_name:
-            info['Uops'] = uops_info['Uops']
-            info['UopsSig'] = sig_name
+        # Only add smv uops info to instruction with iform.
+        if args.layer_out:
+            layer_entries[opcode] = uops_info
+        else:
+            merge_uops_info(info, sig_name, uops_info, args.overwrite)
 
+    if args.layer_out:
+        dump_layer(args.layer_out, sig_name, layer_entries)
     json.dump(instr_sched_info, ostream, indent=2)
     istream.close()
     ostream.close()
+    runner.print_stats()
@@ -1,8 +1,13 @@
 #!/bin/python3
 
-import argparse, json, sys, re
+import argparse, json, sys, os, re
 import xml.etree.ElementTree as ET
 
+# Add parent dir to path.
+sys.path.append(f'{os.path.dirname(os.path.realpath(__file__))}/..')
+
+from lib.overlay import dump_layer, merge_uops_info
+
 
 def parse_command_line():
     parser = argparse.ArgumentParser(
@@ -19,6 +24,10 @@ def parse_command_line():
     parser.add_argument('--inst-xml',
                         required=True,
                         help='uops.info instructions.xml file')
+    parser.add_argument(
+        '--layer-out',
+        help='write uops info to this layer file instead of merging it into '
+        'output json, which is then the unchanged input')
     parser.add_argument('--debug',
                         default=False,
                         action='store_true',
@@ -107,18 +116,31 @@ if __name__ == '__main__':
 
                     tp = min(float(perf_info.attrib['TP_unrolled']),
                              float(perf_info.attrib['TP_loop']))
-                    latency = -1
+                    # Keep latency of each (start, target) operand pair, kind
+                    # is cycles, cycles_addr, cycles_mem or cycles_same_reg.
+                    latency, op_latency = -1, []
+                    opd_names = {
+                        x['idx']: x.get('name', f'OP{x["idx"]}')
+                        for x in xml_instr_info.xml_operands_info
+                    }
                     for child in perf_info:
                         for key, val in child.attrib.items():
                             if not re.match(r'^cycles((_)|(\w+))*$', key):
                                 continue
                             latency = max(latency, int(val))
+                            start = opd_names.get(child.get('start_op'))
+                            target = opd_names.get(child.get('target_op'))
+                            if start and target and key in (
+                                    'cycles', 'cycles_addr', 'cycles_mem',
+                                    'cycles_same_reg'):
+                                op_latency.append([start, target, key, int(val)])
                     if latency == -1:
                         latency = None
 
                     entry = {}
-                    for name, value in zip(('Port', 'Uops', 'Tp', 'Latency'),
-                                           (ports, uops, tp, latency)):
+                    for name, value in zip(
+                        ('Port', 'Uops', 'Tp', 'Latency', 'OpLatency'),
+                        (ports, uops, tp, latency, op_latency or None)):
                         if value is not None:
                             entry[name] = value
                     assert xml_instr_info.xml_uops_info is None
@@ -126,6 +148,8 @@ if __name__ == '__main__':
 
     # Find the suitable uops info.
     instr_sched_info = json.load(istream)
+    sig_name = f'uops.info.{args.arch_name}'
+    layer_entries = {}
     for opcode, info in instr_sched_info.items():
         xed_info = info.get('XedInfo', None)
         if xed_info is None:
@@ -200,19 +224,15 @@ if __name__ == '__main__':
                     print(' ', opi)
                 print('')
 
-        sig_name = f'uops.info.{args.arch_name}'
         uops_info = iform2xml_instr_infos[iform][0].xml_uops_info
         if uops_info is not None:
-            for key, value in uops_info.items():
-                if args.overwrite or key not in info:
-                    info[key] = value
-                    assert info.get(f'{key}Sig', None) != sig_name
-                    info[f'{key}Sig'] = sig_name
-            # if port is updated then uops must be consistent with port.
-            if info['PortSig'] == sig_name:
-                info['Uops'] = uops_info['Uops']
-                info['UopsSig'] = sig_name
+            if args.layer_out:
+                layer_entries[opcode] = uops_info
+            else:
+                merge_uops_info(info, sig_name, uops_info, args.overwrite)
 
+    if args.layer_out:
+        dump_layer(args.layer_out, sig_name, layer_entries)
     json.dump(instr_sched_info, ostream, indent=2)
     istream.close()
     ostream.close()
@@ -1,7 +1,11 @@
 #!/usr/bin/env python3
 
-import argparse, json, subprocess, sys, re, shutil
-from multiprocessing import Pool
+import argparse, asyncio, json, math, os, subprocess, sys, re, shutil, time
+
+# Add parent dir to path.
+sys.path.append(f'{os.path.dirname(os.path.realpath(__file__))}/..')
+
+from lib import runner
 
 
 def parse_command_line():
@@ -12,6 +16,12 @@ def parse_command_line():
     parser.add_argument('--jf',
                         default='-',
                         help='instruction sched info json file')
+    parser.add_argument(
+        '--stats',
+        help='success stats of fix_asm candidates, learned from and updated '
+        'by each run, runtimes of units are also kept to schedule slow units '
+        'first')
+    runner.add_arguments(parser)
     return parser.parse_args()
 
 
@@ -23,180 +33,362 @@ ignore_opcode_list = {
 invalid_opcode_list = ['INVLPGB32', 'LOCK_PREFIX']
 
 
-def fix_asm(opcode, asm_string, modes):
-    vex2_asm_string = f'{{VEX2}} {asm_string}'
-    vex3_asm_string = f'{{VEX3}} {asm_string}'
-    evex_asm_string = f'{{EVEX}} {asm_string}'
-    cmd_template = ("echo -e '{assembly}'"
-                    "| llvm-mc --debug-only=print-opcode -o /dev/null")
+# Prefixes tried by fix_asm, in the order of the original fixed search.
+asm_prefixes = ['{VEX2}', '{EVEX}', '', '{VEX3}']
+
+# Likely prefixes first for each opcode class, used before stats are learned.
+prior_prefixes = {
+    'evex': ['{EVEX}', '', '{VEX2}', '{VEX3}'],
+    'vex': ['', '{VEX2}', '{VEX3}', '{EVEX}'],
+    'legacy': ['', '{VEX2}', '{EVEX}', '{VEX3}'],
+}
+
+
+def opcode_class(opcode):
+    if re.match(r'^V.*Z(128|256)?(r|m|k|b|i|_|$)', opcode):
+        return 'evex'
+    if opcode.startswith('V'):
+        return 'vex'
+    return 'legacy'
+
+
+def candidate_key(mode, prefix):
+    return f'{mode}:{prefix}'
+
+
+def order_candidates(opcode, modes, stats):
+    '''
+    Order (mode, prefix) candidates of fix_asm. Candidates that succeeded
+    most for this opcode class in previous runs come first, then the prior
+    guess from opcode naming, then the original fixed order.
+    '''
+    fixed = [(mode, prefix) for mode in modes + [None]
+             for prefix in asm_prefixes]
+    cls = opcode_class(opcode)
+    counts = stats.get(cls, {})
+    prior = prior_prefixes[cls]
+    return sorted(fixed,
+                  key=lambda x: (-counts.get(candidate_key(*x), 0),
+                                 prior.index(x[1]), fixed.index(x))), fixed
+
+
+class XedInfoPipeline:
+    '''
+    Move each (AsmString, Modes) unit through fix -> encode -> decode on its
+    own, without waiting for other units to finish a stage. Encoding and
+    decoding are memoized by fixed asm and (encoding, mode), so opcodes
+    sharing them await the same task. Subprocess slots of runner go to
+    units of larger prior runtime first.
+    '''
+    def __init__(self, xed, stats):
+        self.xed = xed
+        self.stats = stats
+        self.encodings, self.xed_infos = {}, {}
+        self.num_fix_runs = 0
+        self.num_encode_failures = 0
+
+    async def fix_asm(self, opcode, asm_string, modes, parsed, rank):
+        '''
+        Return (opcode, asm, succeeded candidate, attempts, attempts of fixed
+        order, seconds). parsed memoizes llvm-mc output of each candidate
+        asm, it is shared by opcodes of the same (AsmString, Modes).
+        '''
+        cmd = ['llvm-mc', '--debug-only=print-opcode', '-o', '/dev/null']
 
-    parsed_opcodes, best_parsed_opcodes, best_asm = None, None, None
-    for mode in modes + [None]:
-        asms = [vex2_asm_string, evex_asm_string, asm_string, vex3_asm_string]
-        for asm in asms:
+        candidates, fixed = order_candidates(opcode, modes, self.stats)
+        parsed_opcodes, best_parsed_opcodes, best_asm = None, None, None
+        best_rank, seconds = None, 0
+        for attempts, (mode, prefix) in enumerate(candidates, 1):
+            asm = f'{prefix} {asm_string}' if prefix else asm_string
             if mode is not None:
                 asm = f'.code{mode}\n{asm}'
-            cmd = cmd_template.format(assembly=asm)
-            try:
-                result = subprocess.run(cmd,
-                                        shell=True,
-                                        check=True,
-                                        stdout=subprocess.PIPE,
-                                        stderr=subprocess.DEVNULL)
-                parsed_opcodes = result.stdout.decode('utf-8').split(',')
-            except:
+            if asm not in parsed:
+                self.num_fix_runs += 1
+                try:
+                    result = await runner.run_async(cmd,
+                                                    input=f'{asm}\n',
+                                                    rank=rank)
+                except subprocess.TimeoutExpired:
+                    parsed[asm] = None
+                    continue
+                seconds += result.seconds
+                parsed[asm] = result.stdout.decode('utf-8').split(',') \
+                    if result.returncode == 0 else None
+            parsed_opcodes = parsed[asm]
+            if parsed_opcodes is None:
                 continue
-            else:
-                if opcode in parsed_opcodes:
-                    if len(parsed_opcodes) == 1:
-                        return opcode, asm
-
-                    if (best_parsed_opcodes is None
-                            or len(parsed_opcodes) < len(best_parsed_opcodes)):
-                        best_parsed_opcodes = parsed_opcodes
-                        best_asm = asm
-                elif ignore_opcode_list.get(opcode, None) in parsed_opcodes:
-                    return opcode, asm
-
-    if best_parsed_opcodes is not None:
-        return opcode, best_asm
-    else:
-        print(f"{modes}{cmd}\n'{opcode}': '{parsed_opcodes}',",
-              file=sys.stderr)
-        return opcode, asm_string
-
-
-def encode_asm(opcode, asm_string):
-    result = None
-
-    # Try to match not CodeGenOnly opcode.
-    try:
-        cmd = f"echo -e '{asm_string}' | llvm-mc --show-encoding"
-        result = subprocess.run(cmd,
-                                shell=True,
-                                check=True,
-                                stdout=subprocess.PIPE,
-                                stderr=subprocess.DEVNULL)
-    # Try to match CodeGenOnly opcodes.
-    except subprocess.CalledProcessError:
-        cmd = f"echo -e '{asm_string}' |" \
-               "llvm-mc --show-encoding -debug-only=print-opcode"
-        result = subprocess.run(cmd,
-                                shell=True,
-                                check=True,
-                                stdout=subprocess.PIPE,
-                                stderr=subprocess.DEVNULL)
-
-    output = result.stdout.decode('utf-8').split('\n')
-    for line in output:
-        line = line.strip()
-        match = re.match('.*# encoding: \[(.*)\]', line)
-        if match:
-            encoding = match.group(1).split(',')
-            break
-    encoding_str = ''
-    for byte in encoding:
-        encoding_str += f'{int(byte, 16):02x}'
-    return (opcode, encoding_str)
-
-
-def get_xed_info(opcode, encoding, mode):
-    xed = args.xed or 'xed'
-    assert shutil.which(xed) is not None, f'{xed} not found'
+            fixed_rank = fixed.index((mode, prefix))
+            if opcode in parsed_opcodes:
+                if len(parsed_opcodes) == 1:
+                    return (opcode, asm, (mode, prefix), attempts,
+                            fixed_rank + 1, seconds)
+
+                # Ties are broken by fixed order to keep the original choice.
+                if (best_parsed_opcodes is None
+                        or (len(parsed_opcodes), fixed_rank) <
+                    (len(best_parsed_opcodes), best_rank)):
+                    best_parsed_opcodes = parsed_opcodes
+                    best_asm, best_rank = asm, fixed_rank
+            elif ignore_opcode_list.get(opcode, None) in parsed_opcodes:
+                return (opcode, asm, (mode, prefix), attempts, fixed_rank + 1,
+                        seconds)
 
-    result = None
-    for m in [mode, 64, 32, 16]:
+        if best_parsed_opcodes is not None:
+            return (opcode, best_asm, None, len(candidates), len(fixed),
+                    seconds)
+        else:
+            print(f"{modes}{' '.join(cmd)} <<< {asm}\n"
+                  f"'{opcode}': '{parsed_opcodes}',",
+                  file=sys.stderr)
+            return (opcode, asm_string, None, len(candidates), len(fixed),
+                    seconds)
+
+    async def encode_asm(self, asm_string, opcodes, rank):
+        '''
+        Return (encoding, seconds). encoding is None if llvm-mc fails, times
+        out or prints no encoding, the unit is then left without encoding.
+        '''
+        cmd, seconds = ['llvm-mc', '--show-encoding'], 0
         try:
-            cmd = f'{xed} -{m} -v 4 -d "{encoding}"'
-            result = subprocess.run(cmd,
-                                    shell=True,
-                                    check=False,
-                                    stdout=subprocess.PIPE,
-                                    stderr=subprocess.PIPE)
-            output = result.stdout.decode('utf-8')
-            output = output.split('\n')
-            operands_info = []
-            line_no = 3
-            while not output[line_no].startswith('EOSZ:'):
-                opi, infos = output[line_no].split()
-                assert int(opi) == len(operands_info)
-                infos = infos.split('/')
-                operands_info.append({
-                    'Name': infos[0],
-                    'XType': infos[-2].lower(),
-                    'Width': int(infos[-1]),
-                })
-                line_no += 1
-
-            eosz = int(re.match('EOSZ:\s*(.*)', output[line_no]).group(1))
-            iclass = re.match('ICLASS:\s*(.*)', output[line_no + 2]).group(1)
-            category = re.match('CATEGORY:\s*(.*)',
-                                output[line_no + 3]).group(1)
-            extension = re.match('EXTENSION:\s*(.*)',
-                                 output[line_no + 4]).group(1)
-            iform = re.match('IFORM:\s*(.*)', output[line_no + 5]).group(1)
-            isa_set = re.match('ISA_SET:\s*(.*)', output[line_no + 6]).group(1)
-            return (opcode, {
-                'EOSZ': eosz,
-                'IClass': iclass,
-                'Category': category,
-                'Extension': extension,
-                'IForm': iform,
-                'IsaSet': isa_set,
-                'OpdsInfo': operands_info,
-            })
-
-        except:
-            continue
-    else:
-        print(f'[{opcode}]error ', cmd, file=sys.stderr)
-        return (opcode, None)
+            # Try to match not CodeGenOnly opcode.
+            result = await runner.run_async(cmd,
+                                            input=f'{asm_string}\n',
+                                            rank=rank)
+            seconds += result.seconds
+            # Try to match CodeGenOnly opcodes.
+            if result.returncode != 0:
+                cmd = cmd + ['-debug-only=print-opcode']
+                result = await runner.run_async(cmd,
+                                                input=f'{asm_string}\n',
+                                                check=True,
+                                                rank=rank)
+                seconds += result.seconds
+        except subprocess.TimeoutExpired as error:
+            seconds += error.timeout * (runner.retries() + 1)
+            result = None
+        except subprocess.CalledProcessError:
+            result = None
+
+        encoding = None
+        if result is not None:
+            for line in result.stdout.decode('utf-8').split('\n'):
+                line = line.strip()
+                match = re.match('.*# encoding: \[(.*)\]', line)
+                if match:
+                    encoding = match.group(1).split(',')
+                    break
+            else:
+                runner.record_failure(cmd)
+        if encoding is None:
+            self.num_encode_failures += 1
+            print(f'[{",".join(opcodes)}]error ', ' '.join(cmd),
+                  f'<<< {asm_string}',
+                  file=sys.stderr)
+            return None, seconds
+        encoding_str = ''
+        for byte in encoding:
+            encoding_str += f'{int(byte, 16):02x}'
+        return encoding_str, seconds
+
+    async def get_xed_info(self, encoding, mode, opcodes, rank):
+        ''' Return (xed info, seconds).  '''
+        seconds = 0
+        for m in [mode, 64, 32, 16]:
+            cmd = [self.xed, f'-{m}', '-v', '4', '-d', encoding]
+            try:
+                result = await runner.run_async(cmd, rank=rank)
+            except subprocess.TimeoutExpired as error:
+                seconds += error.timeout * (runner.retries() + 1)
+                continue
+            seconds += result.seconds
+            try:
+                return parse_xed_output(result.stdout.decode('utf-8')), seconds
+            except (IndexError, ValueError, AttributeError, AssertionError):
+                # xed can't decode encoding in this mode.
+                if result.returncode == 0:
+                    runner.record_failure(cmd)
+                continue
+        else:
+            print(f'[{",".join(opcodes)}]error ', ' '.join(cmd),
+                  file=sys.stderr)
+            return None, seconds
+
+    def memoized(self, tasks, key, coro):
+        ''' Task of key in tasks, created from coro if it doesn't exist.  '''
+        if key in tasks:
+            coro.close()
+        else:
+            tasks[key] = asyncio.ensure_future(coro)
+        return tasks[key]
+
+    async def process_unit(self, asm_string, modes, opcodes, rank):
+        '''
+        Fix, encode and decode a unit. Return ({opcode: (fix_asm result,
+        encoding, xed info)}, seconds of the unit's chain).
+        '''
+        parsed, result, seconds = {}, {}, 0
+        for opcode in opcodes:
+            fixed = await self.fix_asm(opcode, asm_string, list(modes),
+                                       parsed, rank)
+            seconds += fixed[-1]
+            asm = fixed[1]
+            encoding, secs = await self.memoized(
+                self.encodings, asm, self.encode_asm(asm, opcodes, rank))
+            seconds += secs
+            xed_info = None
+            if encoding is not None:
+                match = re.match(r'.*\.code(\d{2})', asm)
+                mode = int(match.group(1)) if match else 32
+                xed_info, secs = await self.memoized(
+                    self.xed_infos, (encoding, mode),
+                    self.get_xed_info(encoding, mode, opcodes, rank))
+                seconds += secs
+            result[opcode] = (fixed[:-1], encoding, xed_info)
+        return result, seconds
+
+    async def process(self, units, runtimes):
+        '''
+        Process all units, units of larger prior runtime first. Units never
+        seen before are assumed slow. Return {opcode: (fix_asm result,
+        encoding, xed info)} and update runtimes.
+        '''
+        def prior_runtime(opcodes):
+            return max(runtimes.get(x, math.inf) for x in opcodes)
+
+        order = sorted(units, key=lambda x: -prior_runtime(units[x]))
+        tasks = [
+            self.process_unit(asm_string, modes, units[(asm_string, modes)],
+                              rank)
+            for rank, (asm_string, modes) in enumerate(order)
+        ]
+        result = {}
+        for (asm_string, modes), (unit_result, seconds) in zip(
+                order, await asyncio.gather(*tasks)):
+            result.update(unit_result)
+            for opcode in units[(asm_string, modes)]:
+                runtimes[opcode] = round(seconds, 4)
+        return result
+
+
+def parse_xed_output(output):
+    output = output.split('\n')
+    operands_info = []
+    line_no = 3
+    while not output[line_no].startswith('EOSZ:'):
+        opi, infos = output[line_no].split()
+        assert int(opi) == len(operands_info)
+        infos = infos.split('/')
+        operands_info.append({
+            'Name': infos[0],
+            'XType': infos[-2].lower(),
+            'Width': int(infos[-1]),
+        })
+        line_no += 1
+
+    eosz = int(re.match('EOSZ:\s*(.*)', output[line_no]).group(1))
+    iclass = re.match('ICLASS:\s*(.*)', output[line_no + 2]).group(1)
+    category = re.match('CATEGORY:\s*(.*)', output[line_no + 3]).group(1)
+    extension = re.match('EXTENSION:\s*(.*)', output[line_no + 4]).group(1)
+    iform = re.match('IFORM:\s*(.*)', output[line_no + 5]).group(1)
+    isa_set = re.match('ISA_SET:\s*(.*)', output[line_no + 6]).group(1)
+    return {
+        'EOSZ': eosz,
+        'IClass': iclass,
+        'Category': category,
+        'Extension': extension,
+        'IForm': iform,
+        'IsaSet': isa_set,
+        'OpdsInfo': operands_info,
+    }
+
+
+def group_units(keys):
+    ''' Group [(opcode, work key), ...] into {work key: [opcode, ...]}.  '''
+    units = {}
+    for opcode, key in keys:
+        units.setdefault(key, []).append(opcode)
+    return units
+
+
+def report_dedup(stage, num_opcodes, num_units, runs=None):
+    msg = f'{stage}: {num_opcodes} opcodes, {num_units} distinct units'
+    if num_units:
+        msg += f', dedup ratio {num_opcodes / num_units:.2f}'
+    if runs is not None:
+        msg += f', {runs} llvm-mc runs'
+    print(msg, file=sys.stderr)
+
+
+def load_stats(path):
+    if path is None or not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def update_stats(path, stats, result):
+    ''' Count succeeded candidates per opcode class and report savings.  '''
+    attempts, fixed_attempts = 0, 0
+    for opcode, _, candidate, num_attempts, num_fixed_attempts in result:
+        attempts += num_attempts
+        fixed_attempts += num_fixed_attempts
+        if candidate is not None:
+            counts = stats.setdefault(opcode_class(opcode), {})
+            key = candidate_key(*candidate)
+            counts[key] = counts.get(key, 0) + 1
+    print(f'fix_asm: {attempts} llvm-mc attempts, {fixed_attempts} with '
+          f'fixed order, saved {fixed_attempts - attempts}',
+          file=sys.stderr)
+    if path is not None:
+        with open(path, 'w') as f:
+            json.dump(stats, f, indent=2)
 
 
 if __name__ == '__main__':
     args = parse_command_line()
+    runner.configure_from_args(args)
     ostream = sys.stdout if args.o == '-' else open(args.o, 'w')
     istream = sys.stdin if args.jf == '-' else open(args.jf, 'r')
     instr_sched_info = json.load(istream)
+    xed = args.xed or 'xed'
+    assert shutil.which(xed) is not None, f'{xed} not found'
 
-    # Fix asm strings.
-    task_args = []
-    for opcode, info in instr_sched_info.items():
-        asm_string = info.get('AsmString', None)
-        if asm_string is not None and opcode not in invalid_opcode_list:
-            task_args.append([opcode, asm_string, info['Modes']])
-    with Pool() as pool:
-        result = pool.starmap(fix_asm, task_args)
-    for opcode, asm in result:
-        instr_sched_info[opcode]['AsmString'] = asm
-
-    # Encode assembly.
-    task_args = []
-    for opcode, info in instr_sched_info.items():
-        asm_string = info.get('AsmString', None)
-        if asm_string is not None and opcode not in invalid_opcode_list:
-            task_args.append([opcode, asm_string])
-    with Pool() as pool:
-        result = pool.starmap(encode_asm, task_args)
-    for opcode, encoding_str in result:
-        instr_sched_info[opcode]['Encoding'] = encoding_str
-
-    # Add xed info.
-    task_args = []
+    # Opcodes of the same (AsmString, Modes) share a unit.
+    stats = load_stats(args.stats)
+    units = group_units(
+        ((opcode, (info['AsmString'], tuple(info['Modes'])))
+         for opcode, info in instr_sched_info.items()
+         if info.get('AsmString', None) is not None
+         and opcode not in invalid_opcode_list))
+    pipeline = XedInfoPipeline(xed, stats)
+    runtimes = stats.setdefault('runtime', {})
+    start = time.monotonic()
+    result = asyncio.run(pipeline.process(units, runtimes))
+    print(f'pipeline: {time.monotonic() - start:.2f}s wall, '
+          f'{max(runtimes.values(), default=0):.2f}s longest unit',
+          file=sys.stderr)
+
+    # Keep opcodes in input order.
+    fixed = []
     for opcode, info in instr_sched_info.items():
-        encoding = info.get('Encoding', None)
+        if opcode not in result:
+            continue
+        fix_result, encoding, xed_info = result[opcode]
+        fixed.append(fix_result)
+        info['AsmString'] = fix_result[1]
         if encoding is not None:
-            asm_string = info['AsmString']
-            match = re.match(r'.*\.code(\d{2})', asm_string)
-            mode = 32
-            if match:
-                mode = int(match.group(1))
-            task_args.append((opcode, encoding, mode))
-    with Pool() as pool:
-        result = pool.starmap(get_xed_info, task_args)
-    for opcode, xed_info in result:
+            info['Encoding'] = encoding
         if xed_info:
-            instr_sched_info[opcode]['XedInfo'] = xed_info
+            info['XedInfo'] = xed_info
+    report_dedup('fix_asm', len(result), len(units), pipeline.num_fix_runs)
+    report_dedup('encode_asm', len(result), len(pipeline.encodings))
+    if pipeline.num_encode_failures:
+        print(f'encode_asm: {pipeline.num_encode_failures} units failed, '
+              f'left without encoding',
+              file=sys.stderr)
+    report_dedup('get_xed_info', len(result), len(pipeline.xed_infos))
+    update_stats(args.stats, stats, fixed)
+    runner.print_stats()
 
     json.dump(instr_sched_info, ostream, indent=2)
     istream.close()
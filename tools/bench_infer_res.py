@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+
+import argparse, json, sys, os, timeit
+
+# Add parent dir to path.
+sys.path.append(f'{os.path.dirname(os.path.realpath(__file__))}/..')
+
+from lib import runner, target, info_parser
+
+
+def parse_command_line():
+    parser = argparse.ArgumentParser(
+        description='Benchmark info_parser.infer_res over a llvm-smv dump.')
+    parser.add_argument('--ref-cpu', required=True, help='reference cpu')
+    parser.add_argument('--smv-json',
+                        help='llvm-smv output, run llvm-smv if not given')
+    parser.add_argument('--repeat',
+                        type=int,
+                        default=5,
+                        help='number of timed runs')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_command_line()
+    ref_cpu = target.get_target(args.ref_cpu)
+    if args.smv_json:
+        with open(args.smv_json) as f:
+            smv_info = json.load(f)
+    else:
+        smv_info = json.loads(
+            runner.run(['llvm-smv', f'-mcpu={ref_cpu.proc_name}'],
+                       check=True).stdout.decode('utf-8'))
+
+    entries = []
+    for desc in smv_info.values():
+        resources, resource_cycles = [], []
+        for ports_name, cycles in desc['WriteRes'].items():
+            resources.append(ref_cpu.parse_ports_name(ports_name))
+            resource_cycles.append(cycles)
+        entries.append((tuple(resources), tuple(resource_cycles)))
+
+    uncached = info_parser.infer_res_cached.__wrapped__
+
+    def run_uncached():
+        for resources, resource_cycles in entries:
+            uncached(resources, resource_cycles)
+
+    def run_cached():
+        info_parser.infer_res_cached.cache_clear()
+        for resources, resource_cycles in entries:
+            info_parser.infer_res(resources, resource_cycles)
+
+    print(f'{len(entries)} entries, {len(set(entries))} distinct signatures')
+    for name, func in (('uncached', run_uncached), ('cached', run_cached)):
+        best = min(timeit.repeat(func, number=1, repeat=args.repeat))
+        print(f'{name:10}: {best * 1000:.2f} ms')
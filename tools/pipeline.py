@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+
+import argparse, glob, hashlib, json, os, shutil, subprocess, sys
+
+srcdir = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+tooldir = f'{srcdir}/tools'
+
+
+def parse_command_line():
+    parser = argparse.ArgumentParser(
+        description='Regenerate schedule model, rerun only changed stages.')
+    parser.add_argument('--target-cpu', required=True, help='target cpu')
+    parser.add_argument('--cache-dir',
+                        required=True,
+                        help='directory of stage outputs and fingerprints')
+    parser.add_argument('--llvm-dir',
+                        help='llvm source dir, run llvm-tblgen on it')
+    parser.add_argument('--tblgen-json',
+                        help='X86InstSchedInfo json, used instead of '
+                        'running llvm-tblgen')
+    parser.add_argument('--xed', help='xed path')
+    parser.add_argument('--inst-xml', help='uops.info instructions.xml file')
+    parser.add_argument('--arch-name', help='uops.info architecture name')
+    parser.add_argument('--intel-json',
+                        help='alderlake-p/sapphirerapids tpt lat json file')
+    parser.add_argument('--ref-cpu', help='reference cpu of llvm-smv stage')
+    parser.add_argument('--force',
+                        action='append',
+                        default=[],
+                        metavar='STAGE',
+                        help='rerun this stage even if it is up to date')
+    parser.add_argument('-o', default='-', help='output td file')
+    args = parser.parse_args()
+    if not (args.llvm_dir or args.tblgen_json):
+        parser.error('one of --llvm-dir and --tblgen-json is required')
+    return args
+
+
+def hash_files(sha, paths):
+    for path in sorted(paths):
+        if not os.path.isfile(path) or '__pycache__' in path:
+            continue
+        sha.update(path.encode('utf-8'))
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                sha.update(chunk)
+
+
+def tool_version(tool):
+    ''' Version of an external tool, its content hash if it has no version. '''
+    path = shutil.which(tool)
+    if path is None:
+        return f'{tool}: not found'
+    try:
+        result = subprocess.run([path, '--version'],
+                                check=True,
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.DEVNULL,
+                                timeout=60)
+        return result.stdout.decode('utf-8')
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired):
+        sha = hashlib.sha256()
+        hash_files(sha, [path])
+        return sha.hexdigest()
+
+
+class Stage:
+    '''
+    A pipeline stage reads output of previous stage from stdin and writes its
+    own output to stdout. Its fingerprint covers output of previous stage,
+    input files, sources, versions of external tools and the command line.
+    '''
+    def __init__(self, name, cmd, inputs=(), sources=(), tools=()):
+        self.name = name
+        self.cmd = cmd
+        self.inputs = inputs
+        self.sources = sources
+        self.tools = tools
+
+    def fingerprint(self, prev_output_hash):
+        sha = hashlib.sha256()
+        sha.update(json.dumps([self.name, self.cmd, prev_output_hash]).encode())
+        hash_files(sha, self.inputs)
+        hash_files(sha, self.sources)
+        for tool in self.tools:
+            sha.update(tool_version(tool).encode('utf-8'))
+        return sha.hexdigest()
+
+
+def python_sources(*patterns):
+    paths = []
+    for pattern in patterns:
+        paths.extend(glob.glob(f'{srcdir}/{pattern}', recursive=True))
+    return paths
+
+
+def get_stages(args, cache_dir):
+    lib_sources = python_sources('lib/**/*')
+    stages = []
+    if args.tblgen_json:
+        stages.append(
+            Stage('tblgen', ['cat', os.path.abspath(args.tblgen_json)],
+                  inputs=[args.tblgen_json]))
+    else:
+        llvm_dir = os.path.abspath(args.llvm_dir)
+        stages.append(
+            Stage('tblgen', [
+                'llvm-tblgen', '-I', f'{llvm_dir}/include',
+                f'{llvm_dir}/lib/Target/X86/X86.td', '-I',
+                f'{llvm_dir}/lib/Target/X86/', '--gen-x86-inst-sched-info'
+            ],
+                  inputs=glob.glob(f'{llvm_dir}/lib/Target/X86/*.td') +
+                  glob.glob(f'{llvm_dir}/include/llvm/**/*.td',
+                            recursive=True),
+                  tools=['llvm-tblgen']))
+
+    cmd = [sys.executable, f'{tooldir}/add_xed_info.py']
+    cmd += ['--stats', f'{cache_dir}/fix_asm_stats.json']
+    if args.xed:
+        cmd += ['--xed', args.xed]
+    stages.append(
+        Stage('xed',
+              cmd,
+              sources=[f'{tooldir}/add_xed_info.py'] + lib_sources,
+              tools=['llvm-mc', args.xed or 'xed']))
+
+    if args.inst_xml:
+        assert args.arch_name, '--arch-name is required by --inst-xml'
+        stages.append(
+            Stage('uops', [
+                sys.executable, f'{tooldir}/add_uops_uopsinfo.py',
+                '--inst-xml', args.inst_xml, '--arch-name', args.arch_name
+            ],
+                  inputs=[args.inst_xml],
+                  sources=[f'{tooldir}/add_uops_uopsinfo.py'] + lib_sources))
+
+    if args.intel_json:
+        tool = 'add_spr_uopsinfo.py' if args.target_cpu == 'sapphirerapids' \
+            else 'add_adl_p_uopsinfo.py'
+        stages.append(
+            Stage('intel', [
+                sys.executable, f'{tooldir}/{tool}', '--adl-p-json',
+                args.intel_json
+            ],
+                  inputs=[args.intel_json],
+                  sources=[f'{tooldir}/{tool}'] + lib_sources,
+                  tools=['llvm-mc']))
+
+    if args.ref_cpu:
+        stages.append(
+            Stage('smv', [
+                sys.executable, f'{tooldir}/add_smv_uopsinfo.py', '--ref-cpu',
+                args.ref_cpu, '--target-cpu', args.target_cpu
+            ],
+                  sources=[f'{tooldir}/add_smv_uopsinfo.py'] + lib_sources +
+                  python_sources('schedver/*.py'),
+                  tools=['llvm-smv']))
+
+    stages.append(
+        Stage('gen', [
+            sys.executable, f'{srcdir}/smg', 'gen', '--target-cpu',
+            args.target_cpu, '/dev/stdin'
+        ],
+              sources=[f'{srcdir}/smg'] + lib_sources +
+              python_sources('schedgen/*.py', 'schedver/*.py')))
+    return stages
+
+
+def run_pipeline(stages, cache_dir, force=()):
+    os.makedirs(cache_dir, exist_ok=True)
+    prev_output, prev_output_hash = None, None
+    for stage in stages:
+        output = f'{cache_dir}/{stage.name}.out'
+        meta_path = f'{cache_dir}/{stage.name}.json'
+        fingerprint = stage.fingerprint(prev_output_hash)
+        meta = {}
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                meta = json.load(f)
+
+        if (stage.name not in force and os.path.exists(output)
+                and meta.get('fingerprint') == fingerprint):
+            print(f'[{stage.name}] up to date', file=sys.stderr)
+        else:
+            print(f'[{stage.name}] running: {" ".join(stage.cmd)}',
+                  file=sys.stderr)
+            istream = open(prev_output) if prev_output else subprocess.DEVNULL
+            with open(f'{output}.tmp', 'w') as ostream:
+                subprocess.run(stage.cmd,
+                               check=True,
+                               stdin=istream,
+                               stdout=ostream)
+            if prev_output:
+                istream.close()
+            os.replace(f'{output}.tmp', output)
+
+            sha = hashlib.sha256()
+            hash_files(sha, [output])
+            meta = {'fingerprint': fingerprint, 'output_hash': sha.hexdigest()}
+            with open(meta_path, 'w') as f:
+                json.dump(meta, f, indent=2)
+        prev_output, prev_output_hash = output, meta['output_hash']
+    return prev_output
+
+
+if __name__ == '__main__':
+    args = parse_command_line()
+    cache_dir = os.path.abspath(args.cache_dir)
+    output = run_pipeline(get_stages(args, cache_dir), cache_dir, args.force)
+    if args.o == '-':
+        with open(output) as f:
+            shutil.copyfileobj(f, sys.stdout)
+    else:
+        shutil.copyfile(output, args.o)
@@ -1,11 +1,12 @@
 #!/usr/bin/env python3
 
-import argparse, json, sys, os, math
+import argparse, json, sys, os
 
 # Add parent dir to path.
 sys.path.append(f'{os.path.dirname(os.path.realpath(__file__))}/..')
 
-from lib import target, llvm_instr, info_parser
+from lib import target, info_parser
+from schedgen.schedgen import LLVMSchedGen
 
 
 def parse_command_line():
@@ -24,20 +25,7 @@ if __name__ == '__main__':
     target_cpu = target.get_target(args.target_cpu)
     llvm_instrs = info_parser.parse_llvm_instr_info(json.load(istream),
                                                     target_cpu)
-    ports_set = set()
-    for llvm_instr in llvm_instrs:
-        if (llvm_instr.has_uops_info()
-                and not llvm_instr.is_invalid(target_cpu)):
-            for uop in llvm_instr.uops_info.uops:
-                ports_set.add(uop.ports)
-    ports_groups = sorted(p for p in ports_set if len(p) > 1)
-    aligned_width = math.ceil(
-        (max(len(target_cpu.get_ports_name(p))
-             for p in ports_groups) + 1) / 2) * 2
-    for pg in ports_groups:
-        pg_name = target_cpu.get_ports_name(pg)
-        res = f'def {pg_name}' + ' ' * (aligned_width - len(pg_name))
-        p_names = [target_cpu.get_ports_name((p, )) for p in pg]
-        print(res + ': ProcResGroup<[' + ', '.join(p_names) + ']>;')
+    # Same groups smg gen emits, i.e. used by the model and not in template.
+    LLVMSchedGen(llvm_instrs, target_cpu).emit_proc_res_groups(sys.stdout)
 
     istream.close()